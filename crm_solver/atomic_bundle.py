@@ -0,0 +1,222 @@
+import os
+import json
+import warnings
+import numpy
+from utility import getdata
+
+
+class AtomicBundle:
+    '''''
+    Read-only, memory mapped view of a binary atomic data bundle. Arrays are stored under the relative data path
+    of the file they originate from, rate data additionally under the HDF5 dataset path, e.g.:
+    atomic_data/H/rates/default/rate_coeffs_60_H.h5/Einstein Coeffs
+    File layout: magic string, header length (uint64), JSON header, arrays aligned to ALIGNMENT bytes.
+    '''''
+    MAGIC = b'RENATEAB'
+    VERSION = 1
+    ALIGNMENT = 64
+    opened_bundles = {}
+
+    def __init__(self, bundle_path):
+        self.bundle_path = os.path.abspath(bundle_path)
+        self.__memmap = numpy.memmap(self.bundle_path, dtype=numpy.uint8, mode='r')
+        self.__read_header()
+        print('Atomic bundle opened from: ' + self.bundle_path)
+
+    def __read_header(self):
+        if bytes(self.__memmap[:len(self.MAGIC)]) != self.MAGIC:
+            raise ValueError('The file: ' + self.bundle_path + ' is not a RENATE-OD atomic bundle.')
+        header_start = len(self.MAGIC) + 8
+        header_length = int(self.__memmap[len(self.MAGIC):header_start].view('<u8')[0])
+        header = json.loads(bytes(self.__memmap[header_start:header_start + header_length]).decode('utf-8'))
+        if header['version'] != self.VERSION:
+            raise ValueError('Atomic bundle version ' + str(header['version']) + ' is not supported.')
+        self.index = header['arrays']
+
+    @classmethod
+    def open(cls, bundle_path):
+        if isinstance(bundle_path, AtomicBundle):
+            return bundle_path
+        bundle_path = os.path.abspath(bundle_path)
+        if bundle_path not in cls.opened_bundles:
+            cls.opened_bundles[bundle_path] = cls(bundle_path)
+        return cls.opened_bundles[bundle_path]
+
+    def __reduce__(self):
+        return AtomicBundle.open, (self.bundle_path,)
+
+    def keys(self):
+        return self.index.keys()
+
+    def get_array(self, name):
+        if name not in self.index:
+            raise KeyError('The atomic bundle: ' + self.bundle_path + ' does not contain: ' + name)
+        entry = self.index[name]
+        dtype = numpy.dtype(entry['dtype'])
+        size = int(numpy.prod(entry['shape'], dtype=numpy.int64)) * dtype.itemsize
+        return self.__memmap[entry['offset']:entry['offset'] + size].view(dtype).reshape(entry['shape'])
+
+    def get_rate_data(self, rates_path):
+        prefix = rates_path + '/'
+        rate_data = {name[len(prefix):]: self.get_array(name) for name in self.index if name.startswith(prefix)}
+        if not rate_data:
+            raise KeyError('The atomic bundle: ' + self.bundle_path + ' does not contain rates: ' + rates_path)
+        return rate_data
+
+    @classmethod
+    def write(cls, bundle_path, arrays):
+        arrays = {name: numpy.ascontiguousarray(array) for name, array in arrays.items()}
+        data_start, header = 0, b''
+        while cls.__align(len(cls.MAGIC) + 8 + len(header)) > data_start:
+            data_start = cls.__align(len(cls.MAGIC) + 8 + len(header))
+            index, data_end = cls.build_index(arrays, data_start)
+            header = json.dumps({'version': cls.VERSION, 'arrays': index}).encode('utf-8')
+        with open(bundle_path, 'wb') as bundle_file:
+            bundle_file.write(cls.MAGIC)
+            bundle_file.write(numpy.array(len(header), dtype='<u8').tobytes())
+            bundle_file.write(header)
+            for name, array in arrays.items():
+                bundle_file.write(b'\0' * (index[name]['offset'] - bundle_file.tell()))
+                bundle_file.write(array.astype(index[name]['dtype'], copy=False).tobytes())
+        cls.opened_bundles.pop(os.path.abspath(bundle_path), None)
+        print('Atomic bundle written to: ' + bundle_path)
+
+    @classmethod
+    def build_index(cls, arrays, data_start=0):
+        '''''
+        Little-endian dtype, shape and aligned offset of every array placed from data_start on.
+        Returns the index and the end of the data.
+        '''''
+        index, offset = {}, data_start
+        for name, array in arrays.items():
+            index[name] = {'dtype': array.dtype.newbyteorder('<').str, 'shape': list(array.shape), 'offset': offset}
+            offset = cls.__align(offset + array.nbytes)
+        return index, offset
+
+    @classmethod
+    def __align(cls, offset):
+        return -(-offset // cls.ALIGNMENT) * cls.ALIGNMENT
+
+
+class SharedAtomicBundle(AtomicBundle):
+    '''''
+    Atomic bundle held in a multiprocessing shared memory block, published once by the parent process and attached by
+    its worker processes as zero-copy, read-only views. Pickling transfers only the name and the index of the block,
+    which is attached once per process. The publishing process owns the block and unlinks it on close.
+    Requires multiprocessing.shared_memory (Python 3.8 or later), which is only imported when a block is published
+    or attached.
+    '''''
+    def __init__(self, memory, index, owner=False):
+        self.memory = memory
+        self.index = index
+        self.owner = owner
+        self.bundle_path = 'shared_memory:' + memory.name
+
+    @classmethod
+    def publish(cls, arrays):
+        from multiprocessing import shared_memory
+        arrays = {name: numpy.ascontiguousarray(array) for name, array in arrays.items()}
+        index, data_end = cls.build_index(arrays)
+        memory = shared_memory.SharedMemory(create=True, size=max(data_end, 1))
+        try:
+            for name, array in arrays.items():
+                offset = index[name]['offset']
+                memory.buf[offset:offset + array.nbytes] = array.astype(index[name]['dtype'], copy=False).tobytes()
+        except Exception:
+            memory.close()
+            memory.unlink()
+            raise
+        bundle = cls(memory, index, owner=True)
+        cls.opened_bundles[bundle.bundle_path] = bundle
+        print('Atomic bundle published to shared memory: ' + memory.name)
+        return bundle
+
+    @classmethod
+    def attach(cls, name, index):
+        from multiprocessing import shared_memory
+        bundle_path = 'shared_memory:' + name
+        if bundle_path not in cls.opened_bundles:
+            cls.opened_bundles[bundle_path] = cls(shared_memory.SharedMemory(name=name), index)
+        return cls.opened_bundles[bundle_path]
+
+    def __reduce__(self):
+        return SharedAtomicBundle.attach, (self.memory.name, self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_array(self, name):
+        if name not in self.index:
+            raise KeyError('The atomic bundle: ' + self.bundle_path + ' does not contain: ' + name)
+        entry = self.index[name]
+        # Arrays from frombuffer hold a buffer export, so the block cannot be unmapped while they are referenced.
+        array = numpy.frombuffer(self.memory.buf, dtype=entry['dtype'], count=int(numpy.prod(entry['shape'])),
+                                 offset=entry['offset']).reshape(entry['shape'])
+        array.flags.writeable = False
+        return array
+
+    def close(self):
+        '''''
+        Detaches the bundle from this process, evicts the atomic data cached from it and unlinks the shared memory
+        block in the publishing process. Arrays still referenced elsewhere, e.g. by the atomic databases of existing
+        beamlets, keep the mapping alive until they are released, which is warned about.
+        '''''
+        from crm_solver.atomic_db import RenateDB, atomic_db_cache
+        from crm_solver.neutral_db import NeutralDB
+        self.opened_bundles.pop(self.bundle_path, None)
+        atomic_db_cache.release_bundle(self.bundle_path)
+        RenateDB.release_bundle(self.bundle_path)
+        NeutralDB.release_bundle(self.bundle_path)
+        if self.owner:
+            self.memory.unlink()
+            self.owner = False
+        try:
+            self.memory.close()
+        except BufferError:
+            warnings.warn('Shared atomic bundle: ' + self.bundle_path + ' is still referenced, its memory is only '
+                          'released with the last reference.')
+
+
+def collect_atomic_data(species, energies, rate_types=('default',), neutral_targets=(), resolutions=()):
+    '''''
+    Reads the mass, the rate files of the given energies and rate types and the neutral cross-sections of the
+    given targets and resolutions of a beam species into arrays keyed by their atomic bundle names.
+    '''''
+    arrays = {}
+    mass_path = os.path.join('atomic_data', species, 'supplementary_data', 'default', species + '_m.txt')
+    arrays[mass_path] = numpy.asarray(getdata.GetData(data_path_name=mass_path, data_format='array').data,
+                                      dtype=float)
+    for rate_type in rate_types:
+        for energy in energies:
+            rates_path = os.path.join('atomic_data', species, 'rates', rate_type,
+                                      'rate_coeffs_' + str(energy) + '_' + species + '.h5')
+            for tag, data in getdata.GetData(data_path_name=rates_path, data_format='dict').data.items():
+                arrays[rates_path + '/' + tag] = data
+    for target in neutral_targets:
+        for resolved in resolutions:
+            for energy in energies:
+                cross_section_path = os.path.join('atomic_data', species, 'cross_sections', 'neutral', target + '_' +
+                                                  resolved + '_' + str(energy) + '.txt')
+                arrays[cross_section_path] = getdata.GetData(data_path_name=cross_section_path,
+                                                             data_format='array').data
+    return arrays
+
+
+def convert_to_atomic_bundle(bundle_path, species, energies, rate_types=('default',), neutral_targets=(),
+                             resolutions=()):
+    '''''
+    Packs the atomic data of a beam species, as collected by collect_atomic_data, into a single atomic bundle.
+    '''''
+    AtomicBundle.write(bundle_path, collect_atomic_data(species, energies, rate_types, neutral_targets, resolutions))
+    return AtomicBundle.open(bundle_path)
+
+
+def publish_atomic_data(species, energies, rate_types=('default',), neutral_targets=(), resolutions=()):
+    '''''
+    Publishes the atomic data of a beam species, as collected by collect_atomic_data, to shared memory.
+    '''''
+    return SharedAtomicBundle.publish(collect_atomic_data(species, energies, rate_types, neutral_targets,
+                                                          resolutions))
@@ -0,0 +1,156 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import warnings
+import numpy
+from crm_solver.atomic_bundle import AtomicBundle, SharedAtomicBundle, convert_to_atomic_bundle, publish_atomic_data
+from crm_solver.atomic_db import AtomicDB, RenateDB, atomic_db_cache
+from crm_solver.neutral_db import NeutralDB
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+from utility.input import AtomicInput
+
+
+class AtomicBundleTest(unittest.TestCase):
+    INPUT_ARRAYS = {'scalar': numpy.array(1.5),
+                    'vector': numpy.arange(5, dtype=numpy.int32),
+                    'tensor': numpy.linspace(0., 1., 24).reshape(2, 3, 4),
+                    'empty': numpy.zeros((0, 3))}
+    INPUT_SPECIES = 'H'
+    INPUT_ENERGIES = [50]
+    INPUT_NEUTRAL_TARGETS = ['H']
+    INPUT_RESOLUTIONS = ['bundled_n']
+    INPUT_q = [1, 0]
+    INPUT_z = [1, 1]
+    INPUT_a = [2, 1]
+    INPUT_m = [None, None]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bundle_path = os.path.join(self.directory, 'test.bundle')
+
+    def tearDown(self):
+        AtomicBundle.opened_bundles.clear()
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        AtomicBundle.write(self.bundle_path, self.INPUT_ARRAYS)
+        bundle = AtomicBundle.open(self.bundle_path)
+        self.assertSetEqual(set(bundle.keys()), set(self.INPUT_ARRAYS.keys()),
+                            msg='Atomic bundle is expected to contain all written arrays.')
+        for name, array in self.INPUT_ARRAYS.items():
+            self.assertEqual(bundle.get_array(name).dtype, array.dtype, msg='Array type changed for: ' + name)
+            numpy.testing.assert_array_equal(bundle.get_array(name), array, err_msg='Array changed for: ' + name)
+
+    def test_alignment(self):
+        AtomicBundle.write(self.bundle_path, self.INPUT_ARRAYS)
+        for entry in AtomicBundle.open(self.bundle_path).index.values():
+            self.assertEqual(entry['offset'] % AtomicBundle.ALIGNMENT, 0, msg='Arrays are expected to be aligned.')
+
+    def test_read_only(self):
+        AtomicBundle.write(self.bundle_path, self.INPUT_ARRAYS)
+        with self.assertRaises(ValueError):
+            AtomicBundle.open(self.bundle_path).get_array('tensor')[0, 0, 0] = 1.
+
+    def test_shared_bundle(self):
+        AtomicBundle.write(self.bundle_path, self.INPUT_ARRAYS)
+        bundle = AtomicBundle.open(self.bundle_path)
+        self.assertIs(bundle, AtomicBundle.open(self.bundle_path), msg='Opened bundles are expected to be reused.')
+        self.assertIs(bundle, AtomicBundle.open(bundle), msg='Opening an opened bundle is expected to return it.')
+        self.assertIs(bundle, pickle.loads(pickle.dumps(bundle)),
+                      msg='Pickled bundles are expected to be reopened from their path.')
+
+    def test_missing_array(self):
+        AtomicBundle.write(self.bundle_path, self.INPUT_ARRAYS)
+        with self.assertRaises(KeyError):
+            AtomicBundle.open(self.bundle_path).get_array('missing')
+
+    def test_invalid_file(self):
+        with open(self.bundle_path, 'wb') as bundle_file:
+            bundle_file.write(b'NOTABUNDLE' * 4)
+        with self.assertRaises(ValueError):
+            AtomicBundle.open(self.bundle_path)
+
+    def test_atomic_db_from_bundle(self):
+        convert_to_atomic_bundle(self.bundle_path, self.INPUT_SPECIES, self.INPUT_ENERGIES,
+                                 neutral_targets=self.INPUT_NEUTRAL_TARGETS, resolutions=self.INPUT_RESOLUTIONS)
+        param, components = self.build_atomic_input()
+        reference_db = AtomicDB(param=param, components=components)
+        bundled_db = AtomicDB(param=param, components=components, bundle=self.bundle_path)
+        self.assertEqual(bundled_db.mass, reference_db.mass, msg='Projectile mass differs when read from bundle.')
+        numpy.testing.assert_array_equal(bundled_db.spontaneous_trans, reference_db.spontaneous_trans,
+                                         err_msg='Spontaneous transitions differ when read from bundle.')
+        numpy.testing.assert_array_equal(bundled_db.electron_impact_trans_table.rates,
+                                         reference_db.electron_impact_trans_table.rates,
+                                         err_msg='Electron impact transitions differ when read from bundle.')
+        numpy.testing.assert_array_equal(bundled_db.ion_impact_loss_tables[0].rates,
+                                         reference_db.ion_impact_loss_tables[0].rates,
+                                         err_msg='Ion impact loss differs when read from bundle.')
+        numpy.testing.assert_array_equal(bundled_db.neutral_db.neutral_cross_sections['neutral1'],
+                                         reference_db.neutral_db.neutral_cross_sections['neutral1'],
+                                         err_msg='Neutral cross-sections differ when read from bundle.')
+
+    @unittest.skipIf(shared_memory is None, 'Shared memory requires Python 3.8 or later.')
+    def test_shared_memory_bundle(self):
+        with SharedAtomicBundle.publish(self.INPUT_ARRAYS) as bundle:
+            name = bundle.memory.name
+            for array_name, array in self.INPUT_ARRAYS.items():
+                self.assertEqual(bundle.get_array(array_name).dtype, array.dtype,
+                                 msg='Array type changed for: ' + array_name)
+                numpy.testing.assert_array_equal(bundle.get_array(array_name), array,
+                                                 err_msg='Array changed for: ' + array_name)
+            with self.assertRaises(ValueError):
+                bundle.get_array('tensor')[0, 0, 0] = 1.
+            self.assertIs(pickle.loads(pickle.dumps(bundle)), bundle,
+                          msg='Shared bundles are expected to be attached once per process.')
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+    @unittest.skipIf(shared_memory is None, 'Shared memory requires Python 3.8 or later.')
+    def test_referenced_shared_bundle(self):
+        bundle = SharedAtomicBundle.publish(self.INPUT_ARRAYS)
+        array = bundle.get_array('tensor')[1]
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            bundle.close()
+        self.assertEqual(len(caught), 1, msg='Closing a still referenced shared bundle is expected to warn.')
+        numpy.testing.assert_array_equal(array, self.INPUT_ARRAYS['tensor'][1],
+                                         err_msg='Referenced arrays are expected to stay readable after close.')
+        del array
+        bundle.memory.close()
+
+    @unittest.skipIf(shared_memory is None, 'Shared memory requires Python 3.8 or later.')
+    def test_atomic_db_from_shared_bundle(self):
+        bundle = publish_atomic_data(self.INPUT_SPECIES, self.INPUT_ENERGIES,
+                                     neutral_targets=self.INPUT_NEUTRAL_TARGETS, resolutions=self.INPUT_RESOLUTIONS)
+        param, components = self.build_atomic_input()
+        reference_db = AtomicDB(param=param, components=components)
+        shared_db = atomic_db_cache.get_atomic_db(param=param, components=components, bundle=bundle)
+        numpy.testing.assert_array_equal(shared_db.electron_impact_loss_table.rates,
+                                         reference_db.electron_impact_loss_table.rates,
+                                         err_msg='Electron impact loss differs when read from shared memory.')
+        numpy.testing.assert_array_equal(shared_db.neutral_db.neutral_impact_trans,
+                                         reference_db.neutral_db.neutral_impact_trans,
+                                         err_msg='Neutral cross-sections differ when read from shared memory.')
+        RenateDB.get_rate_stack(self.INPUT_SPECIES, 'default', self.INPUT_ENERGIES, bundle)
+        del shared_db
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            bundle.close()
+        self.assertListEqual(caught, [], msg='Closing is expected to release all atomic data cached from the bundle.')
+        self.assertFalse(any(key[3] == bundle.bundle_path for key in RenateDB.rate_stacks))
+        self.assertFalse(any(key[1] == bundle.bundle_path for key in NeutralDB.loaded_cross_sections))
+        self.assertNotIn(bundle.bundle_path, SharedAtomicBundle.opened_bundles)
+
+    def build_atomic_input(self):
+        input_gen = AtomicInput(energy=self.INPUT_ENERGIES[0], projectile=self.INPUT_SPECIES,
+                                param_name='AtomicBundle_test', source='Unittest', current=0.001)
+        input_gen.add_target_component(charge=-1, atomic_number=0, mass_number=0, molecule_name=None)
+        for index in range(len(self.INPUT_q)):
+            input_gen.add_target_component(charge=self.INPUT_q[index], atomic_number=self.INPUT_z[index],
+                                           mass_number=self.INPUT_a[index], molecule_name=self.INPUT_m[index])
+        return input_gen.get_atomic_db_input()
@@ -1,5 +1,7 @@
 import os
 import numpy
+from copy import deepcopy
+from collections import OrderedDict
 from lxml import etree
 from utility import getdata
 import utility.convert as uc
@@ -7,11 +9,57 @@ from scipy.interpolate import interp1d
 import matplotlib.pyplot as plt
 import pandas
 from crm_solver.neutral_db import NeutralDB
+from crm_solver.atomic_bundle import AtomicBundle
+
+
+class RateTable:
+    '''''
+    Array backed piecewise linear rate table, evaluated for all transitions in a single call. Out of range temperatures
+    are linearly extrapolated from the outermost segments, identically to interp1d(fill_value='extrapolate').
+    Indexing convention: rates[..., temperature]
+    '''''
+    def __init__(self, temperature_axis, rates):
+        self.temperature_axis = numpy.asarray(temperature_axis, dtype=float)
+        self.rates = numpy.array(rates, dtype=float)
+        if self.temperature_axis.ndim != 1 or self.temperature_axis.size < 2:
+            raise ValueError('The temperature axis of a rate table is expected to be 1D with at least two points.')
+        if self.rates.shape[-1] != self.temperature_axis.size:
+            raise ValueError('The last axis of the rate table is expected to match the temperature axis.')
+        self.slopes = numpy.diff(self.rates, axis=-1) / numpy.diff(self.temperature_axis)
+        self.rates.flags.writeable = False
+        self.slopes.flags.writeable = False
+
+    def evaluate(self, temperatures):
+        temperatures = numpy.asarray(temperatures, dtype=float)
+        lower = self.__get_segments(temperatures)
+        return self.slopes[..., lower] * (temperatures - self.temperature_axis[lower]) + self.rates[..., lower]
+
+    def evaluate_derivative(self, temperatures):
+        '''''
+        Temperature derivative of the rates, i.e. the slope of the segment used by evaluate.
+        '''''
+        return self.slopes[..., self.__get_segments(numpy.asarray(temperatures, dtype=float))]
+
+    def __get_segments(self, temperatures):
+        return numpy.clip(numpy.searchsorted(self.temperature_axis, temperatures), 1,
+                          self.temperature_axis.size - 1) - 1
 
 
 class RenateDB:
-    def __init__(self, param, rate_type, data_path):
+    RATE_DATA_TAGS = {'electron_transition': 'Collisional Coeffs/Electron Neutral Collisions',
+                      'ion_transition': 'Collisional Coeffs/Proton Neutral Collisions',
+                      'impurity_transition': 'Collisional Coeffs/Impurity Neutral Collisions',
+                      'ionization_terms': 'Collisional Coeffs/Electron Loss Collisions',
+                      'spontaneous_transition': 'Einstein Coeffs',
+                      'temperature': 'Temperature axis'}
+
+    RATE_STACK_CACHE_SIZE = 4
+    rate_stacks = OrderedDict()
+
+    def __init__(self, param, rate_type, data_path, energy_grid=None, bundle=None):
         self.param = param
+        self.energy_grid = energy_grid
+        self.bundle = None if bundle is None else AtomicBundle.open(bundle)
         if not isinstance(self.param, etree._ElementTree):
             self.param = getdata.GetData(data_path_name=data_path).data
         assert isinstance(self.param, etree._ElementTree)
@@ -19,6 +67,7 @@ class RenateDB:
         self.__projectile_parameters()
         self.__set_atomic_dictionary()
         self.__set_rates_path(rate_type)
+        self.__load_rate_bundle()
         self.__set_charge_state_lib()
 
     def __set_impurity_mass_scaling_dictionary(self):
@@ -44,7 +93,10 @@ class RenateDB:
         data_path_name = os.path.join('atomic_data', self.param.getroot().find('body').find('beamlet_species').text,
                                       'supplementary_data', 'default', self.param.getroot().
                                       find('body').find('beamlet_species').text + '_m.txt')
-        mass_str = getdata.GetData(data_path_name=data_path_name, data_format="array").data
+        if self.bundle is None:
+            mass_str = getdata.GetData(data_path_name=data_path_name, data_format="array").data
+        else:
+            mass_str = self.bundle.get_array(data_path_name)
         try:
             self.mass = float(mass_str)
         except ValueError:
@@ -77,6 +129,66 @@ class RenateDB:
         self.file_name = 'rate_coeffs_' + str(self.energy) + '_' + self.species + '.h5'
         self.rates_path = os.path.join('atomic_data', self.species, 'rates', rate_type, self.file_name)
 
+    def __load_rate_bundle(self):
+        if self.energy_grid is None and self.bundle is None:
+            self.rate_data = self.load_rate_bundle(self.rates_path)
+        elif self.energy_grid is None:
+            self.rate_data = self.bundle.get_rate_data(self.rates_path)
+        else:
+            self.__interpolate_rate_bundle()
+
+    def __interpolate_rate_bundle(self):
+        '''''
+        Linear interpolation of all rate data in beam energy between the two neighbouring tabulated energies.
+        Stacked rate data indexing convention: data[energy, ...]
+        '''''
+        energies = numpy.asarray([float(energy) for energy in self.energy_grid])
+        if energies.size < 2 or numpy.any(numpy.diff(energies) <= 0):
+            raise ValueError('The energy grid is expected to contain at least two strictly increasing energies.')
+        energy = float(self.energy)
+        if not energies[0] <= energy <= energies[-1]:
+            raise ValueError('The beam energy: ' + str(self.energy) + ' keV is outside of the tabulated energy range '
+                             + str(energies[0]) + ' - ' + str(energies[-1]) + ' keV.')
+        rate_stack = self.get_rate_stack(self.species, self.rate_type, self.energy_grid, self.bundle)
+        upper = min(max(int(numpy.searchsorted(energies, energy)), 1), energies.size - 1)
+        weight = (energy - energies[upper - 1]) / (energies[upper] - energies[upper - 1])
+        self.rate_data = {tag: (1. - weight) * data[upper - 1] + weight * data[upper]
+                          for tag, data in rate_stack.items()}
+
+    @classmethod
+    def get_rate_stack(cls, species, rate_type, energy_grid, atomic_bundle=None):
+        '''''
+        Rate data of an energy grid stacked along energy. The stacks of the RATE_STACK_CACHE_SIZE most recently used
+        energy grids are kept.
+        '''''
+        key = (species, rate_type, tuple(str(energy) for energy in energy_grid),
+               None if atomic_bundle is None else atomic_bundle.bundle_path)
+        if key in cls.rate_stacks:
+            cls.rate_stacks.move_to_end(key)
+        else:
+            rates_paths = [os.path.join('atomic_data', species, 'rates', rate_type, 'rate_coeffs_' + str(energy) +
+                                        '_' + species + '.h5') for energy in energy_grid]
+            if atomic_bundle is None:
+                bundles = [cls.load_rate_bundle(rates_path) for rates_path in rates_paths]
+            else:
+                bundles = [atomic_bundle.get_rate_data(rates_path) for rates_path in rates_paths]
+            for bundle in bundles[1:]:
+                if not numpy.array_equal(bundle[cls.RATE_DATA_TAGS['temperature']],
+                                         bundles[0][cls.RATE_DATA_TAGS['temperature']]):
+                    raise ValueError('Rate files on the energy grid are expected to share the same temperature axis.')
+            cls.rate_stacks[key] = {tag: numpy.stack([bundle[tag] for bundle in bundles]) for tag in bundles[0]}
+            if len(cls.rate_stacks) > cls.RATE_STACK_CACHE_SIZE:
+                cls.rate_stacks.popitem(last=False)
+        return cls.rate_stacks[key]
+
+    @classmethod
+    def release_bundle(cls, bundle_path):
+        '''''
+        Evicts the rate stacks read from the atomic bundle of the given path.
+        '''''
+        for key in [key for key in cls.rate_stacks if key[3] == bundle_path]:
+            del cls.rate_stacks[key]
+
     def __set_charge_state_lib(self):
         impact_loss = self.get_from_renate_atomic('ionization_terms')
         self.charged_states = []
@@ -85,8 +197,8 @@ class RenateDB:
         self.charged_states = tuple(self.charged_states)
 
     @staticmethod
-    def load_rate_data(path, tag_name):
-        return getdata.GetData(data_path_name=path, data_key=[tag_name], data_format='array').data
+    def load_rate_bundle(path):
+        return getdata.GetData(data_path_name=path, data_format='dict').data
 
     def set_default_atomic_levels(self):
         if self.species in ['H', 'D', 'T']:
@@ -102,40 +214,31 @@ class RenateDB:
 
     def get_from_renate_atomic(self, source):
         assert isinstance(source, str)
-        if source == 'electron_transition':
-            return self.load_rate_data(self.rates_path, 'Collisional Coeffs/Electron Neutral Collisions')
-        elif source == 'ion_transition':
-            return self.load_rate_data(self.rates_path, 'Collisional Coeffs/Proton Neutral Collisions')
-        elif source == 'impurity_transition':
-            return self.load_rate_data(self.rates_path, 'Collisional Coeffs/Impurity Neutral Collisions')
-        elif source == 'ionization_terms':
-            return self.load_rate_data(self.rates_path, 'Collisional Coeffs/Electron Loss Collisions')
-        elif source == 'spontaneous_transition':
-            return self.load_rate_data(self.rates_path, 'Einstein Coeffs')
-        elif source == 'temperature':
-            return self.load_rate_data(self.rates_path, 'Temperature axis')
+        if source in self.RATE_DATA_TAGS:
+            return self.rate_data[self.RATE_DATA_TAGS[source]]
         else:
             raise ValueError('Data ' + source + ' is not located and supported in the Renate rate library.')
 
 
 class AtomicDB(RenateDB):
     def __init__(self, atomic_source='renate', param=None, rate_type='default', resolution=None,
-                 data_path='beamlet/testimp0001.xml', components=None, atomic_ceiling=False):
+                 data_path='beamlet/testimp0001.xml', components=None, atomic_ceiling=False, energy_grid=None,
+                 bundle=None):
         assert isinstance(atomic_source, str)
         assert isinstance(components, pandas.core.frame.DataFrame)
         self.components = components
-        self.__set_neutral_db(param=param, resolution=resolution)
+        self.__set_neutral_db(param=param, resolution=resolution, bundle=bundle)
         if atomic_source == 'renate':
-            RenateDB.__init__(self, param, rate_type, data_path)
+            RenateDB.__init__(self, param, rate_type, data_path, energy_grid, bundle)
             self.__set_ceiling_for_atomic_levels(atomic_ceiling=atomic_ceiling)
             self.__generate_rate_function_db()
         else:
             raise ValueError('Currently the requested atomic DB: ' + atomic_source + ' is not supported')
 
-    def __set_neutral_db(self, param, resolution):
+    def __set_neutral_db(self, param, resolution, bundle):
         if (self.components['q'] == 0).any():
             self.are_neutrals = True
-            self.neutral_db = NeutralDB(param=param, resolved=resolution, components=self.components)
+            self.neutral_db = NeutralDB(param=param, resolved=resolution, components=self.components, bundle=bundle)
         else:
             self.are_neutrals = False
 
@@ -163,11 +266,17 @@ class AtomicDB(RenateDB):
                 self.atomic_ceiling = atomic_ceiling
 
     def __generate_rate_function_db(self):
+        '''''
+        Rate tables and interpolator functions are materialized on first access only, sliced to the atomic ceiling
+        and to the charge states present among the plasma components.
+        '''''
         self.__set_temperature_axis()
         self.__set_einstein_coefficient_db()
-        self.__set_impact_loss_functions()
-        self.__set_electron_impact_transition_functions()
-        self.__set_ion_impact_transition_functions()
+        self.__set_plasma_ions()
+        self.__electron_impact_loss_table, self.__ion_impact_loss_tables = None, None
+        self.__electron_impact_trans_table, self.__ion_impact_trans_tables = None, None
+        self.__electron_impact_loss, self.__ion_impact_loss = None, None
+        self.__electron_impact_trans, self.__ion_impact_trans = None, None
 
     def __set_temperature_axis(self):
         self.temperature_axis = self.get_from_renate_atomic('temperature')
@@ -181,67 +290,123 @@ class AtomicDB(RenateDB):
         if self.atomic_levels != int(self.spontaneous_trans.size ** 0.5):
             raise Exception('Loaded atomic database is inconsistent with atomic data dictionary. Wrong data loaded.')
 
-    def __set_impact_loss_functions(self):
+    def __set_plasma_ions(self):
+        self.plasma_ions = tuple(target for target in self.components.T.keys() if self.components['q'][target] > 0)
+
+    @property
+    def electron_impact_loss_table(self):
+        '''''
+        Contains electron impact electron loss data for loaded atomic type.
+        Indexing convention: data[from_level, T]
+        '''''
+        if self.__electron_impact_loss_table is None:
+            self.__electron_impact_loss_table = RateTable(self.temperature_axis, uc.convert_from_cm2_to_m2(
+                self.get_from_renate_atomic('ionization_terms')[0, :self.atomic_ceiling, :]))
+        return self.__electron_impact_loss_table
+
+    @property
+    def ion_impact_loss_tables(self):
         '''''
         Contains beam atom impact ionization (ion + charge exchange) data for loaded atomic type.
-        Indexing convention: data[from_level][target] for ion impact electron loss interaction.
-        Indexing convention: data[from_level] for electron impact electron loss interactions. 
+        Indexing convention: data[ion][from_level, T]
         '''''
-        raw_impact_loss_transition = self.get_from_renate_atomic('ionization_terms')
-        self.electron_impact_loss, self.ion_impact_loss = [], []
-        for from_level in range(self.atomic_ceiling):
-            from_level_functions = []
-            self.electron_impact_loss.append(interp1d(self.temperature_axis, uc.convert_from_cm2_to_m2(
-                raw_impact_loss_transition[0, from_level, :]), fill_value='extrapolate'))
-            for target in self.components.T.keys():
-                if not (target != 'electron') ^ (not('neutral' in target)):
-                    from_level_functions.append(self.__interp1d_scaled_ion(uc.convert_from_cm2_to_m2(
-                        raw_impact_loss_transition[self.components['q'][target], from_level, :]), target))
-            self.ion_impact_loss.append(tuple(from_level_functions))
-        self.electron_impact_loss, self.ion_impact_loss = tuple(self.electron_impact_loss), tuple(self.ion_impact_loss)
-
-    def __set_electron_impact_transition_functions(self):
+        if self.__ion_impact_loss_tables is None:
+            raw_impact_loss_transition = self.get_from_renate_atomic('ionization_terms')
+            self.__ion_impact_loss_tables = tuple(RateTable(self.__get_scaled_ion_temperature_axis(target),
+                                                            uc.convert_from_cm2_to_m2(raw_impact_loss_transition[
+                                                                self.components['q'][target], :self.atomic_ceiling,
+                                                                :])) for target in self.plasma_ions)
+        return self.__ion_impact_loss_tables
+
+    @property
+    def electron_impact_trans_table(self):
         '''''
         Contains electron impact transition data for loaded atomic type.
+        Indexing convention: data[from_level, to_level, T]
+        '''''
+        if self.__electron_impact_trans_table is None:
+            self.__electron_impact_trans_table = RateTable(self.temperature_axis, uc.convert_from_cm2_to_m2(
+                self.get_from_renate_atomic('electron_transition')[:self.atomic_ceiling, :self.atomic_ceiling, :]))
+        return self.__electron_impact_trans_table
+
+    @property
+    def ion_impact_trans_tables(self):
+        '''''
+        Contains ion impact transition data for loaded atomic type. The impurity transition data is only accessed for
+        charge states present in the plasma.
+        Indexing convention: data[ion][from_level, to_level, T]
+        '''''
+        if self.__ion_impact_trans_tables is None:
+            ion_tables = []
+            for target in self.plasma_ions:
+                if self.components['q'][target] == 1:
+                    raw_rates = self.get_from_renate_atomic('ion_transition')[:self.atomic_ceiling,
+                                                                              :self.atomic_ceiling, :]
+                else:
+                    raw_rates = self.get_from_renate_atomic('impurity_transition')[
+                        self.components['q'][target]-2, :self.atomic_ceiling, :self.atomic_ceiling, :]
+                ion_tables.append(RateTable(self.__get_scaled_ion_temperature_axis(target),
+                                            uc.convert_from_cm2_to_m2(raw_rates)))
+            self.__ion_impact_trans_tables = tuple(ion_tables)
+        return self.__ion_impact_trans_tables
+
+    @property
+    def electron_impact_loss(self):
+        '''''
+        Interpolator functions of the electron impact loss table.
+        Indexing convention: data[from_level]
+        '''''
+        if self.__electron_impact_loss is None:
+            self.__electron_impact_loss = self.__get_interp1d_functions(self.electron_impact_loss_table)
+        return self.__electron_impact_loss
+
+    @property
+    def ion_impact_loss(self):
+        '''''
+        Interpolator functions of the ion impact loss tables.
+        Indexing convention: data[from_level][target]
+        '''''
+        if self.__ion_impact_loss is None:
+            functions = [self.__get_interp1d_functions(table) for table in self.ion_impact_loss_tables]
+            self.__ion_impact_loss = tuple(tuple(ion[from_level] for ion in functions)
+                                           for from_level in range(self.atomic_ceiling))
+        return self.__ion_impact_loss
+
+    @property
+    def electron_impact_trans(self):
+        '''''
+        Interpolator functions of the electron impact transition table.
         Indexing convention: data[from_level][to_level]
         '''''
-        raw_electron_transition = self.get_from_renate_atomic('electron_transition')
-        self.electron_impact_trans = []
-        for from_level in range(self.atomic_ceiling):
-            from_level_functions = []
-            for to_level in range(self.atomic_ceiling):
-                from_level_functions.append(interp1d(self.temperature_axis, uc.convert_from_cm2_to_m2(
-                    raw_electron_transition[from_level, to_level, :]), fill_value='extrapolate'))
-            self.electron_impact_trans.append(tuple(from_level_functions))
-        self.electron_impact_trans = tuple(self.electron_impact_trans)
-
-    def __set_ion_impact_transition_functions(self):
+        if self.__electron_impact_trans is None:
+            self.__electron_impact_trans = self.__get_interp1d_functions(self.electron_impact_trans_table)
+        return self.__electron_impact_trans
+
+    @property
+    def ion_impact_trans(self):
         '''''
-        Contains spontanous transition data for loaded atomic type.
-        Indexing convention: data[from_level, to_level, target]
+        Interpolator functions of the ion impact transition tables.
+        Indexing convention: data[from_level][to_level][target]
         '''''
-        raw_proton_transition = self.get_from_renate_atomic('ion_transition')
-        raw_impurity_transition = self.get_from_renate_atomic('impurity_transition')
-        self.ion_impact_trans = []
-        for from_level in range(self.atomic_ceiling):
-            from_level_functions = []
-            for to_level in range(self.atomic_ceiling):
-                to_level_functions = []
-                for target in self.components.T.keys():
-                    if self.components['q'][target] == 1:
-                        to_level_functions.append(self.__interp1d_scaled_ion(uc.convert_from_cm2_to_m2(
-                            raw_proton_transition[from_level, to_level, :]), target))
-                    elif self.components['q'][target] > 1:
-                        to_level_functions.append(self.__interp1d_scaled_ion(uc.convert_from_cm2_to_m2(
-                            raw_impurity_transition[self.components['q'][target]-2, from_level, to_level, :]), target))
-                from_level_functions.append(tuple(to_level_functions))
-            self.ion_impact_trans.append(tuple(from_level_functions))
-        self.ion_impact_trans = tuple(self.ion_impact_trans)
-
-    def __interp1d_scaled_ion(self, rates, target):
+        if self.__ion_impact_trans is None:
+            functions = [self.__get_interp1d_functions(table) for table in self.ion_impact_trans_tables]
+            self.__ion_impact_trans = tuple(tuple(tuple(ion[from_level][to_level] for ion in functions)
+                                                  for to_level in range(self.atomic_ceiling))
+                                            for from_level in range(self.atomic_ceiling))
+        return self.__ion_impact_trans
+
+    @staticmethod
+    def __get_interp1d_functions(rate_table):
+        if rate_table.rates.ndim == 2:
+            return tuple(interp1d(rate_table.temperature_axis, rates, fill_value='extrapolate')
+                         for rates in rate_table.rates)
+        return tuple(AtomicDB.__get_interp1d_functions(RateTable(rate_table.temperature_axis, rates))
+                     for rates in rate_table.rates)
+
+    def __get_scaled_ion_temperature_axis(self, target):
         scaling_mass_ratio = float(self.components['A'][target]) /\
                              self.impurity_mass_normalization['charge-'+str(self.components['q'][target])]
-        return interp1d(self.temperature_axis*scaling_mass_ratio, rates, fill_value='extrapolate')
+        return self.temperature_axis*scaling_mass_ratio
 
     def plot_rates(self, *args, temperature=None, external_density=1.):
         if temperature is None:
@@ -309,3 +474,84 @@ class AtomicDB(RenateDB):
         plt.xscale('log')
         plt.legend()
         plt.show()
+
+
+class AtomicDBCache:
+    '''''
+    Process wide memoizing factory for AtomicDB instances with least recently used eviction. Cached databases are
+    shared between callers and are therefore made read-only, and built from private copies of the beamlet
+    parameters and plasma components, so later changes of the caller's inputs do not reach other beamlets.
+    Key: (species, energy, rate_type, atomic_ceiling, resolution, energy_grid, bundle path, components signature)
+    '''''
+    COMPONENT_SIGNATURE = ('q', 'Z', 'A', 'Molecule')
+
+    def __init__(self, maxsize=8):
+        if not isinstance(maxsize, int) or maxsize < 1:
+            raise ValueError('The AtomicDB cache size is expected to be a positive integer.')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__atomic_dbs = OrderedDict()
+
+    def get_atomic_db(self, param=None, components=None, rate_type='default', resolution=None,
+                      data_path='beamlet/testimp0001.xml', atomic_ceiling=False, energy_grid=None, bundle=None):
+        if not isinstance(param, etree._ElementTree):
+            param = getdata.GetData(data_path_name=data_path).data
+        assert isinstance(components, pandas.core.frame.DataFrame)
+        if bundle is not None:
+            bundle = AtomicBundle.open(bundle)
+        key = self.get_key(param, components, rate_type, resolution, atomic_ceiling, energy_grid, bundle)
+        if key in self.__atomic_dbs:
+            self.hits += 1
+            self.__atomic_dbs.move_to_end(key)
+            return self.__atomic_dbs[key]
+        self.misses += 1
+        atomic_db = AtomicDB(param=deepcopy(param), rate_type=rate_type, resolution=resolution,
+                             components=components.copy(deep=True), atomic_ceiling=atomic_ceiling,
+                             energy_grid=energy_grid, bundle=bundle)
+        self.__set_read_only(atomic_db)
+        self.__atomic_dbs[key] = atomic_db
+        if len(self.__atomic_dbs) > self.maxsize:
+            self.__atomic_dbs.popitem(last=False)
+        return atomic_db
+
+    def get_key(self, param, components, rate_type, resolution, atomic_ceiling, energy_grid=None, bundle=None):
+        body = param.getroot().find('body')
+        signature = tuple((str(name),) + tuple(str(components[column][name]) for column in self.COMPONENT_SIGNATURE
+                                               if column in components.columns) for name in components.index)
+        if energy_grid is not None:
+            energy_grid = tuple(str(energy) for energy in energy_grid)
+        bundle_path = None if bundle is None else bundle.bundle_path
+        return body.find('beamlet_species').text, body.find('beamlet_energy').text, rate_type, atomic_ceiling, \
+            resolution, energy_grid, bundle_path, signature
+
+    def release_bundle(self, bundle_path):
+        '''''
+        Evicts the databases built from the atomic bundle of the given path.
+        '''''
+        for key in [key for key in self.__atomic_dbs if key[6] == bundle_path]:
+            del self.__atomic_dbs[key]
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.__atomic_dbs), 'maxsize': self.maxsize}
+
+    def clear(self):
+        self.__atomic_dbs.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __set_read_only(self, data):
+        if isinstance(data, numpy.ndarray):
+            data.flags.writeable = False
+        elif isinstance(data, (tuple, list)):
+            for element in data:
+                self.__set_read_only(element)
+        elif isinstance(data, dict):
+            for element in data.values():
+                self.__set_read_only(element)
+        elif isinstance(data, (AtomicDB, NeutralDB, RateTable)):
+            for element in vars(data).values():
+                self.__set_read_only(element)
+
+
+atomic_db_cache = AtomicDBCache()
@@ -1,5 +1,7 @@
 from crm_solver.atomic_db import AtomicDB
 from crm_solver.atomic_db import RenateDB
+from crm_solver.atomic_db import RateTable
+from crm_solver.atomic_db import AtomicDBCache
 from crm_solver.neutral_db import NeutralDB
 from utility.input import AtomicInput
 import unittest
@@ -117,6 +119,17 @@ class RenateDBTest(unittest.TestCase):
             self.assertIsInstance(data, numpy.ndarray, msg='Data type to be returned by getter function is'
                                                            ' expected to be of type numpy ndarray.')
 
+    def test_rate_bundle(self):
+        self.assertIsInstance(self.renate_db.rate_data, dict, msg='Rate data bundle is expected to be a dictionary.')
+        for source, tag in RenateDB.RATE_DATA_TAGS.items():
+            self.assertIn(tag, self.renate_db.rate_data, msg='Rate data bundle is missing tag: ' + tag)
+            self.assertIs(self.renate_db.get_from_renate_atomic(source), self.renate_db.rate_data[tag],
+                          msg='Getter function is expected to serve data from the loaded rate bundle.')
+
+    def test_unsupported_atomic_data(self):
+        with self.assertRaises(ValueError):
+            self.renate_db.get_from_renate_atomic('unsupported')
+
     def test_charged_state_library(self):
         self.assertIsInstance(self.renate_db.charged_states, tuple, msg='Data structure containing availability for '
                               'rates in various charged states is of type tuple.')
@@ -170,6 +183,65 @@ class RenateDBTest(unittest.TestCase):
                                                                             'with atomic physics specifications.')
 
 
+class RenateDBEnergyInterpolationTest(unittest.TestCase):
+    INPUT_SPECIES = 'H'
+    INPUT_ENERGY_GRID = [40, 50, 60]
+    INPUT_ENERGY = 55
+    INPUT_WEIGHT = 0.5
+    INPUT_TABULATED_ENERGY = 50
+    INPUT_OUTLYING_ENERGY = 70
+
+    def test_interpolated_rates(self):
+        interpolated_db = RenateDB(self.build_param(self.INPUT_ENERGY), 'default', None,
+                                   energy_grid=self.INPUT_ENERGY_GRID)
+        lower_db = RenateDB(self.build_param(50), 'default', None)
+        upper_db = RenateDB(self.build_param(60), 'default', None)
+        for source in RenateDB.RATE_DATA_TAGS.keys():
+            numpy.testing.assert_allclose(interpolated_db.get_from_renate_atomic(source),
+                                          (1. - self.INPUT_WEIGHT) * lower_db.get_from_renate_atomic(source) +
+                                          self.INPUT_WEIGHT * upper_db.get_from_renate_atomic(source),
+                                          err_msg='Energy interpolation of ' + source + ' rate data failed.')
+
+    def test_tabulated_energy(self):
+        interpolated_db = RenateDB(self.build_param(self.INPUT_TABULATED_ENERGY), 'default', None,
+                                   energy_grid=self.INPUT_ENERGY_GRID)
+        tabulated_db = RenateDB(self.build_param(self.INPUT_TABULATED_ENERGY), 'default', None)
+        for source in RenateDB.RATE_DATA_TAGS.keys():
+            numpy.testing.assert_array_equal(interpolated_db.get_from_renate_atomic(source),
+                                             tabulated_db.get_from_renate_atomic(source),
+                                             err_msg='Rate data at tabulated energy expected to be reproduced.')
+
+    def test_cached_rate_stack(self):
+        RenateDB(self.build_param(self.INPUT_ENERGY), 'default', None, energy_grid=self.INPUT_ENERGY_GRID)
+        rate_stack = RenateDB.get_rate_stack(self.INPUT_SPECIES, 'default', self.INPUT_ENERGY_GRID)
+        self.assertIs(rate_stack, RenateDB.get_rate_stack(self.INPUT_SPECIES, 'default', self.INPUT_ENERGY_GRID),
+                      msg='Rate stack of an energy grid is expected to be loaded once.')
+        self.assertEqual(rate_stack[RenateDB.RATE_DATA_TAGS['electron_transition']].shape[0],
+                         len(self.INPUT_ENERGY_GRID), msg='Rate data is expected to be stacked along energy.')
+
+    def test_bounded_rate_stacks(self):
+        for start in range(RenateDB.RATE_STACK_CACHE_SIZE + 1):
+            RenateDB.get_rate_stack(self.INPUT_SPECIES, 'default', self.INPUT_ENERGY_GRID[:2] * (start + 1))
+        self.assertLessEqual(len(RenateDB.rate_stacks), RenateDB.RATE_STACK_CACHE_SIZE,
+                             msg='Rate stacks are expected to be evicted beyond the cache size.')
+        self.assertNotIn((self.INPUT_SPECIES, 'default', tuple(str(energy) for energy in self.INPUT_ENERGY_GRID[:2])),
+                         RenateDB.rate_stacks, msg='The least recently used rate stack is expected to be evicted.')
+
+    def test_outlying_energy(self):
+        with self.assertRaises(ValueError):
+            RenateDB(self.build_param(self.INPUT_OUTLYING_ENERGY), 'default', None, energy_grid=self.INPUT_ENERGY_GRID)
+
+    def test_invalid_energy_grid(self):
+        with self.assertRaises(ValueError):
+            RenateDB(self.build_param(self.INPUT_ENERGY), 'default', None, energy_grid=self.INPUT_ENERGY_GRID[::-1])
+
+    def build_param(self, energy):
+        input_gen = AtomicInput(energy=energy, projectile=self.INPUT_SPECIES, param_name='RenateDB_energy_test',
+                                source='Unittest', current=0.001)
+        input_gen.add_target_component(charge=-1, atomic_number=0, mass_number=0, molecule_name=None)
+        return input_gen.get_atomic_db_input()[0]
+
+
 class AtomicDBTest(unittest.TestCase):
     EXPECTED_ATTR = ['temperature_axis', 'spontaneous_trans', 'electron_impact_loss',
                      'ion_impact_loss', 'electron_impact_trans', 'ion_impact_trans']
@@ -388,6 +460,63 @@ class AtomicDBTest(unittest.TestCase):
                                                       rates, self.EXPECTED_DECIMAL_PRECISION_5,
                                                       err_msg='Ion impact transition interpolator failure.')
 
+    def test_electron_impact_rate_tables(self):
+        self.assertIsInstance(self.atomic_db.electron_impact_loss_table, RateTable,
+                              msg='Electron impact loss table is stored in wrong data format.')
+        self.assertIsInstance(self.atomic_db.electron_impact_trans_table, RateTable,
+                              msg='Electron impact transition table is stored in wrong data format.')
+        numpy.testing.assert_almost_equal(self.EXPECTED_ELECTRON_IMPACT_LOSS, self.atomic_db.electron_impact_loss_table.
+                                          evaluate(self.INTERPOLATION_TEST_TEMPERATURE),
+                                          self.EXPECTED_DECIMAL_PRECISION_5,
+                                          err_msg='Electron impact loss table evaluation failure.')
+        numpy.testing.assert_almost_equal(self.EXPECTED_ELECTRON_IMPACT_TRANS, self.atomic_db.
+                                          electron_impact_trans_table.evaluate(self.INTERPOLATION_TEST_TEMPERATURE),
+                                          self.EXPECTED_DECIMAL_PRECISION_5,
+                                          err_msg='Electron impact transition table evaluation failure.')
+
+    def test_ion_impact_rate_tables(self):
+        self.assertEqual(len(self.atomic_db.ion_impact_loss_tables), len(self.atomic_db.components.T.keys())-1,
+                         msg='Number of ion impact loss tables is inconsistent with the number of plasma ions.')
+        self.assertEqual(len(self.atomic_db.ion_impact_trans_tables), len(self.atomic_db.components.T.keys())-1,
+                         msg='Number of ion impact transition tables is inconsistent with the number of plasma ions.')
+        for target in range(len(self.atomic_db.components.T.keys())-1):
+            numpy.testing.assert_almost_equal(self.EXPECTED_ION_IMPACT_LOSS[:, target, :], self.atomic_db.
+                                              ion_impact_loss_tables[target].evaluate(
+                                                  self.INTERPOLATION_TEST_TEMPERATURE),
+                                              self.EXPECTED_DECIMAL_PRECISION_5,
+                                              err_msg='Ion impact loss table evaluation failure.')
+            numpy.testing.assert_almost_equal(self.EXPECTED_ION_IMPACT_TRANS[:, :, target, :], self.atomic_db.
+                                              ion_impact_trans_tables[target].evaluate(
+                                                  self.INTERPOLATION_TEST_TEMPERATURE),
+                                              self.EXPECTED_DECIMAL_PRECISION_5,
+                                              err_msg='Ion impact transition table evaluation failure.')
+
+    def test_lazy_rate_materialization(self):
+        lazy_db = AtomicDB(param=self.atomic_db.param, components=self.atomic_db.components)
+        for name in ['electron_impact_loss_table', 'ion_impact_loss_tables', 'electron_impact_trans_table',
+                     'ion_impact_trans_tables', 'electron_impact_loss', 'ion_impact_loss', 'electron_impact_trans',
+                     'ion_impact_trans']:
+            self.assertIsNone(vars(lazy_db)['_AtomicDB__' + name], msg='Rate data: ' + name + ' is expected to be '
+                                                                       'materialized on first access only.')
+        lazy_db.electron_impact_trans_table
+        self.assertIsNotNone(vars(lazy_db)['_AtomicDB__electron_impact_trans_table'],
+                             msg='Rate table is expected to be kept after first access.')
+        self.assertIsNone(vars(lazy_db)['_AtomicDB__electron_impact_trans'],
+                          msg='Interpolator functions are not expected to be built for rate table access.')
+
+    def test_component_aware_rate_tables(self):
+        components = self.atomic_db.components[self.atomic_db.components['q'] <= 1]
+        ceiled_db = AtomicDB(param=self.atomic_db.param, components=components, atomic_ceiling=2)
+        self.assertTupleEqual(ceiled_db.plasma_ions, tuple(components[components['q'] > 0].index),
+                              msg='Plasma ions are expected to be read from the plasma components.')
+        self.assertEqual(len(ceiled_db.ion_impact_trans_tables), len(ceiled_db.plasma_ions),
+                         msg='Ion impact transition tables are expected for present plasma ions only.')
+        self.assertTupleEqual(ceiled_db.ion_impact_trans_tables[0].rates.shape,
+                              (2, 2, ceiled_db.temperature_axis.size),
+                              msg='Ion impact transition table is expected to be sliced to the atomic ceiling.')
+        self.assertTupleEqual(ceiled_db.electron_impact_loss_table.rates.shape, (2, ceiled_db.temperature_axis.size),
+                              msg='Electron impact loss table is expected to be sliced to the atomic ceiling.')
+
     def test_ceiled_electron_impact_loss_terms(self):
         ceiled_db = AtomicDB(param=self.atomic_db.param, components=self.atomic_db.components, atomic_ceiling=2)
         self.assertIsInstance(ceiled_db.electron_impact_loss, tuple,
@@ -438,3 +567,114 @@ class AtomicDBTest(unittest.TestCase):
                                            mass_number=self.INPUT_neutral_a[index],
                                            molecule_name=self.INPUT_neutral_m[index])
         return input_gen.get_atomic_db_input()
+
+
+class RateTableTest(unittest.TestCase):
+    INPUT_TEMPERATURE_AXIS = numpy.array([1., 2., 4., 8.])
+    INPUT_RATES = numpy.array([[[1., 3., 2., 5.], [0., 1., 4., 4.]],
+                               [[2., 2., 2., 2.], [7., 5., 1., 0.]]])
+    INPUT_TEMPERATURES = numpy.array([0., 1., 1.5, 2., 3., 7.9, 8., 12.])
+
+    def setUp(self):
+        self.rate_table = RateTable(self.INPUT_TEMPERATURE_AXIS, self.INPUT_RATES)
+
+    def tearDown(self):
+        del self.rate_table
+
+    def test_evaluation_shape(self):
+        self.assertEqual(self.rate_table.evaluate(self.INPUT_TEMPERATURES).shape,
+                         self.INPUT_RATES.shape[:-1] + self.INPUT_TEMPERATURES.shape,
+                         msg='Rate table evaluation is expected to return all transitions for all temperatures.')
+
+    def test_evaluation_against_interp1d(self):
+        expected = scipy.interpolate.interp1d(self.INPUT_TEMPERATURE_AXIS, self.INPUT_RATES,
+                                              fill_value='extrapolate')(self.INPUT_TEMPERATURES)
+        numpy.testing.assert_allclose(self.rate_table.evaluate(self.INPUT_TEMPERATURES), expected, rtol=1E-14,
+                                      err_msg='Rate table is expected to inter- and extrapolate like interp1d.')
+
+    def test_derivative(self):
+        temperatures = self.INPUT_TEMPERATURES[~numpy.isin(self.INPUT_TEMPERATURES, self.INPUT_TEMPERATURE_AXIS)]
+        expected = (self.rate_table.evaluate(temperatures + 1E-3) - self.rate_table.evaluate(temperatures - 1E-3)) / 2E-3
+        numpy.testing.assert_allclose(self.rate_table.evaluate_derivative(temperatures), expected, rtol=1E-9,
+                                      err_msg='Rate table derivative is expected to match the slope of the segment.')
+
+    def test_inconsistent_axis(self):
+        with self.assertRaises(ValueError):
+            RateTable(self.INPUT_TEMPERATURE_AXIS[:-1], self.INPUT_RATES)
+
+
+class AtomicDBCacheTest(unittest.TestCase):
+    INPUT_q = [1, 2]
+    INPUT_z = [1, 2]
+    INPUT_a = [2, 4]
+    INPUT_m = [None, None]
+    INPUT_CACHE_SIZE = 2
+
+    def setUp(self):
+        self.cache = AtomicDBCache(maxsize=self.INPUT_CACHE_SIZE)
+        self.param, self.components = self.build_atomic_input()
+
+    def tearDown(self):
+        del self.cache
+
+    def test_cache_hit(self):
+        first_db = self.cache.get_atomic_db(param=self.param, components=self.components)
+        second_db = self.cache.get_atomic_db(param=self.param, components=self.components.copy())
+        self.assertIs(first_db, second_db, msg='Identical requests are expected to return the shared AtomicDB.')
+        self.assertEqual(self.cache.cache_info()['hits'], 1, msg='Cache hit is not recorded.')
+        self.assertEqual(self.cache.cache_info()['misses'], 1, msg='Cache miss is not recorded.')
+
+    def test_distinct_keys(self):
+        full_db = self.cache.get_atomic_db(param=self.param, components=self.components)
+        ceiled_db = self.cache.get_atomic_db(param=self.param, components=self.components, atomic_ceiling=2)
+        self.assertIsNot(full_db, ceiled_db, msg='Differing atomic ceilings are expected to be cached separately.')
+        self.assertEqual(self.cache.cache_info()['misses'], 2, msg='Cache misses are not recorded.')
+
+    def test_lru_eviction(self):
+        first_db = self.cache.get_atomic_db(param=self.param, components=self.components, atomic_ceiling=1)
+        self.cache.get_atomic_db(param=self.param, components=self.components, atomic_ceiling=2)
+        self.cache.get_atomic_db(param=self.param, components=self.components, atomic_ceiling=3)
+        self.assertEqual(self.cache.cache_info()['size'], self.INPUT_CACHE_SIZE,
+                         msg='Cache is expected to be bounded by its maximal size.')
+        self.assertIsNot(first_db, self.cache.get_atomic_db(param=self.param, components=self.components,
+                                                            atomic_ceiling=1),
+                         msg='Least recently used AtomicDB is expected to be evicted.')
+
+    def test_read_only(self):
+        atomic_db = self.cache.get_atomic_db(param=self.param, components=self.components)
+        with self.assertRaises(ValueError):
+            atomic_db.spontaneous_trans[0, 0] = 1.
+        with self.assertRaises(ValueError):
+            atomic_db.electron_impact_trans_table.rates[0, 0, 0] = 1.
+
+    def test_private_inputs(self):
+        atomic_db = self.cache.get_atomic_db(param=self.param, components=self.components)
+        self.assertIsNot(atomic_db.components, self.components)
+        self.assertIsNot(atomic_db.param, self.param)
+        energy = self.param.getroot().find('body').find('beamlet_energy').text
+        self.param.getroot().find('body').find('beamlet_energy').text = '1'
+        self.components['q'] = 0
+        self.assertEqual(atomic_db.param.getroot().find('body').find('beamlet_energy').text, energy,
+                         msg='Cached AtomicDB is expected to keep its own beamlet parameters.')
+        self.assertTrue((atomic_db.components['q'] != 0).any(),
+                        msg='Cached AtomicDB is expected to keep its own plasma components.')
+
+    def test_clear(self):
+        self.cache.get_atomic_db(param=self.param, components=self.components)
+        self.cache.clear()
+        self.assertEqual(self.cache.cache_info(), {'hits': 0, 'misses': 0, 'size': 0,
+                                                   'maxsize': self.INPUT_CACHE_SIZE},
+                         msg='Cleared cache is expected to be empty with reset statistics.')
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            AtomicDBCache(maxsize=0)
+
+    def build_atomic_input(self):
+        input_gen = AtomicInput(energy=60, projectile='dummy', param_name='AtomicDBCache_test',
+                                source='Unittest', current=0.001)
+        input_gen.add_target_component(charge=-1, atomic_number=0, mass_number=0, molecule_name=None)
+        for index in range(len(self.INPUT_q)):
+            input_gen.add_target_component(charge=self.INPUT_q[index], atomic_number=self.INPUT_z[index],
+                                           mass_number=self.INPUT_a[index], molecule_name=self.INPUT_m[index])
+        return input_gen.get_atomic_db_input()
@@ -0,0 +1,230 @@
+import numpy
+from copy import deepcopy
+from crm_solver.beamlet import Beamlet
+from crm_solver.ode import BatchOde
+from crm_solver.atomic_db import atomic_db_cache
+
+
+def solve_batched(beamlets, integrator='odeint', solver='numerical'):
+    '''''
+    Solves beamlets sharing a common beamlet grid in a single BatchOde call and sets their level profiles, either by
+    numerical integration or by the analytical solution with segment mean coefficients.
+    Beamlets resolved to different numbers of atomic levels are padded with decoupled, empty levels.
+    Returns the solver statistics of the batch.
+    '''''
+    if solver not in ('numerical', 'analytical'):
+        raise ValueError('Batched beamlets are solved by the numerical or the analytical solver.')
+    odes = [beamlet.get_ode() for beamlet in beamlets]
+    grid = beamlets[0].profiles['beamlet grid']['distance']['m']
+    for beamlet in beamlets[1:]:
+        if not numpy.array_equal(beamlet.profiles['beamlet grid']['distance']['m'], grid):
+            raise ValueError('Batched beamlets are expected to share a common beamlet grid.')
+    levels = max(ode.coeff_matrix.shape[0] for ode in odes)
+    coeff_matrices = numpy.zeros((len(odes), levels, levels, grid.size))
+    init_conditions = numpy.zeros((len(odes), levels))
+    for index, ode in enumerate(odes):
+        ode_levels = ode.coeff_matrix.shape[0]
+        coeff_matrices[index, :ode_levels, :ode_levels, :] = ode.coeff_matrix
+        init_conditions[index, :ode_levels] = ode.init_condition
+    batch = BatchOde(coeff_matrices, init_conditions)
+    if solver == 'numerical':
+        populations = batch.calculate_numerical_solution(grid, method=integrator)
+    else:
+        populations = batch.calculate_analytical_solution(grid)
+    for index, beamlet in enumerate(beamlets):
+        beamlet.solver = solver
+        beamlet.set_level_populations(populations[index, :, :beamlet.atomic_db.atomic_ceiling])
+    return batch.solver_statistics
+
+
+def calculate_batched_beamevolution(beamlets, solver, integrator='odeint'):
+    '''''
+    Beam evolution of the beamlets of a composite beam. Returns the solver statistics of the batch.
+    '''''
+    assert isinstance(solver, str)
+    if solver in ('numerical', 'analytical'):
+        return solve_batched(beamlets, integrator, solver)
+    elif solver == 'disregard':
+        print('Beam evolution not calculated.')
+        return None
+    else:
+        raise Exception('The numerical solver: ' + solver + ' is not supported. '
+                        'Supported solvers are: numerical, analytical, disregard.')
+
+
+class MultiEnergyBeamlet:
+    '''''
+    Beamlet of a heating beam carrying several energy components, by default the full, half and third energy
+    components. The beamlet current is shared among the components according to the current fractions, every
+    component is a Beamlet on the common beamlet grid and all components are integrated in a single batched solve.
+    Summed profiles are kept in profiles, the component profiles in the profiles of the component beamlets.
+    '''''
+    ENERGY_RATIOS = (1., 1. / 2., 1. / 3.)
+
+    def __init__(self, current_fractions, param=None, profiles=None, components=None, energy_ratios=None,
+                 energy_grid=None, solver='numerical', data_path="beamlet/testimp0001.xml", integrator='odeint'):
+        if energy_ratios is None:
+            energy_ratios = self.ENERGY_RATIOS[:len(current_fractions)]
+        self.current_fractions = numpy.asarray(current_fractions, dtype=float)
+        self.energy_ratios = numpy.asarray(energy_ratios, dtype=float)
+        if self.current_fractions.ndim != 1 or self.current_fractions.shape != self.energy_ratios.shape:
+            raise ValueError('A current fraction is expected for every energy component.')
+        if numpy.any(self.current_fractions < 0) or not numpy.isclose(numpy.sum(self.current_fractions), 1.):
+            raise ValueError('Current fractions are expected to be non-negative and sum to 1.')
+        if numpy.any(self.energy_ratios <= 0) or numpy.any(self.energy_ratios > 1):
+            raise ValueError('Energy ratios are expected in the (0, 1] interval.')
+        reference = Beamlet(param=param, profiles=profiles, components=components, data_path=data_path, solver=None)
+        self.param = reference.param
+        self.components = reference.components
+        self.profiles = reference._copy_profiles_input()
+        self.integrator = integrator
+        self.solver_statistics = None
+        self.beamlets = [self.__build_component_beamlet(ratio, fraction, energy_grid)
+                         for ratio, fraction in zip(self.energy_ratios, self.current_fractions)]
+        self.calculate_beamevolution(solver)
+
+    def __build_component_beamlet(self, energy_ratio, current_fraction, energy_grid):
+        param = deepcopy(self.param)
+        body = param.getroot().find('body')
+        body.find('beamlet_energy').text = self.__format_energy(float(body.find('beamlet_energy').text) * energy_ratio)
+        body.find('beamlet_current').text = str(float(body.find('beamlet_current').text) * current_fraction)
+        atomic_db = atomic_db_cache.get_atomic_db(param=param, components=self.components, energy_grid=energy_grid)
+        return Beamlet(param=param, profiles=self.profiles.copy(), components=self.components, atomic_db=atomic_db,
+                       solver=None, integrator=self.integrator)
+
+    @staticmethod
+    def __format_energy(energy):
+        '''''
+        Whole keV energies are written as integers, matching the tabulated rate files, any other at full precision.
+        '''''
+        if numpy.isclose(energy, round(energy), rtol=1E-12, atol=0.):
+            return str(int(round(energy)))
+        return repr(energy)
+
+    def calculate_beamevolution(self, solver):
+        self.solver_statistics = calculate_batched_beamevolution(self.beamlets, solver, self.integrator)
+
+    def compute_linear_density_attenuation(self):
+        for beamlet in self.beamlets:
+            beamlet.compute_linear_density_attenuation()
+        self.__set_summed_profile('linear_density_attenuation')
+
+    def compute_linear_emission_density(self, to_level=None, from_level=None):
+        for beamlet in self.beamlets:
+            beamlet.compute_linear_emission_density(to_level=to_level, from_level=from_level)
+        if to_level is None or from_level is None:
+            from_level, to_level, ground_level, transition_label = \
+                self.beamlets[0].atomic_db.set_default_atomic_levels()
+        self.__set_summed_profile(from_level + '-->' + to_level)
+
+    def __set_summed_profile(self, label):
+        self.profiles[label] = numpy.sum([beamlet.profiles[label].values.reshape(-1) for beamlet in self.beamlets],
+                                         axis=0)
+
+    def get_component_profiles(self, label):
+        '''''
+        Indexing convention: component_profiles[component, step]
+        '''''
+        return numpy.array([beamlet.profiles[label].values.reshape(-1) for beamlet in self.beamlets])
+
+
+class Beam:
+    '''''
+    Beam of finite width and divergence, composed of beamlets solved in a single batched call with one shared
+    AtomicDB. In the beam frame the beam axis starts at the origin along z. The beamlet sources lie on a regular
+    lattice across the beam width, on a line along x (dimension=2) or on the disc of the beam cross-section
+    (dimension=3). The beamlet current follows a Gaussian current density of 1/e radius width, the beamlets diverge
+    proportionally to their source offset, reaching the divergence angle at the edge of the beam.
+    The plasma is sampled along every beamlet path by the plasma function, taking the path points in (point, 3)
+    shape and returning the plasma profiles at the points as {(component, quantity, unit): values}. By default the
+    profiles are taken as a slab plasma varying only along the beam axis.
+    Indexing convention: positions[beamlet, step, coordinate], beamlet profiles[beamlet, step]
+    '''''
+    def __init__(self, param=None, profiles=None, components=None, atomic_db=None, plasma=None, width=0.,
+                 divergence=0., beamlet_resolution=1, dimension=3, solver='numerical',
+                 data_path="beamlet/testimp0001.xml", integrator='odeint'):
+        if width < 0 or divergence < 0 or int(beamlet_resolution) < 1:
+            raise ValueError('Beam width, divergence and beamlet resolution are expected to be positive.')
+        if dimension not in (2, 3):
+            raise ValueError('Beams are supported in 2 or 3 dimensions.')
+        reference = Beamlet(param=param, profiles=profiles, components=components, atomic_db=atomic_db,
+                            data_path=data_path, solver=None)
+        self.param = reference.param
+        self.components = reference.components
+        self.atomic_db = reference.atomic_db
+        self.profiles = reference._copy_profiles_input()
+        self.plasma = plasma
+        if self.plasma is None:
+            self.plasma = self.get_slab_plasma(self.profiles)
+        self.width = width
+        self.divergence = divergence
+        self.integrator = integrator
+        self.solver_statistics = None
+        self.__set_beamlet_geometry(int(beamlet_resolution), dimension)
+        self.beamlets = [self.__build_beamlet(index) for index in range(self.current_fractions.size)]
+        self.calculate_beamevolution(solver)
+
+    def __set_beamlet_geometry(self, beamlet_resolution, dimension):
+        lattice = numpy.linspace(-self.width, self.width, beamlet_resolution) \
+            if beamlet_resolution > 1 and self.width > 0 else numpy.zeros(1)
+        if dimension == 2:
+            offsets = numpy.stack([lattice, numpy.zeros(lattice.size)], axis=1)
+        else:
+            offsets = numpy.stack([axis.reshape(-1) for axis in numpy.meshgrid(lattice, lattice, indexing='ij')],
+                                  axis=1)
+            offsets = offsets[numpy.sum(offsets ** 2, axis=1) <= self.width ** 2 * (1. + 1E-12)]
+        self.source_offsets = offsets
+        if self.width > 0:
+            weights = numpy.exp(- numpy.sum(offsets ** 2, axis=1) / self.width ** 2)
+            slopes = offsets / self.width * numpy.tan(self.divergence)
+        else:
+            weights, slopes = numpy.ones(offsets.shape[0]), numpy.zeros(offsets.shape)
+        self.current_fractions = weights / numpy.sum(weights)
+        directions = numpy.concatenate([slopes, numpy.ones((offsets.shape[0], 1))], axis=1)
+        self.directions = directions / numpy.linalg.norm(directions, axis=1)[:, None]
+        sources = numpy.concatenate([offsets, numpy.zeros((offsets.shape[0], 1))], axis=1)
+        grid = numpy.asarray(self.profiles['beamlet grid']['distance']['m'], dtype=float)
+        self.positions = sources[:, None, :] + grid[None, :, None] * self.directions[:, None, :]
+
+    def __build_beamlet(self, index):
+        param = deepcopy(self.param)
+        current = param.getroot().find('body').find('beamlet_current')
+        current.text = str(float(current.text) * self.current_fractions[index])
+        profiles = self.profiles.copy()
+        for column, values in self.plasma(self.positions[index]).items():
+            if column not in profiles.columns:
+                raise ValueError('The plasma profile: ' + ' '.join(column) + ' is not a profile of the beam.')
+            profiles[column] = numpy.asarray(values, dtype=float)
+        return Beamlet(param=param, profiles=profiles, components=self.components, atomic_db=self.atomic_db,
+                       solver=None, integrator=self.integrator)
+
+    @staticmethod
+    def get_slab_plasma(profiles):
+        '''''
+        Plasma function of profiles given along the beam axis, varying only with the z coordinate.
+        '''''
+        grid = numpy.asarray(profiles['beamlet grid']['distance']['m'], dtype=float)
+        plasma_profiles = {column: numpy.asarray(profiles[column], dtype=float) for column in profiles.columns
+                           if column[0] != 'beamlet grid'}
+
+        def slab_plasma(points):
+            return {column: numpy.interp(points[:, 2], grid, values) for column, values in plasma_profiles.items()}
+        return slab_plasma
+
+    def calculate_beamevolution(self, solver):
+        self.solver_statistics = calculate_batched_beamevolution(self.beamlets, solver, self.integrator)
+
+    def compute_linear_density_attenuation(self):
+        for beamlet in self.beamlets:
+            beamlet.compute_linear_density_attenuation()
+        return self.get_beamlet_profiles('linear_density_attenuation')
+
+    def compute_linear_emission_density(self, to_level=None, from_level=None):
+        for beamlet in self.beamlets:
+            beamlet.compute_linear_emission_density(to_level=to_level, from_level=from_level)
+        if to_level is None or from_level is None:
+            from_level, to_level, ground_level, transition_label = self.atomic_db.set_default_atomic_levels()
+        return self.get_beamlet_profiles(from_level + '-->' + to_level)
+
+    def get_beamlet_profiles(self, label):
+        return numpy.array([beamlet.profiles[label].values.reshape(-1) for beamlet in self.beamlets])
@@ -6,12 +6,16 @@ from copy import deepcopy
 from lxml import etree
 from crm_solver.coefficientmatrix import CoefficientMatrix
 from crm_solver.ode import Ode
-from crm_solver.atomic_db import AtomicDB
+from crm_solver.atomic_db import atomic_db_cache
 
 
 class Beamlet:
+    ADAPTIVE_TOLERANCE = 1E-3
+    ADAPTIVE_INITIAL_POINTS = 3
+    ADAPTIVE_MAX_REFINEMENTS = 8
+
     def __init__(self, param=None, profiles=None, components=None, atomic_db=None,
-                 solver='numerical', data_path="beamlet/testimp0001.xml"):
+                 solver='numerical', data_path="beamlet/testimp0001.xml", integrator='odeint'):
         self.param = param
         if not isinstance(self.param, etree._ElementTree):
             self.__read_beamlet_param(data_path)
@@ -21,11 +25,22 @@ class Beamlet:
         if not (isinstance(self.components, pandas.DataFrame) and isinstance(self.profiles, pandas.DataFrame)):
             self.__read_beamlet_profiles()
         if atomic_db is None:
-            self.atomic_db = AtomicDB(param=self.param, components=self.components)
+            self.atomic_db = atomic_db_cache.get_atomic_db(param=self.param, components=self.components)
         self.const = Constants()
         self.coefficient_matrix = None
         self.initial_condition = None
-        self.calculate_beamevolution(solver)
+        self.integrator = integrator
+        self.solver = solver
+        self.solver_statistics = None
+        self.checkpoints = None
+        self.initial_fractions = None
+        self.normalized_populations = None
+        self.fundamental_solution = None
+        self.profile_sensitivity = None
+        self.quasi_steady_state_report = None
+        self.adaptive_grid = None
+        if solver is not None:
+            self.calculate_beamevolution(solver)
 
     def __read_beamlet_param(self, data_path):
         self.param = utility.getdata.GetData(data_path_name=data_path).data
@@ -43,6 +58,7 @@ class Beamlet:
 
     def __initialize_ode(self):
         self.coefficient_matrix = CoefficientMatrix(self.param, self.profiles, self.components, self.atomic_db)
+        self.initial_fractions = numpy.identity(self.atomic_db.atomic_ceiling)[0]
         self.initial_condition = [self.__get_linear_density()] + [0.] * (self.atomic_db.atomic_ceiling - 1)
 
     def __get_linear_density(self):
@@ -54,25 +70,313 @@ class Beamlet:
             self.__initialize_ode()
 
         ode = Ode(coeff_matrix=self.coefficient_matrix.matrix, init_condition=self.initial_condition)
-        numerical = ode.calculate_numerical_solution(self.profiles['beamlet grid']['distance']['m'])
+        numerical = ode.calculate_numerical_solution(self.profiles['beamlet grid']['distance']['m'],
+                                                     interpolation='piecewise_linear', method=self.integrator)
+        self.solver_statistics = ode.solver_statistics
+        self.__set_normalized_populations(numerical)
+        self.__set_level_profiles(numerical)
+
+    def __solve_analytically(self):
+        if self.coefficient_matrix is None or self.initial_condition is None:
+            self.__initialize_ode()
 
+        ode = Ode(coeff_matrix=self.coefficient_matrix.matrix, init_condition=self.initial_condition)
+        analytical = ode.calculate_analytical_solution(self.profiles['beamlet grid']['distance']['m'])
+        self.__set_normalized_populations(analytical)
+        self.__set_level_profiles(analytical)
+
+    def __set_normalized_populations(self, populations):
+        linear_density = numpy.sum(self.initial_condition)
+        if linear_density > 0:
+            self.normalized_populations = populations / linear_density
+        else:
+            self.normalized_populations = None
+
+    def __set_level_profiles(self, populations):
+        self.checkpoints = numpy.array(populations, dtype=float)
         for level in range(self.atomic_db.atomic_ceiling):
             label = 'level ' + self.atomic_db.inv_atomic_dict[level]
-            self.profiles[label] = numerical[:, level]
-        return
+            self.profiles[label] = populations[:, level]
+
+    def get_ode(self):
+        '''''
+        Ode of the beam evolution on the beamlet grid, for solving beamlets outside of the Beamlet class.
+        '''''
+        if self.coefficient_matrix is None or self.initial_condition is None:
+            self.__initialize_ode()
+        return Ode(coeff_matrix=self.coefficient_matrix.matrix, init_condition=self.initial_condition)
+
+    def set_level_populations(self, populations):
+        '''''
+        Sets the level profiles and the derived profiles from populations solved on the beamlet grid.
+        Indexing convention: populations[step, level]
+        '''''
+        populations = numpy.asarray(populations, dtype=float)
+        if populations.shape != (len(self.profiles), self.atomic_db.atomic_ceiling):
+            raise ValueError('Populations are expected for all ' + str(self.atomic_db.atomic_ceiling) +
+                             ' atomic levels on the beamlet grid.')
+        if self.initial_condition is None:
+            self.__initialize_ode()
+        self.fundamental_solution = None
+        self.profile_sensitivity = None
+        self.__set_normalized_populations(populations)
+        self.__set_level_profiles(populations)
+        self.__update_derived_profiles()
+
+    def calculate_fundamental_solution(self, method=None):
+        '''''
+        Fundamental solution matrix along the beamlet grid, see Ode.calculate_fundamental_solution.
+        Indexing convention: fundamental_solution[step, init_level, level]
+        '''''
+        if self.coefficient_matrix is None or self.initial_condition is None:
+            self.__initialize_ode()
+        if method is None:
+            method = self.integrator
+        ode = Ode(coeff_matrix=self.coefficient_matrix.matrix, init_condition=self.initial_condition)
+        self.fundamental_solution = ode.calculate_fundamental_solution(
+            self.profiles['beamlet grid']['distance']['m'], method=method)
+        return self.fundamental_solution
+
+    def set_initial_fractions(self, initial_fractions):
+        '''''
+        Sets the level distribution of a (pre-excited) beam entering the plasma and derives the populations from the
+        fundamental solution without re-integration. The beam linear density is set by the beamlet current.
+        '''''
+        initial_fractions = numpy.asarray(initial_fractions, dtype=float)
+        if self.coefficient_matrix is None or self.initial_condition is None:
+            self.__initialize_ode()
+        if initial_fractions.shape != (self.atomic_db.atomic_ceiling,):
+            raise ValueError('The initial fractions are expected for all ' + str(self.atomic_db.atomic_ceiling) +
+                             ' atomic levels.')
+        if numpy.any(initial_fractions < 0) or numpy.sum(initial_fractions) <= 0:
+            raise ValueError('The initial fractions are expected to be non-negative with a positive sum.')
+        if self.fundamental_solution is None:
+            self.calculate_fundamental_solution()
+        self.initial_fractions = initial_fractions / numpy.sum(initial_fractions)
+        self.normalized_populations = numpy.einsum('i,nij->nj', self.initial_fractions, self.fundamental_solution)
+        self.__apply_linear_density()
+
+    def scale_to_current(self, current):
+        '''''
+        The beam evolution is linear in the populations, populations, emission densities and attenuation are rescaled
+        from the normalized solution to the given beamlet current [A] without re-integration.
+        '''''
+        if self.normalized_populations is None:
+            raise ValueError('Current scaling requires a beam evolution solved for a non-zero beamlet current.')
+        if current < 0:
+            raise ValueError('The beamlet current is expected to be non-negative.')
+        self.param = deepcopy(self.param)
+        self.param.getroot().find('body').find('beamlet_current').text = str(current)
+        self.__apply_linear_density()
+
+    def __apply_linear_density(self):
+        linear_density = self.__get_linear_density()
+        self.initial_condition = list(linear_density * self.initial_fractions)
+        self.profile_sensitivity = None
+        self.__set_level_profiles(linear_density * self.normalized_populations)
+        self.__update_derived_profiles()
+
+    def __update_derived_profiles(self):
+        labels = self.profiles.columns.get_level_values(0)
+        if 'linear_density_attenuation' in labels:
+            self.compute_linear_density_attenuation()
+        for label in set(labels):
+            if '-->' in label:
+                from_level, to_level = label.split('-->')
+                self.compute_linear_emission_density(to_level=to_level, from_level=from_level)
+
+    def resolve_from(self, profile_update):
+        '''''
+        Updates the plasma profiles and re-integrates the beam evolution only from the first changed grid point,
+        restarting from the population checkpoints of the previous solution. Returns the restart index.
+        The update is expected on the same beamlet grid, for any subset of the plasma profile columns.
+        '''''
+        assert isinstance(profile_update, pandas.DataFrame)
+        if self.checkpoints is None:
+            raise ValueError('A partial re-solve requires a solved beam evolution.')
+        if len(profile_update) != len(self.profiles):
+            raise ValueError('Profile updates are expected to be given on the same beamlet grid.')
+        restart = self.__get_restart_index(profile_update)
+        if restart is None:
+            print('Plasma profiles unchanged, beam evolution not recalculated.')
+            return len(self.profiles)
+        if self.coefficient_matrix is None:
+            self.__initialize_ode()
+        for column in profile_update.columns:
+            self.profiles[column] = profile_update[column].values
+        self.coefficient_matrix.update_profiles(self.profiles, self.atomic_db)
+        populations, statistics = self.__integrate(self.coefficient_matrix.matrix[:, :, restart:],
+                                                   self.checkpoints[restart], restart)
+        if statistics is not None:
+            self.solver_statistics = statistics
+        populations = numpy.concatenate([self.checkpoints[:restart], populations])
+        self.set_level_populations(populations)
+        return restart
+
+    def __integrate(self, coeff_matrix, init_condition, start=0):
+        grid = numpy.asarray(self.profiles['beamlet grid']['distance']['m'], dtype=float)[start:]
+        ode = Ode(coeff_matrix=coeff_matrix, init_condition=init_condition)
+        if self.solver == 'analytical':
+            return ode.calculate_analytical_solution(grid), None
+        populations = ode.calculate_numerical_solution(grid, interpolation='piecewise_linear', method=self.integrator)
+        return populations, ode.solver_statistics
+
+    def solve_quasi_steady_state(self, fast_levels, compare=False):
+        '''''
+        Reduced solver treating the given fast levels in the quasi-steady-state approximation: only the slow levels
+        are integrated, the fast level populations follow algebraically. If compare is set, the full system is also
+        integrated for reference and the maximal deviation of every profile relative to its maximum is reported.
+        '''''
+        if self.coefficient_matrix is None or self.initial_condition is None:
+            self.__initialize_ode()
+        for level in fast_levels:
+            if level not in self.atomic_db.atomic_dict:
+                raise ValueError('The atomic level: ' + str(level) + ' is not present in the atomic database.')
+        fast_indices = numpy.array([self.atomic_db.atomic_dict[level] for level in fast_levels], dtype=int)
+        reduced_matrix, fast_coupling = self.coefficient_matrix.calculate_quasi_steady_state_matrix(fast_indices)
+        slow_indices = numpy.setdiff1d(numpy.arange(self.atomic_db.atomic_ceiling), fast_indices)
+        slow_populations, statistics = self.__integrate(reduced_matrix,
+                                                        numpy.asarray(self.initial_condition)[slow_indices])
+        populations = numpy.zeros((slow_populations.shape[0], self.atomic_db.atomic_ceiling))
+        populations[:, slow_indices] = slow_populations
+        populations[:, fast_indices] = numpy.einsum('ns,sfn->nf', slow_populations, fast_coupling)
+        self.quasi_steady_state_report = {'fast_levels': list(fast_levels), 'reduced_statistics': statistics}
+        if compare:
+            full_populations, full_statistics = self.__integrate(self.coefficient_matrix.matrix,
+                                                                 self.initial_condition)
+            self.quasi_steady_state_report['full_statistics'] = full_statistics
+            errors = numpy.max(numpy.abs(populations - full_populations), axis=0) / \
+                numpy.max(numpy.abs(full_populations), axis=0)
+            self.quasi_steady_state_report['relative_errors'] = \
+                {'level ' + self.atomic_db.inv_atomic_dict[level]: errors[level]
+                 for level in range(self.atomic_db.atomic_ceiling)}
+            attenuation = numpy.sum(full_populations, axis=1)
+            self.quasi_steady_state_report['relative_errors']['linear_density_attenuation'] = \
+                numpy.max(numpy.abs(numpy.sum(populations, axis=1) - attenuation)) / numpy.max(numpy.abs(attenuation))
+        self.solver_statistics = statistics
+        self.set_level_populations(populations)
+        return self.quasi_steady_state_report
+
+    def __get_restart_index(self, profile_update):
+        changed = numpy.zeros(len(self.profiles), dtype=bool)
+        for column in profile_update.columns:
+            if column[0] == 'beamlet grid':
+                if not numpy.array_equal(profile_update[column].values, self.profiles[column].values):
+                    raise ValueError('Profile updates are expected to be given on the same beamlet grid.')
+            elif column not in self.profiles.columns:
+                raise ValueError('The plasma profile: ' + ' '.join(column) + ' is not present in the beamlet.')
+            else:
+                changed |= profile_update[column].values != self.profiles[column].values
+        if not numpy.any(changed):
+            return None
+        # The segment ending at the first changed point is affected by the piecewise linear coefficients.
+        return max(int(numpy.argmax(changed)) - 1, 0)
 
     def calculate_beamevolution(self, solver):
         assert isinstance(solver, str)
+        self.solver = solver
         if solver == 'numerical':
             self.__solve_numerically()
         elif solver == 'analytical':
-            raise NotImplementedError('Analytical solver not yet implemented.')
+            self.__solve_analytically()
+        elif solver == 'adaptive':
+            self.solve_adaptively()
         elif solver == 'disregard':
             print('Beam evolution not calculated.')
             return
         else:
             raise Exception('The numerical solver: ' + solver + ' is not supported. '
-                            'Supported solvers are: numerical, analytical, disregard.')
+                            'Supported solvers are: numerical, analytical, adaptive, disregard.')
+
+    def solve_adaptively(self, tolerance=None):
+        '''''
+        Solves the beam evolution on an adaptive grid and interpolates the populations back to the beamlet grid. The
+        initial grid is the subset of beamlet grid points resolving the plasma profiles by linear interpolation to the
+        tolerance relative to their maxima. Segments are then bisected, on profiles linearly interpolated to the
+        segment midpoints, until the populations at the midpoints are predicted by linear interpolation of the
+        segment ends to the tolerance relative to the maximum of each level, or until ADAPTIVE_MAX_REFINEMENTS
+        bisections. Converged segments are not revisited and every refined solution is carried over.
+        '''''
+        if tolerance is None:
+            tolerance = self.ADAPTIVE_TOLERANCE
+        if tolerance <= 0:
+            raise ValueError('The tolerance of the adaptive solver is expected to be positive.')
+        if self.coefficient_matrix is None or self.initial_condition is None:
+            self.__initialize_ode()
+        grid = numpy.asarray(self.profiles['beamlet grid']['distance']['m'], dtype=float)
+        input_profiles = self._copy_profiles_input()
+        indices = self.__get_profile_resolving_indices(input_profiles, tolerance)
+        points, matrix = grid[indices], self.coefficient_matrix.matrix[:, :, indices]
+        solution, statistics = self.__solve_on_points(points, matrix)
+        converged = numpy.zeros(points.size - 1, dtype=bool)
+        for refinement in range(self.ADAPTIVE_MAX_REFINEMENTS):
+            if numpy.all(converged):
+                break
+            midpoints = (0.5 * (points[:-1] + points[1:]))[~converged]
+            refined_points = numpy.concatenate([points, midpoints])
+            order = numpy.argsort(refined_points, kind='mergesort')
+            refined_matrix = numpy.concatenate([matrix, self.__calculate_sub_grid_matrix(input_profiles, midpoints)],
+                                               axis=2)[:, :, order]
+            refined, statistics = self.__solve_on_points(refined_points[order], refined_matrix)
+            is_midpoint = order >= points.size
+            predicted = numpy.array([numpy.interp(midpoints, points, refined[~is_midpoint, level])
+                                     for level in range(self.atomic_db.atomic_ceiling)]).T
+            scales = numpy.maximum(numpy.max(numpy.abs(refined), axis=0), numpy.finfo(float).tiny)
+            unresolved = numpy.max(numpy.abs(predicted - refined[is_midpoint]) / scales, axis=1) > tolerance
+            kept = ~is_midpoint
+            kept[is_midpoint] = unresolved
+            points, matrix, solution = refined_points[order][kept], refined_matrix[:, :, kept], refined[kept]
+            converged = self.__get_converged_segments(converged, unresolved)
+        populations = numpy.array([numpy.interp(grid, points, solution[:, level])
+                                   for level in range(self.atomic_db.atomic_ceiling)]).T
+        self.adaptive_grid = points
+        self.solver_statistics = statistics
+        self.set_level_populations(populations)
+
+    @staticmethod
+    def __get_converged_segments(converged, unresolved):
+        segments = []
+        unresolved = iter(unresolved)
+        for segment in converged:
+            if segment:
+                segments.append(True)
+            elif next(unresolved):
+                segments.extend([False, False])
+            else:
+                segments.append(True)
+        return numpy.array(segments, dtype=bool)
+
+    def __calculate_sub_grid_matrix(self, input_profiles, points):
+        grid = numpy.asarray(input_profiles['beamlet grid']['distance']['m'], dtype=float)
+        profiles = pandas.DataFrame({column: numpy.interp(points, grid, input_profiles[column].values)
+                                     for column in input_profiles.columns}, columns=input_profiles.columns)
+        return CoefficientMatrix(self.param, profiles, self.components, self.atomic_db, lean=True).matrix
+
+    @staticmethod
+    def __get_profile_resolving_indices(input_profiles, tolerance):
+        grid = numpy.asarray(input_profiles['beamlet grid']['distance']['m'], dtype=float)
+        profiles = numpy.asarray(input_profiles.drop(columns='beamlet grid', level=0), dtype=float)
+        scales = numpy.max(numpy.abs(profiles), axis=0)
+        profiles = profiles[:, scales > 0] / scales[scales > 0]
+        indices = set(numpy.linspace(0, grid.size - 1, Beamlet.ADAPTIVE_INITIAL_POINTS).astype(int))
+        segments = list(zip(sorted(indices)[:-1], sorted(indices)[1:]))
+        while segments:
+            start, end = segments.pop()
+            if end - start < 2:
+                continue
+            weights = ((grid[start + 1:end] - grid[start]) / (grid[end] - grid[start]))[:, None]
+            deviation = numpy.max(numpy.abs(profiles[start + 1:end] - (1. - weights) * profiles[start] -
+                                            weights * profiles[end]), axis=1)
+            if deviation.max() > tolerance:
+                split = start + 1 + int(numpy.argmax(deviation))
+                indices.add(split)
+                segments.extend([(start, split), (split, end)])
+        return numpy.array(sorted(indices), dtype=int)
+
+    def __solve_on_points(self, points, coeff_matrix):
+        ode = Ode(coeff_matrix=coeff_matrix, init_condition=self.initial_condition)
+        populations = ode.calculate_numerical_solution(points, interpolation='piecewise_linear', method=self.integrator)
+        return populations, ode.solver_statistics
 
     def __was_beamevolution_performed(self):
         try:
@@ -81,7 +385,7 @@ class Beamlet:
         except KeyError:
             return False
 
-    def compute_linear_emission_density(self, to_level=None, from_level=None):
+    def __get_transition(self, to_level, from_level):
         if to_level is None or from_level is None:
             from_level, to_level, ground_level, transition_label = self.atomic_db.set_default_atomic_levels()
         if isinstance(to_level, str) and isinstance(from_level, str):
@@ -92,6 +396,10 @@ class Beamlet:
             raise Exception('The expected input for atomic transitions are strings. '
                             'Bundled-n for H,D,T beam species ex:[1, 2, ... 6]. '
                             'l-n resolved labels for Li ex: [2s, 2p, ... 4f] and Na ex: [3s, 3p, ... 5s]')
+        return to_level, from_level
+
+    def compute_linear_emission_density(self, to_level=None, from_level=None):
+        to_level, from_level = self.__get_transition(to_level, from_level)
         if self.__was_beamevolution_performed():
             transition_label = from_level + '-->' + to_level
             self.profiles[transition_label] = \
@@ -100,6 +408,70 @@ class Beamlet:
         else:
             print('Beam evolution calculations were not performed. Execute solver first.')
 
+    def calculate_emission_response(self, to_level=None, from_level=None):
+        '''''
+        Linear response of the emission density profile to electron density perturbations around the present plasma
+        profiles, from the variational equations of the propagated solution. The emission fluctuation of a density
+        fluctuation profile is: numpy.dot(emission_response, electron_density_fluctuation)
+        The derivatives are those of the analytical solution with segment mean coefficients (see
+        Ode.calculate_nodal_sensitivity), not of the numerical solution stored in profiles.
+        Indexing convention: emission_response[step, node] = d(emission[step]) / d(electron_density[node])
+        '''''
+        to_level, from_level = self.__get_transition(to_level, from_level)
+        if self.coefficient_matrix is None or self.initial_condition is None:
+            self.__initialize_ode()
+        ode = Ode(coeff_matrix=self.coefficient_matrix.matrix, init_condition=self.initial_condition)
+        from_index, to_index = self.atomic_db.atomic_dict[from_level], self.atomic_db.atomic_dict[to_level]
+        weights = numpy.zeros((self.atomic_db.atomic_ceiling, 1))
+        weights[from_index, 0] = self.atomic_db.spontaneous_trans[to_index, from_index]
+        return ode.calculate_nodal_sensitivity(self.profiles['beamlet grid']['distance']['m'],
+                                               self.coefficient_matrix.electron_terms, weights)[:, :, 0]
+
+    def calculate_profile_sensitivity(self, labels=None):
+        '''''
+        Derivatives of the level populations ('level 2s'), the linear density attenuation
+        ('linear_density_attenuation') and the emission densities ('2p-->2s') with respect to the electron density
+        and temperature at every grid point, from the variational equations of the propagated solution. Only the
+        requested labels are propagated, by default all levels and the attenuation.
+        The derivatives are those of the analytical solution with segment mean coefficients (see
+        Ode.calculate_nodal_sensitivity), not of the numerical solution stored in profiles.
+        Indexing convention: profile_sensitivity[profile_key][label][step, node]
+        '''''
+        if labels is None:
+            labels = ['level ' + self.atomic_db.inv_atomic_dict[level]
+                      for level in range(self.atomic_db.atomic_ceiling)] + ['linear_density_attenuation']
+        weights = self.__get_sensitivity_weights(labels)
+        if self.coefficient_matrix is None or self.initial_condition is None:
+            self.__initialize_ode()
+        ode = Ode(coeff_matrix=self.coefficient_matrix.matrix, init_condition=self.initial_condition)
+        nodal_derivatives = {('electron', 'density', 'm-3'): self.coefficient_matrix.electron_terms,
+                             ('electron', 'temperature', 'eV'): self.coefficient_matrix.electron_density *
+                             self.coefficient_matrix.calculate_electron_temperature_terms(self.atomic_db)}
+        self.profile_sensitivity = {}
+        for profile_key, derivatives in nodal_derivatives.items():
+            sensitivity = ode.calculate_nodal_sensitivity(self.profiles['beamlet grid']['distance']['m'], derivatives,
+                                                          weights)
+            self.profile_sensitivity[profile_key] = {label: sensitivity[:, :, index]
+                                                     for index, label in enumerate(labels)}
+        return self.profile_sensitivity
+
+    def __get_sensitivity_weights(self, labels):
+        weights = numpy.zeros((self.atomic_db.atomic_ceiling, len(labels)))
+        for index, label in enumerate(labels):
+            if label == 'linear_density_attenuation':
+                weights[:, index] = 1.
+            elif label.startswith('level ') and label[len('level '):] in self.atomic_db.atomic_dict:
+                weights[self.atomic_db.atomic_dict[label[len('level '):]], index] = 1.
+            elif '-->' in label:
+                from_level, to_level = label.split('-->')
+                to_level, from_level = self.__get_transition(to_level, from_level)
+                from_index, to_index = self.atomic_db.atomic_dict[from_level], self.atomic_db.atomic_dict[to_level]
+                weights[from_index, index] = self.atomic_db.spontaneous_trans[to_index, from_index]
+            else:
+                raise ValueError('The sensitivity label: ' + str(label) + ' is not supported. Supported labels are '
+                                 'level populations, linear_density_attenuation and from-->to emission densities.')
+        return weights
+
     def compute_linear_density_attenuation(self):
         if self.__was_beamevolution_performed():
             self.profiles['linear_density_attenuation'] = self.profiles['level ' + self.atomic_db.inv_atomic_dict[0]]
@@ -109,6 +481,28 @@ class Beamlet:
         else:
             print('Beam evolution calculations were not performed. Execute solver first.')
 
+    def compute_table_attenuation(self, coefficient_table):
+        '''''
+        Fast alternative to the beam evolution: the linear density attenuation and the tabulated emission densities
+        are integrated from the effective coefficients of a BeamCoefficientTable along the beamlet grid.
+        '''''
+        electron_density = numpy.asarray(self.profiles['electron']['density']['m-3'], dtype=float)
+        electron_temperature = numpy.asarray(self.profiles['electron']['temperature']['eV'], dtype=float)
+        effective_charge = numpy.zeros(electron_density.shape)
+        for ion in self.components.T.keys():
+            if self.components['q'][ion] > 0:
+                effective_charge += float(self.components['q'][ion]) ** 2 * \
+                    numpy.asarray(self.profiles[ion]['density']['m-3'], dtype=float)
+        effective_charge /= electron_density
+        energy = float(self.param.getroot().find('body').find('beamlet_energy').text)
+        attenuation = coefficient_table.calculate_linear_density_attenuation(
+            self.profiles['beamlet grid']['distance']['m'], energy, effective_charge, electron_density,
+            electron_temperature, linear_density=self.__get_linear_density())
+        self.profiles['linear_density_attenuation'] = attenuation
+        for transition in coefficient_table.emission:
+            self.profiles[transition] = attenuation * electron_density * coefficient_table.get_emission_coefficient(
+                transition, energy, effective_charge, electron_density, electron_temperature)
+
     def compute_relative_populations(self, reference_level=None):
         if self.__was_beamevolution_performed():
             if reference_level is None:
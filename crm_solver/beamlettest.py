@@ -2,6 +2,8 @@ from crm_solver.beamlet import Beamlet
 import unittest
 from lxml import etree
 from crm_solver.atomic_db import AtomicDB
+from crm_solver.ode import Ode
+from copy import deepcopy
 import pandas
 import numpy
 
@@ -23,6 +25,21 @@ class BeamletTest(unittest.TestCase):
     EXPECTED_ATTENUATION_KEY = 'linear_density_attenuation'
     INPUT_TRANSITION = ['2s', '2p', '5s', '5p']
     EXPECTED_ELEMENTS_3 = 3
+    EXPECTED_SOLVER_PRECISION = 1E-3
+    EXPECTED_SCALING_PRECISION = 1E-5
+    INPUT_CURRENT_SCALING = 2.
+    INPUT_PRE_EXCITATION = 0.2
+    INPUT_PERTURBATION_START = 60
+    INPUT_PERTURBATION = 1.5
+    INPUT_RESPONSE_NODES = [0, 40, 100]
+    INPUT_FINITE_DIFFERENCE = 1E-4
+    EXPECTED_RESPONSE_PRECISION = 1E-6
+    INPUT_TEMPERATURE_SHIFT = 1.0123
+    EXPECTED_SENSITIVITY_PRECISION = 1E-5
+    INPUT_FAST_LEVELS = ['4s', '4p', '4d', '4f']
+    INPUT_ADAPTIVE_TOLERANCE = 1E-3
+    INPUT_COARSE_GRID_STEP = 20
+    INPUT_DENSE_GRID_LENGTH = 2001
 
     def setUp(self):
         self.beamlet = Beamlet()
@@ -94,8 +111,14 @@ class BeamletTest(unittest.TestCase):
                                   msg='Profiles key description fails for test case.')
 
     def test_analytical_solver(self):
-        with self.assertRaises(NotImplementedError):
-            actual = Beamlet(solver='analytical')
+        actual = Beamlet(solver='analytical')
+        self.assertTupleEqual(actual.profiles.shape, self.beamlet.profiles.shape,
+                              msg='Analytical solver failed to provide expected output into plasma profiles.')
+        for level in range(actual.atomic_db.atomic_ceiling):
+            label = 'level ' + actual.atomic_db.inv_atomic_dict[level]
+            tolerance = self.EXPECTED_SOLVER_PRECISION * self.beamlet.profiles[label].abs().max()
+            numpy.testing.assert_allclose(actual.profiles[label], self.beamlet.profiles[label], atol=tolerance,
+                                          err_msg='Analytical and numerical solvers differ on ' + label + '.')
 
     def test_numerical_solver(self):
         self.assertTupleEqual(self.beamlet.profiles.shape, (self.EXPECTED_PROFILES_LENGTH,
@@ -206,3 +229,243 @@ class BeamletTest(unittest.TestCase):
                              str(self.beamlet.atomic_db.atomic_ceiling) + ' less columns.')
         self.assertEqual(actual.profiles.filter(like='level').shape[1], 0,
                          msg='The copy without results is expected NOT to contain any columns labeled <level>.')
+
+    def test_current_scaling(self):
+        self.beamlet.compute_linear_density_attenuation()
+        self.beamlet.compute_linear_emission_density(to_level=self.INPUT_TRANSITION[0],
+                                                     from_level=self.INPUT_TRANSITION[1])
+        transition = self.INPUT_TRANSITION[1] + '-->' + self.INPUT_TRANSITION[0]
+        attenuation = self.beamlet.profiles[self.EXPECTED_ATTENUATION_KEY].copy()
+        emission = self.beamlet.profiles[transition].copy()
+        current = float(self.beamlet.param.getroot().find('body').find('beamlet_current').text)
+        param = deepcopy(self.beamlet.param)
+        param.getroot().find('body').find('beamlet_current').text = str(current * self.INPUT_CURRENT_SCALING)
+        reference = Beamlet(param=param)
+        input_param = self.beamlet.param
+        self.beamlet.scale_to_current(current * self.INPUT_CURRENT_SCALING)
+        self.assertEqual(float(input_param.getroot().find('body').find('beamlet_current').text), current,
+                         msg='Current scaling is expected to leave the input parameters unchanged.')
+        self.assertAlmostEqual(self.beamlet.initial_condition[0], reference.initial_condition[0],
+                               msg='Initial condition is expected to follow the beamlet current.')
+        for level in range(self.beamlet.atomic_db.atomic_ceiling):
+            label = 'level ' + self.beamlet.atomic_db.inv_atomic_dict[level]
+            tolerance = self.EXPECTED_SCALING_PRECISION * reference.profiles[label].abs().max()
+            numpy.testing.assert_allclose(self.beamlet.profiles[label], reference.profiles[label], atol=tolerance,
+                                          err_msg='Scaled populations differ from the solution on ' + label + '.')
+        numpy.testing.assert_allclose(self.beamlet.profiles[self.EXPECTED_ATTENUATION_KEY],
+                                      attenuation * self.INPUT_CURRENT_SCALING, rtol=1E-12,
+                                      err_msg='Attenuation is expected to be rescaled with the current.')
+        numpy.testing.assert_allclose(self.beamlet.profiles[transition], emission * self.INPUT_CURRENT_SCALING,
+                                      rtol=1E-12,
+                                      err_msg='Emission density is expected to be rescaled with the current.')
+
+    def test_fundamental_solution(self):
+        levels = self.beamlet.atomic_db.atomic_ceiling
+        fundamental = self.beamlet.calculate_fundamental_solution()
+        self.assertTupleEqual(fundamental.shape, (self.EXPECTED_PROFILES_LENGTH, levels, levels),
+                              msg='Fundamental solution is expected on the beamlet grid for all initial levels.')
+        initial_fractions = numpy.zeros(levels)
+        initial_fractions[:2] = [1. - self.INPUT_PRE_EXCITATION, self.INPUT_PRE_EXCITATION]
+        initial_condition = numpy.sum(self.beamlet.initial_condition) * initial_fractions
+        reference = Ode(coeff_matrix=self.beamlet.coefficient_matrix.matrix, init_condition=initial_condition).\
+            calculate_numerical_solution(self.beamlet.profiles['beamlet grid']['distance']['m'],
+                                         interpolation='piecewise_linear')
+        self.beamlet.set_initial_fractions(initial_fractions)
+        numpy.testing.assert_allclose(self.beamlet.initial_condition, initial_condition, rtol=1E-12,
+                                      err_msg='Initial condition is expected to follow the initial fractions.')
+        for level in range(levels):
+            label = 'level ' + self.beamlet.atomic_db.inv_atomic_dict[level]
+            tolerance = self.EXPECTED_SCALING_PRECISION * numpy.abs(reference[:, level]).max()
+            numpy.testing.assert_allclose(self.beamlet.profiles[label], reference[:, level], atol=tolerance,
+                                          err_msg='Pre-excited beam populations differ on ' + label + '.')
+
+    def test_invalid_initial_fractions(self):
+        with self.assertRaises(ValueError):
+            self.beamlet.set_initial_fractions([1.])
+        with self.assertRaises(ValueError):
+            self.beamlet.set_initial_fractions(-numpy.identity(self.beamlet.atomic_db.atomic_ceiling)[0])
+
+    def test_partial_resolve(self):
+        self.beamlet.compute_linear_density_attenuation()
+        checkpoints = self.beamlet.checkpoints.copy()
+        profile_update = self.beamlet._copy_profiles_input()
+        profile_update.loc[self.INPUT_PERTURBATION_START:, ('electron', 'density', 'm-3')] *= self.INPUT_PERTURBATION
+        reference = Beamlet(param=self.beamlet.param, profiles=profile_update.copy(),
+                            components=self.beamlet.components, atomic_db=self.beamlet.atomic_db)
+        reference.compute_linear_density_attenuation()
+        restart = self.beamlet.resolve_from(profile_update)
+        self.assertEqual(restart, self.INPUT_PERTURBATION_START - 1,
+                         msg='Integration is expected to restart at the segment of the first changed grid point.')
+        numpy.testing.assert_array_equal(self.beamlet.checkpoints[:restart + 1], checkpoints[:restart + 1],
+                                         err_msg='Populations before the perturbation are expected to be kept.')
+        for level in range(self.beamlet.atomic_db.atomic_ceiling):
+            label = 'level ' + self.beamlet.atomic_db.inv_atomic_dict[level]
+            tolerance = self.EXPECTED_SOLVER_PRECISION * reference.profiles[label].abs().max()
+            numpy.testing.assert_allclose(self.beamlet.profiles[label], reference.profiles[label], atol=tolerance,
+                                          err_msg='Partial re-solve differs from the full solution on ' + label + '.')
+        numpy.testing.assert_allclose(self.beamlet.profiles[self.EXPECTED_ATTENUATION_KEY],
+                                      reference.profiles[self.EXPECTED_ATTENUATION_KEY],
+                                      rtol=self.EXPECTED_SOLVER_PRECISION,
+                                      err_msg='Attenuation is expected to follow the partial re-solve.')
+
+    def test_unchanged_partial_resolve(self):
+        checkpoints = self.beamlet.checkpoints.copy()
+        restart = self.beamlet.resolve_from(self.beamlet._copy_profiles_input())
+        self.assertEqual(restart, self.EXPECTED_PROFILES_LENGTH, msg='Unchanged profiles are not expected to restart.')
+        numpy.testing.assert_array_equal(self.beamlet.checkpoints, checkpoints)
+
+    def test_partial_resolve_grid_mismatch(self):
+        profile_update = self.beamlet._copy_profiles_input()
+        profile_update[('beamlet grid', 'distance', 'm')] *= self.INPUT_PERTURBATION
+        with self.assertRaises(ValueError):
+            self.beamlet.resolve_from(profile_update)
+
+    def test_emission_response(self):
+        beamlet = Beamlet(param=self.beamlet.param, profiles=self.beamlet._copy_profiles_input(),
+                          components=self.beamlet.components, atomic_db=self.beamlet.atomic_db, solver='analytical')
+        transition = self.INPUT_TRANSITION[1] + '-->' + self.INPUT_TRANSITION[0]
+        response = beamlet.calculate_emission_response(to_level=self.INPUT_TRANSITION[0],
+                                                       from_level=self.INPUT_TRANSITION[1])
+        self.assertTupleEqual(response.shape, (self.EXPECTED_PROFILES_LENGTH, self.EXPECTED_PROFILES_LENGTH),
+                              msg='Emission response is expected for all grid point pairs.')
+        beamlet.compute_linear_emission_density(to_level=self.INPUT_TRANSITION[0], from_level=self.INPUT_TRANSITION[1])
+        profiles = beamlet._copy_profiles_input()
+        density = profiles[('electron', 'density', 'm-3')]
+        for node in self.INPUT_RESPONSE_NODES:
+            step = self.INPUT_FINITE_DIFFERENCE * density[node]
+            emissions = []
+            for sign in (1., -1.):
+                profile_update = profiles.copy()
+                profile_update.loc[node, ('electron', 'density', 'm-3')] = density[node] + sign * step
+                beamlet.resolve_from(profile_update)
+                emissions.append(beamlet.profiles[transition].values.copy())
+            expected = (emissions[0] - emissions[1]) / (2. * step)
+            numpy.testing.assert_allclose(response[:, node], expected,
+                                          atol=self.EXPECTED_RESPONSE_PRECISION * numpy.abs(expected).max(),
+                                          err_msg='Emission response differs from finite differences at node ' +
+                                                  str(node) + '.')
+        numpy.testing.assert_array_equal(response[:self.INPUT_RESPONSE_NODES[1], self.INPUT_RESPONSE_NODES[1]], 0.,
+                                         err_msg='Emission is not expected to respond to downstream perturbations.')
+
+    def test_profile_sensitivity(self):
+        # Temperatures are moved off the rate table knots, where the temperature derivative is one-sided.
+        profiles = self.beamlet._copy_profiles_input()
+        profiles[('electron', 'temperature', 'eV')] *= self.INPUT_TEMPERATURE_SHIFT
+        beamlet = Beamlet(param=self.beamlet.param, profiles=profiles.copy(), components=self.beamlet.components,
+                          atomic_db=self.beamlet.atomic_db, solver='analytical')
+        sensitivity = beamlet.calculate_profile_sensitivity()
+        labels = ['level ' + self.beamlet.atomic_db.inv_atomic_dict[level]
+                  for level in range(self.beamlet.atomic_db.atomic_ceiling)] + [self.EXPECTED_ATTENUATION_KEY]
+        for profile_key in [('electron', 'density', 'm-3'), ('electron', 'temperature', 'eV')]:
+            self.assertSetEqual(set(sensitivity[profile_key].keys()), set(labels),
+                                msg='Sensitivities are expected for all levels and the attenuation.')
+            profile = profiles[profile_key]
+            for node in self.INPUT_RESPONSE_NODES:
+                step = self.INPUT_FINITE_DIFFERENCE * profile[node]
+                results = []
+                for sign in (1., -1.):
+                    profile_update = profiles.copy()
+                    profile_update.loc[node, profile_key] = profile[node] + sign * step
+                    beamlet.resolve_from(profile_update)
+                    beamlet.compute_linear_density_attenuation()
+                    results.append(beamlet.profiles[labels].values.copy())
+                expected = (results[0] - results[1]) / (2. * step)
+                for index, label in enumerate(labels):
+                    numpy.testing.assert_allclose(sensitivity[profile_key][label][:, node], expected[:, index],
+                                                  atol=self.EXPECTED_SENSITIVITY_PRECISION *
+                                                  numpy.abs(expected[:, index]).max(),
+                                                  err_msg='Sensitivity of ' + label + ' to ' + ' '.join(profile_key) +
+                                                          ' differs from finite differences at node ' + str(node) + '.')
+
+    def test_selected_profile_sensitivity(self):
+        beamlet = Beamlet(param=self.beamlet.param, profiles=self.beamlet._copy_profiles_input(),
+                          components=self.beamlet.components, atomic_db=self.beamlet.atomic_db, solver='analytical')
+        transition = self.INPUT_TRANSITION[1] + '-->' + self.INPUT_TRANSITION[0]
+        response = beamlet.calculate_emission_response(to_level=self.INPUT_TRANSITION[0],
+                                                       from_level=self.INPUT_TRANSITION[1])
+        full = beamlet.calculate_profile_sensitivity()
+        selected = beamlet.calculate_profile_sensitivity([self.EXPECTED_ATTENUATION_KEY, transition])
+        density_key = ('electron', 'density', 'm-3')
+        self.assertSetEqual(set(selected[density_key].keys()), {self.EXPECTED_ATTENUATION_KEY, transition})
+        numpy.testing.assert_allclose(selected[density_key][self.EXPECTED_ATTENUATION_KEY],
+                                      full[density_key][self.EXPECTED_ATTENUATION_KEY])
+        numpy.testing.assert_allclose(selected[density_key][transition], response)
+        with self.assertRaises(ValueError):
+            beamlet.calculate_profile_sensitivity(['electron density'])
+
+    def test_quasi_steady_state_solver(self):
+        full_populations = self.beamlet.checkpoints.copy()
+        report = self.beamlet.solve_quasi_steady_state(self.INPUT_FAST_LEVELS, compare=True)
+        self.assertListEqual(report['fast_levels'], self.INPUT_FAST_LEVELS)
+        self.assertIsNotNone(report['reduced_statistics'], msg='Reduced solver statistics are expected.')
+        fast_indices = [self.beamlet.atomic_db.atomic_dict[level] for level in self.INPUT_FAST_LEVELS]
+        for step in range(self.EXPECTED_PROFILES_LENGTH):
+            derivatives = numpy.dot(self.beamlet.checkpoints[step], self.beamlet.coefficient_matrix.matrix[:, :, step])
+            numpy.testing.assert_allclose(derivatives[fast_indices], 0.,
+                                          atol=1E-9 * numpy.abs(derivatives).max(),
+                                          err_msg='Fast levels are expected to be in quasi-steady state.')
+        for level in range(self.beamlet.atomic_db.atomic_ceiling):
+            label = 'level ' + self.beamlet.atomic_db.inv_atomic_dict[level]
+            expected = numpy.max(numpy.abs(self.beamlet.profiles[label] - full_populations[:, level])) / \
+                numpy.max(numpy.abs(full_populations[:, level]))
+            self.assertAlmostEqual(report['relative_errors'][label], expected, delta=1E-9,
+                                   msg='Reported error differs from the deviation of the full solution on ' + label)
+        self.assertIn(self.EXPECTED_ATTENUATION_KEY, report['relative_errors'])
+
+    def test_quasi_steady_state_without_reference(self):
+        report = self.beamlet.solve_quasi_steady_state(self.INPUT_FAST_LEVELS)
+        self.assertNotIn('relative_errors', report, msg='The full system is only expected to be solved on request.')
+        self.assertNotIn('full_statistics', report)
+
+    def test_quasi_steady_state_invalid_level(self):
+        with self.assertRaises(ValueError):
+            self.beamlet.solve_quasi_steady_state(['1x'])
+
+    def test_adaptive_solver(self):
+        full_populations = self.beamlet.checkpoints.copy()
+        self.beamlet.solve_adaptively(self.INPUT_ADAPTIVE_TOLERANCE)
+        grid = self.beamlet.profiles['beamlet grid']['distance']['m']
+        self.assertLess(self.beamlet.adaptive_grid.size, self.EXPECTED_PROFILES_LENGTH,
+                        msg='Adaptive grid is expected to use fewer points than the beamlet grid.')
+        self.assertEqual(self.beamlet.adaptive_grid[0], grid.iloc[0])
+        self.assertEqual(self.beamlet.adaptive_grid[-1], grid.iloc[-1])
+        for level in range(self.beamlet.atomic_db.atomic_ceiling):
+            label = 'level ' + self.beamlet.atomic_db.inv_atomic_dict[level]
+            tolerance = 2. * self.INPUT_ADAPTIVE_TOLERANCE * numpy.abs(full_populations[:, level]).max()
+            numpy.testing.assert_allclose(self.beamlet.profiles[label], full_populations[:, level], atol=tolerance,
+                                          err_msg='Adaptive solution differs from the full solution on ' + label)
+
+    def test_adaptive_sub_grid_refinement(self):
+        input_profiles = self.beamlet._copy_profiles_input()
+        coarse_profiles = input_profiles.iloc[::self.INPUT_COARSE_GRID_STEP].reset_index(drop=True)
+        beamlet = Beamlet(param=self.beamlet.param, profiles=coarse_profiles.copy(), components=self.beamlet.components,
+                          atomic_db=self.beamlet.atomic_db, solver='adaptive')
+        coarse_grid = coarse_profiles['beamlet grid']['distance']['m'].values
+        self.assertTrue(numpy.any(~numpy.isin(beamlet.adaptive_grid, coarse_grid)),
+                        msg='Adaptive grid is expected to refine between the beamlet grid points.')
+        dense_grid = numpy.linspace(coarse_grid[0], coarse_grid[-1], self.INPUT_DENSE_GRID_LENGTH)
+        dense_profiles = pandas.DataFrame({column: numpy.interp(dense_grid, coarse_grid, coarse_profiles[column].values)
+                                           for column in coarse_profiles.columns}, columns=coarse_profiles.columns)
+        reference = Beamlet(param=self.beamlet.param, profiles=dense_profiles, components=self.beamlet.components,
+                            atomic_db=self.beamlet.atomic_db)
+        for level in range(self.beamlet.atomic_db.atomic_ceiling):
+            label = 'level ' + self.beamlet.atomic_db.inv_atomic_dict[level]
+            expected = numpy.interp(coarse_grid, dense_grid, reference.checkpoints[:, level])
+            numpy.testing.assert_allclose(beamlet.profiles[label], expected,
+                                          atol=2. * self.INPUT_ADAPTIVE_TOLERANCE * numpy.abs(expected).max(),
+                                          err_msg='Adaptive solution differs from the dense solution on ' + label)
+
+    def test_adaptive_solver_without_current(self):
+        param = deepcopy(self.beamlet.param)
+        param.getroot().find('body').find('beamlet_current').text = '0'
+        beamlet = Beamlet(param=param, profiles=self.beamlet._copy_profiles_input(),
+                          components=self.beamlet.components, atomic_db=self.beamlet.atomic_db, solver='adaptive')
+        numpy.testing.assert_array_equal(beamlet.checkpoints, 0.,
+                                         err_msg='Populations are expected to vanish without beamlet current.')
+
+    def test_adaptive_solver_option(self):
+        beamlet = Beamlet(param=self.beamlet.param, profiles=self.beamlet._copy_profiles_input(),
+                          components=self.beamlet.components, atomic_db=self.beamlet.atomic_db, solver='adaptive')
+        self.assertIsNotNone(beamlet.adaptive_grid, msg='Adaptive solver is expected to set the adaptive grid.')
+        with self.assertRaises(ValueError):
+            beamlet.solve_adaptively(0.)
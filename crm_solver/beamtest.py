@@ -0,0 +1,155 @@
+import io
+import unittest
+import numpy
+from contextlib import redirect_stdout
+from copy import deepcopy
+from crm_solver.beam import MultiEnergyBeamlet, Beam
+from crm_solver.beamlet import Beamlet
+
+
+class MultiEnergyBeamletTest(unittest.TestCase):
+    INPUT_SPECIES = 'H'
+    INPUT_CURRENT_FRACTIONS = [0.5, 0.3, 0.2]
+    INPUT_ENERGY_RATIOS = [1., 5. / 6., 2. / 3.]
+    INPUT_TRANSITION = ['2n', '3n']
+    INPUT_FRACTIONAL_ENERGY_RATIO = 0.7654321
+    INPUT_ENERGY_GRID = ['40', '50', '60']
+    EXPECTED_SOLVER_PRECISION = 1E-5
+
+    def setUp(self):
+        self.param = deepcopy(Beamlet(solver='disregard').param)
+        self.param.getroot().find('body').find('beamlet_species').text = self.INPUT_SPECIES
+        self.beamlet = MultiEnergyBeamlet(self.INPUT_CURRENT_FRACTIONS, param=self.param,
+                                          energy_ratios=self.INPUT_ENERGY_RATIOS)
+
+    def tearDown(self):
+        del self.beamlet
+
+    def test_energy_components(self):
+        energy = float(self.param.getroot().find('body').find('beamlet_energy').text)
+        current = float(self.param.getroot().find('body').find('beamlet_current').text)
+        for beamlet, ratio, fraction in zip(self.beamlet.beamlets, self.INPUT_ENERGY_RATIOS,
+                                            self.INPUT_CURRENT_FRACTIONS):
+            body = beamlet.param.getroot().find('body')
+            self.assertAlmostEqual(float(body.find('beamlet_energy').text), energy * ratio)
+            self.assertAlmostEqual(float(body.find('beamlet_current').text), current * fraction)
+
+    def test_batched_solution(self):
+        transition = self.INPUT_TRANSITION[1] + '-->' + self.INPUT_TRANSITION[0]
+        self.beamlet.compute_linear_emission_density(to_level=self.INPUT_TRANSITION[0],
+                                                     from_level=self.INPUT_TRANSITION[1])
+        component_emission = self.beamlet.get_component_profiles(transition)
+        for index, component in enumerate(self.beamlet.beamlets):
+            reference = Beamlet(param=component.param, profiles=component._copy_profiles_input(),
+                                components=component.components, atomic_db=component.atomic_db)
+            reference.compute_linear_emission_density(to_level=self.INPUT_TRANSITION[0],
+                                                      from_level=self.INPUT_TRANSITION[1])
+            expected = reference.profiles[transition].values.reshape(-1)
+            numpy.testing.assert_allclose(component_emission[index], expected,
+                                          atol=self.EXPECTED_SOLVER_PRECISION * numpy.abs(expected).max(),
+                                          err_msg='Batched energy component differs from a single beamlet solve.')
+        numpy.testing.assert_allclose(self.beamlet.profiles[transition].values.reshape(-1),
+                                      numpy.sum(component_emission, axis=0), rtol=1E-12,
+                                      err_msg='Summed emission is expected to add up the energy components.')
+
+    def test_summed_attenuation(self):
+        self.beamlet.compute_linear_density_attenuation()
+        numpy.testing.assert_allclose(self.beamlet.profiles['linear_density_attenuation'].values.reshape(-1)[0],
+                                      sum(beamlet.initial_condition[0] for beamlet in self.beamlet.beamlets),
+                                      rtol=1E-12, err_msg='Summed attenuation is expected to start from the total '
+                                                          'linear density.')
+
+    def test_analytical_batched_solution(self):
+        beamlet = MultiEnergyBeamlet(self.INPUT_CURRENT_FRACTIONS, param=self.param,
+                                     energy_ratios=self.INPUT_ENERGY_RATIOS, solver='analytical')
+        for component in beamlet.beamlets:
+            expected = component.get_ode().calculate_analytical_solution(
+                component.profiles['beamlet grid']['distance']['m'])
+            numpy.testing.assert_allclose(component.checkpoints, expected, rtol=1E-12,
+                                          err_msg='Batched analytical component differs from a single beamlet solve.')
+            self.assertEqual(component.solver, 'analytical')
+
+    def test_full_precision_energy(self):
+        energy = float(self.param.getroot().find('body').find('beamlet_energy').text)
+        beamlet = MultiEnergyBeamlet([1.], param=self.param, energy_ratios=[self.INPUT_FRACTIONAL_ENERGY_RATIO],
+                                     energy_grid=self.INPUT_ENERGY_GRID, solver='disregard')
+        self.assertEqual(float(beamlet.beamlets[0].param.getroot().find('body').find('beamlet_energy').text),
+                         energy * self.INPUT_FRACTIONAL_ENERGY_RATIO)
+
+    def test_quiet_construction(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            MultiEnergyBeamlet(self.INPUT_CURRENT_FRACTIONS, param=self.param, energy_ratios=self.INPUT_ENERGY_RATIOS)
+        self.assertNotIn('Beam evolution not calculated.', output.getvalue())
+
+    def test_invalid_fractions(self):
+        with self.assertRaises(ValueError):
+            MultiEnergyBeamlet([0.5, 0.3], param=self.param, energy_ratios=self.INPUT_ENERGY_RATIOS,
+                               solver='disregard')
+        with self.assertRaises(ValueError):
+            MultiEnergyBeamlet([0.5, 0.3, 0.3], param=self.param, energy_ratios=self.INPUT_ENERGY_RATIOS,
+                               solver='disregard')
+
+
+class BeamTest(unittest.TestCase):
+    INPUT_WIDTH = 0.01
+    INPUT_DIVERGENCE = 0.02
+    INPUT_BEAMLET_RESOLUTION = 3
+    INPUT_TRANSITION = ['2s', '2p']
+    EXPECTED_BEAMLET_NUMBER_2D = 3
+    EXPECTED_BEAMLET_NUMBER_3D = 5
+    EXPECTED_SOLVER_PRECISION = 1E-5
+    EXPECTED_ANALYTICAL_PRECISION = 1E-5
+
+    def setUp(self):
+        self.beamlet = Beamlet()
+
+    def tearDown(self):
+        del self.beamlet
+
+    def test_beamlet_geometry(self):
+        beam = Beam(param=self.beamlet.param, width=self.INPUT_WIDTH, divergence=self.INPUT_DIVERGENCE,
+                    beamlet_resolution=self.INPUT_BEAMLET_RESOLUTION, dimension=2, solver='disregard')
+        self.assertEqual(len(beam.beamlets), self.EXPECTED_BEAMLET_NUMBER_2D)
+        self.assertAlmostEqual(numpy.sum(beam.current_fractions), 1.)
+        self.assertTupleEqual(beam.positions.shape, (self.EXPECTED_BEAMLET_NUMBER_2D, len(self.beamlet.profiles), 3))
+        numpy.testing.assert_allclose(numpy.arccos(beam.directions[:, 2]),
+                                      [self.INPUT_DIVERGENCE, 0., self.INPUT_DIVERGENCE], atol=1E-12,
+                                      err_msg='Edge beamlets are expected to diverge by the divergence angle.')
+        beam = Beam(param=self.beamlet.param, width=self.INPUT_WIDTH, divergence=self.INPUT_DIVERGENCE,
+                    beamlet_resolution=self.INPUT_BEAMLET_RESOLUTION, dimension=3, solver='disregard')
+        self.assertEqual(len(beam.beamlets), self.EXPECTED_BEAMLET_NUMBER_3D,
+                         msg='Beamlet sources are expected within the beam cross-section.')
+        for beamlet in beam.beamlets:
+            self.assertIs(beamlet.atomic_db, beam.atomic_db, msg='Beamlets are expected to share the atomic data.')
+
+    def test_parallel_beam_in_slab_plasma(self):
+        beam = Beam(param=self.beamlet.param, width=self.INPUT_WIDTH,
+                    beamlet_resolution=self.INPUT_BEAMLET_RESOLUTION)
+        emission = beam.compute_linear_emission_density(to_level=self.INPUT_TRANSITION[0],
+                                                        from_level=self.INPUT_TRANSITION[1])
+        self.assertTupleEqual(emission.shape, (self.EXPECTED_BEAMLET_NUMBER_3D, len(self.beamlet.profiles)))
+        self.beamlet.compute_linear_emission_density(to_level=self.INPUT_TRANSITION[0],
+                                                     from_level=self.INPUT_TRANSITION[1])
+        transition = self.INPUT_TRANSITION[1] + '-->' + self.INPUT_TRANSITION[0]
+        expected = self.beamlet.profiles[transition].values.reshape(-1)
+        numpy.testing.assert_allclose(numpy.sum(emission, axis=0), expected,
+                                      atol=self.EXPECTED_SOLVER_PRECISION * numpy.abs(expected).max(),
+                                      err_msg='Parallel beamlets in a slab plasma are expected to add up to the '
+                                              'beamlet of the total current.')
+
+    def test_analytical_beam(self):
+        numerical = Beam(param=self.beamlet.param, width=self.INPUT_WIDTH, divergence=self.INPUT_DIVERGENCE,
+                         beamlet_resolution=self.INPUT_BEAMLET_RESOLUTION, dimension=2)
+        analytical = Beam(param=self.beamlet.param, width=self.INPUT_WIDTH, divergence=self.INPUT_DIVERGENCE,
+                          beamlet_resolution=self.INPUT_BEAMLET_RESOLUTION, dimension=2, solver='analytical')
+        expected = numerical.compute_linear_density_attenuation()
+        numpy.testing.assert_allclose(analytical.compute_linear_density_attenuation(), expected,
+                                      atol=self.EXPECTED_ANALYTICAL_PRECISION * numpy.abs(expected).max(),
+                                      err_msg='Analytical beam is expected to agree with the numerical beam.')
+        self.assertIsNone(analytical.solver_statistics)
+
+    def test_invalid_plasma(self):
+        with self.assertRaises(ValueError):
+            Beam(param=self.beamlet.param, plasma=lambda points: {('ion9', 'density', 'm-3'): points[:, 2]},
+                 solver='disregard')
@@ -0,0 +1,157 @@
+import numpy
+from scipy.interpolate import RegularGridInterpolator
+from crm_solver.atomic_bundle import AtomicBundle
+from crm_solver.atomic_db import atomic_db_cache
+from crm_solver.coefficientmatrix import CoefficientMatrix
+from utility.input import BeamletInput
+
+
+class BeamCoefficientTable:
+    '''''
+    Effective beam stopping and emission coefficients on a (energy, Z_eff, n_e, T) grid, derived from the full CRM in
+    homogeneous plasmas of electrons, a main ion and an impurity, with equal electron and ion temperatures.
+    In a homogeneous plasma the populations relax to the dominant eigenmode of the coefficient matrix, its decay rate
+    gives the stopping coefficient and its level distribution the emission coefficients.
+    Indexing convention: stopping[energy, effective_charge, density, temperature] in m3/s
+    '''''
+    TABLE_AXES = ('energy', 'effective_charge', 'density', 'temperature')
+
+    def __init__(self, axes, stopping, emission, velocity, projectile, main_ion, impurity):
+        self.axes = {name: numpy.asarray(axes[name], dtype=float) for name in self.TABLE_AXES}
+        self.stopping = numpy.asarray(stopping, dtype=float)
+        self.emission = {label: numpy.asarray(coefficient, dtype=float) for label, coefficient in emission.items()}
+        self.velocity = numpy.asarray(velocity, dtype=float)
+        self.projectile = projectile
+        self.main_ion = tuple(int(value) for value in main_ion)
+        self.impurity = tuple(int(value) for value in impurity)
+        for name in self.TABLE_AXES:
+            if self.axes[name].ndim != 1 or numpy.any(numpy.diff(self.axes[name]) <= 0):
+                raise ValueError('The ' + name + ' axis of the coefficient table is expected to be increasing.')
+        shape = tuple(self.axes[name].size for name in self.TABLE_AXES)
+        if self.stopping.shape != shape or any(coefficient.shape != shape for coefficient in self.emission.values()):
+            raise ValueError('The coefficient tables are expected on the ' + str(shape) + ' table grid.')
+
+    @classmethod
+    def generate(cls, projectile, energies, densities, temperatures, effective_charges=(1.,), transitions=(),
+                 main_ion=(1, 1, 2), impurity=(6, 6, 12)):
+        '''''
+        Transitions are given as (from_level, to_level) pairs, main_ion and impurity as (charge, atomic number,
+        mass number). Densities in m-3, temperatures in eV, energies in keV.
+        '''''
+        energies, densities, temperatures, effective_charges = \
+            [numpy.asarray(axis, dtype=float).reshape(-1) for axis in (energies, densities, temperatures,
+                                                                         effective_charges)]
+        if impurity[0] <= main_ion[0]:
+            raise ValueError('The impurity charge is expected to exceed the main ion charge.')
+        if numpy.any(effective_charges < main_ion[0]) or numpy.any(effective_charges > impurity[0]):
+            raise ValueError('Effective charges are expected between the main ion and the impurity charge.')
+        shape = (energies.size, effective_charges.size, densities.size, temperatures.size)
+        stopping = numpy.zeros(shape)
+        emission = {from_level + '-->' + to_level: numpy.zeros(shape) for from_level, to_level in transitions}
+        velocity = numpy.zeros(energies.size)
+        grid_charges, grid_densities, grid_temperatures = [axis.reshape(-1) for axis in numpy.meshgrid(
+            effective_charges, densities, temperatures, indexing='ij')]
+        impurity_densities = grid_densities * (grid_charges - main_ion[0]) / (impurity[0] * (impurity[0] - main_ion[0]))
+        main_ion_densities = (grid_densities - impurity[0] * impurity_densities) / main_ion[0]
+        for index, energy in enumerate(energies):
+            input_gen = BeamletInput(energy='{:g}'.format(energy), projectile=projectile,
+                                     source='BeamCoefficientTable', current=0.001, param_name='Coefficient table')
+            input_gen.add_grid(numpy.arange(grid_densities.size, dtype=float))
+            input_gen.add_target_profiles(charge=-1, atomic_number=0, mass_number=0, molecule_name=None,
+                                          density=grid_densities, temperature=grid_temperatures)
+            input_gen.add_target_profiles(charge=main_ion[0], atomic_number=main_ion[1], mass_number=main_ion[2],
+                                          molecule_name=None, density=main_ion_densities,
+                                          temperature=grid_temperatures)
+            input_gen.add_target_profiles(charge=impurity[0], atomic_number=impurity[1], mass_number=impurity[2],
+                                          molecule_name=None, density=impurity_densities,
+                                          temperature=grid_temperatures)
+            param, components, profiles = input_gen.get_beamlet_input()
+            atomic_db = atomic_db_cache.get_atomic_db(param=param, components=components)
+            coefficient_matrix = CoefficientMatrix(param, profiles, components, atomic_db)
+            decay_rates, fractions = cls.__get_dominant_modes(coefficient_matrix.matrix)
+            velocity[index] = atomic_db.velocity
+            stopping[index] = (decay_rates * atomic_db.velocity / grid_densities).reshape(shape[1:])
+            for from_level, to_level in transitions:
+                from_index, to_index = atomic_db.atomic_dict[from_level], atomic_db.atomic_dict[to_level]
+                emission[from_level + '-->' + to_level][index] = (fractions[:, from_index] / grid_densities *
+                                                                  atomic_db.spontaneous_trans[to_index, from_index]
+                                                                  ).reshape(shape[1:])
+        axes = dict(zip(cls.TABLE_AXES, (energies, effective_charges, densities, temperatures)))
+        return cls(axes, stopping, emission, velocity, projectile, main_ion, impurity)
+
+    @staticmethod
+    def __get_dominant_modes(matrix):
+        '''''
+        Slowest decaying eigenmode of the row vector system d(populations)/dx = populations @ matrix on every grid
+        point. Returns the decay rates and the level fractions of the modes.
+        '''''
+        eigenvalues, eigenvectors = numpy.linalg.eig(numpy.transpose(matrix, (2, 1, 0)))
+        dominant = numpy.argmax(eigenvalues.real, axis=1)
+        points = numpy.arange(matrix.shape[2])
+        fractions = eigenvectors[points, :, dominant].real
+        fractions /= numpy.sum(fractions, axis=1)[:, None]
+        return - eigenvalues[points, dominant].real, fractions
+
+    def save(self, table_path):
+        arrays = {'axes/' + name: axis for name, axis in self.axes.items()}
+        arrays.update({'emission/' + label: coefficient for label, coefficient in self.emission.items()})
+        arrays.update({'stopping': self.stopping, 'velocity': self.velocity, 'projectile': numpy.array(self.projectile),
+                       'main_ion': numpy.array(self.main_ion), 'impurity': numpy.array(self.impurity)})
+        AtomicBundle.write(table_path, arrays)
+
+    @classmethod
+    def load(cls, table_path):
+        bundle = AtomicBundle.open(table_path)
+        axes = {name: bundle.get_array('axes/' + name) for name in cls.TABLE_AXES}
+        emission = {name[len('emission/'):]: bundle.get_array(name) for name in bundle.keys()
+                    if name.startswith('emission/')}
+        return cls(axes, bundle.get_array('stopping'), emission, bundle.get_array('velocity'),
+                   str(bundle.get_array('projectile').reshape(-1)[0]), bundle.get_array('main_ion'),
+                   bundle.get_array('impurity'))
+
+    def get_stopping_coefficient(self, energy, effective_charge, density, temperature):
+        return self.__interpolate(self.stopping, energy, effective_charge, density, temperature)
+
+    def get_emission_coefficient(self, transition, energy, effective_charge, density, temperature):
+        if transition not in self.emission:
+            raise ValueError('The transition: ' + transition + ' is not tabulated. Tabulated transitions are: ' +
+                             ', '.join(self.emission.keys()))
+        return self.__interpolate(self.emission[transition], energy, effective_charge, density, temperature)
+
+    def get_velocity(self, energy):
+        if self.velocity.size == 1:
+            return self.velocity[0]
+        return numpy.interp(energy, self.axes['energy'], self.velocity)
+
+    def __interpolate(self, table, energy, effective_charge, density, temperature):
+        '''''
+        Linear interpolation in energy and effective charge, and in the logarithm of density and temperature.
+        Axes with a single point only accept their tabulated value.
+        '''''
+        points = numpy.broadcast_arrays(*[numpy.asarray(value, dtype=float) for value in
+                                          (energy, effective_charge, density, temperature)])
+        axes, coordinates = [], []
+        for name, values, logarithmic in zip(self.TABLE_AXES, points, (False, False, True, True)):
+            axis = self.axes[name]
+            if axis.size == 1:
+                if not numpy.allclose(values, axis[0]):
+                    raise ValueError('The coefficient table is only defined for ' + name + ': ' + str(axis[0]))
+                table = table[(slice(None),) * len(axes) + (0,)]
+                continue
+            axes.append(numpy.log(axis) if logarithmic else axis)
+            coordinates.append(numpy.log(values) if logarithmic else values)
+        if not axes:
+            return numpy.full(points[0].shape, float(table))
+        return RegularGridInterpolator(axes, table)(numpy.stack(coordinates, axis=-1))
+
+    def calculate_linear_density_attenuation(self, grid, energy, effective_charge, density, temperature,
+                                             linear_density=1.):
+        '''''
+        Beam linear density along the grid from d(linear_density)/dx = - n_e * S / v * linear_density
+        '''''
+        grid = numpy.asarray(grid, dtype=float)
+        attenuation_rates = numpy.asarray(density, dtype=float) * \
+            self.get_stopping_coefficient(energy, effective_charge, density, temperature) / self.get_velocity(energy)
+        optical_depth = numpy.concatenate([[0.], numpy.cumsum(numpy.diff(grid) * (attenuation_rates[:-1] +
+                                                                                   attenuation_rates[1:]) / 2.)])
+        return linear_density * numpy.exp(- optical_depth)
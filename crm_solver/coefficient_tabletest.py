@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+from crm_solver.atomic_bundle import AtomicBundle
+from crm_solver.beamlet import Beamlet
+from crm_solver.coefficient_table import BeamCoefficientTable
+from utility.input import BeamletInput
+
+
+class BeamCoefficientTableTest(unittest.TestCase):
+    INPUT_SPECIES = 'Li'
+    INPUT_ENERGIES = [60]
+    INPUT_DENSITIES = [1E18, 1E19, 5E19]
+    INPUT_TEMPERATURES = [100., 1000., 3000.]
+    INPUT_EFFECTIVE_CHARGES = [1., 1.5, 2.]
+    INPUT_TRANSITIONS = [('2p', '2s')]
+    INPUT_MAIN_ION = (1, 1, 2)
+    INPUT_IMPURITY = (2, 2, 4)
+    INPUT_GRID = numpy.linspace(0., 0.5, 201)
+    INPUT_DENSITY = 1E19
+    INPUT_TEMPERATURE = 1000.
+    INPUT_IMPURITY_FRACTION = 0.125
+    EXPECTED_DECAY_PRECISION = 1E-3
+    EXPECTED_EMISSION_PRECISION = 2E-2
+
+    @classmethod
+    def setUpClass(cls):
+        cls.table = BeamCoefficientTable.generate(cls.INPUT_SPECIES, cls.INPUT_ENERGIES, cls.INPUT_DENSITIES,
+                                                  cls.INPUT_TEMPERATURES, cls.INPUT_EFFECTIVE_CHARGES,
+                                                  transitions=cls.INPUT_TRANSITIONS, main_ion=cls.INPUT_MAIN_ION,
+                                                  impurity=cls.INPUT_IMPURITY)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        AtomicBundle.opened_bundles.clear()
+        shutil.rmtree(self.directory)
+
+    def test_table_shape(self):
+        expected_shape = (len(self.INPUT_ENERGIES), len(self.INPUT_EFFECTIVE_CHARGES), len(self.INPUT_DENSITIES),
+                          len(self.INPUT_TEMPERATURES))
+        self.assertTupleEqual(self.table.stopping.shape, expected_shape)
+        self.assertTrue(numpy.all(self.table.stopping > 0), msg='Stopping coefficients are expected to be positive.')
+        for from_level, to_level in self.INPUT_TRANSITIONS:
+            self.assertTupleEqual(self.table.emission[from_level + '-->' + to_level].shape, expected_shape)
+
+    def test_tabulated_values(self):
+        effective_charge, density, temperature = numpy.meshgrid(self.INPUT_EFFECTIVE_CHARGES, self.INPUT_DENSITIES,
+                                                                self.INPUT_TEMPERATURES, indexing='ij')
+        numpy.testing.assert_allclose(self.table.get_stopping_coefficient(self.INPUT_ENERGIES[0], effective_charge,
+                                                                          density, temperature),
+                                      self.table.stopping[0], rtol=1E-12,
+                                      err_msg='Interpolation is expected to reproduce the tabulated values.')
+
+    def test_save_and_load(self):
+        table_path = os.path.join(self.directory, 'coefficients.bundle')
+        self.table.save(table_path)
+        table = BeamCoefficientTable.load(table_path)
+        self.assertEqual(table.projectile, self.INPUT_SPECIES)
+        self.assertTupleEqual(table.impurity, self.INPUT_IMPURITY)
+        numpy.testing.assert_array_equal(table.stopping, self.table.stopping)
+        for label, coefficient in self.table.emission.items():
+            numpy.testing.assert_array_equal(table.emission[label], coefficient)
+
+    def test_out_of_table(self):
+        with self.assertRaises(ValueError):
+            self.table.get_stopping_coefficient(self.INPUT_ENERGIES[0], 1., self.INPUT_DENSITIES[-1] * 2.,
+                                                self.INPUT_TEMPERATURES[0])
+        with self.assertRaises(ValueError):
+            self.table.get_stopping_coefficient(self.INPUT_ENERGIES[0] / 2., 1., self.INPUT_DENSITIES[0],
+                                                self.INPUT_TEMPERATURES[0])
+
+    def test_invalid_effective_charge(self):
+        with self.assertRaises(ValueError):
+            BeamCoefficientTable.generate(self.INPUT_SPECIES, self.INPUT_ENERGIES, self.INPUT_DENSITIES,
+                                          self.INPUT_TEMPERATURES, [self.INPUT_IMPURITY[0] + 1.],
+                                          main_ion=self.INPUT_MAIN_ION, impurity=self.INPUT_IMPURITY)
+
+    def test_invalid_impurity_charge(self):
+        impurity = (self.INPUT_MAIN_ION[0],) + tuple(self.INPUT_IMPURITY[1:])
+        with self.assertRaises(ValueError):
+            BeamCoefficientTable.generate(self.INPUT_SPECIES, self.INPUT_ENERGIES, self.INPUT_DENSITIES,
+                                          self.INPUT_TEMPERATURES, [self.INPUT_MAIN_ION[0]],
+                                          main_ion=self.INPUT_MAIN_ION, impurity=impurity)
+
+    def test_homogeneous_plasma_against_crm(self):
+        beamlet = Beamlet(*self.build_homogeneous_beamlet_input())
+        beamlet.compute_linear_density_attenuation()
+        from_level, to_level = self.INPUT_TRANSITIONS[0]
+        beamlet.compute_linear_emission_density(to_level=to_level, from_level=from_level)
+        transition = from_level + '-->' + to_level
+        crm_attenuation = beamlet.profiles['linear_density_attenuation'].values.ravel().copy()
+        crm_emission = beamlet.profiles[transition].values.ravel().copy()
+        beamlet.compute_table_attenuation(self.table)
+        table_attenuation = beamlet.profiles['linear_density_attenuation'].values.ravel()
+        table_emission = beamlet.profiles[transition].values.ravel()
+        middle = self.INPUT_GRID.size // 2
+        self.assertAlmostEqual(table_attenuation[-1] / table_attenuation[middle],
+                               crm_attenuation[-1] / crm_attenuation[middle], delta=self.EXPECTED_DECAY_PRECISION,
+                               msg='Relaxed beam is expected to attenuate with the tabulated stopping coefficient.')
+        self.assertAlmostEqual(table_emission[-1] / table_attenuation[-1], crm_emission[-1] / crm_attenuation[-1],
+                               delta=self.EXPECTED_EMISSION_PRECISION * crm_emission[-1] / crm_attenuation[-1],
+                               msg='Relaxed beam is expected to emit with the tabulated emission coefficient.')
+
+    def build_homogeneous_beamlet_input(self):
+        input_gen = BeamletInput(energy=self.INPUT_ENERGIES[0], projectile=self.INPUT_SPECIES,
+                                 param_name='BeamCoefficientTable_test', source='Unittest', current=0.001)
+        input_gen.add_grid(self.INPUT_GRID)
+        density = numpy.full(self.INPUT_GRID.size, self.INPUT_DENSITY)
+        temperature = numpy.full(self.INPUT_GRID.size, self.INPUT_TEMPERATURE)
+        input_gen.add_target_profiles(charge=-1, atomic_number=0, mass_number=0, molecule_name=None,
+                                      density=density, temperature=temperature)
+        input_gen.add_target_profiles(charge=self.INPUT_MAIN_ION[0], atomic_number=self.INPUT_MAIN_ION[1],
+                                      mass_number=self.INPUT_MAIN_ION[2], molecule_name=None,
+                                      density=density * (1. - self.INPUT_IMPURITY[0] * self.INPUT_IMPURITY_FRACTION),
+                                      temperature=temperature)
+        input_gen.add_target_profiles(charge=self.INPUT_IMPURITY[0], atomic_number=self.INPUT_IMPURITY[1],
+                                      mass_number=self.INPUT_IMPURITY[2], molecule_name=None,
+                                      density=density * self.INPUT_IMPURITY_FRACTION, temperature=temperature)
+        param, components, profiles = input_gen.get_beamlet_input()
+        return param, profiles, components
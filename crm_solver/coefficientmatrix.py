@@ -4,20 +4,18 @@ import pandas
 
 
 class CoefficientMatrix:
-    def __init__(self, beamlet_param, beamlet_profiles, plasma_components, atomic_db):
+    '''''
+    In lean mode grid constant terms (photon_terms, neutral_terms) are stored once as read-only broadcast views and
+    the interpolated rate arrays (*_np) are released after assembly.
+    '''''
+    def __init__(self, beamlet_param, beamlet_profiles, plasma_components, atomic_db, lean=False):
         assert isinstance(beamlet_param, etree._ElementTree)
         assert isinstance(beamlet_profiles, pandas.DataFrame)
         self.beamlet_profiles = beamlet_profiles
-
-        # Initialize interpolation matrices
-        self.electron_impact_trans_np = numpy.zeros((atomic_db.atomic_ceiling, atomic_db.atomic_ceiling,
-                                                     self.beamlet_profiles['beamlet grid'].size))
-        self.electron_impact_loss_np = numpy.zeros((atomic_db.atomic_ceiling,
-                                                    self.beamlet_profiles['beamlet grid'].size))
-        self.ion_impact_trans_np = numpy.concatenate([[self.electron_impact_trans_np] * len(
-            [comp for comp in plasma_components['q'] if int(comp) > 0])])
-        self.ion_impact_loss_np = numpy.concatenate([[self.electron_impact_loss_np] * len(
-            [comp for comp in plasma_components['q'] if int(comp) > 0])])
+        self.plasma_components = plasma_components
+        self.lean = lean
+        self.__set_plasma_profiles(plasma_components, atomic_db)
+        self.__allocate_rate_arrays(atomic_db)
 
         # Initialize assembly matrices
         self.matrix = numpy.zeros(
@@ -28,8 +26,27 @@ class CoefficientMatrix:
             (atomic_db.atomic_ceiling, atomic_db.atomic_ceiling, self.beamlet_profiles['beamlet grid'].size))
         self.ion_terms = numpy.concatenate([[ion_terms] *
                                             len([comp for comp in plasma_components['q'] if int(comp) > 0])])
-        self.photon_terms = numpy.zeros(
-            (atomic_db.atomic_ceiling, atomic_db.atomic_ceiling, self.beamlet_profiles['beamlet grid'].size))
+        if not self.lean:
+            self.photon_terms = numpy.zeros(
+                (atomic_db.atomic_ceiling, atomic_db.atomic_ceiling, self.beamlet_profiles['beamlet grid'].size))
+            if atomic_db.are_neutrals:
+                self.neutral_terms = numpy.zeros((atomic_db.neutral_db.neutral_target_count, atomic_db.atomic_ceiling,
+                                                  atomic_db.atomic_ceiling, self.beamlet_profiles['beamlet grid'].size))
+
+        self.interpolate_rates(atomic_db, plasma_components)
+        self.assemble_matrix(atomic_db, plasma_components)
+        if self.lean:
+            self.__release_rate_arrays()
+
+    def __allocate_rate_arrays(self, atomic_db):
+        self.electron_impact_trans_np = numpy.zeros((atomic_db.atomic_ceiling, atomic_db.atomic_ceiling,
+                                                     self.beamlet_profiles['beamlet grid'].size))
+        self.electron_impact_loss_np = numpy.zeros((atomic_db.atomic_ceiling,
+                                                    self.beamlet_profiles['beamlet grid'].size))
+        self.ion_impact_trans_np = numpy.concatenate([[self.electron_impact_trans_np] * len(
+            [comp for comp in self.plasma_components['q'] if int(comp) > 0])])
+        self.ion_impact_loss_np = numpy.concatenate([[self.electron_impact_loss_np] * len(
+            [comp for comp in self.plasma_components['q'] if int(comp) > 0])])
 
         # Add neutrals to the coefficient matrix if there are any.
         if atomic_db.are_neutrals:
@@ -39,148 +56,196 @@ class CoefficientMatrix:
             self.neutral_impact_loss_np = numpy.zeros((atomic_db.neutral_db.neutral_target_count,
                                                        atomic_db.atomic_ceiling,
                                                        self.beamlet_profiles['beamlet grid'].size))
-            self.neutral_terms = numpy.zeros((atomic_db.neutral_db.neutral_target_count, atomic_db.atomic_ceiling,
-                                              atomic_db.atomic_ceiling, self.beamlet_profiles['beamlet grid'].size))
 
-        self.interpolate_rates(atomic_db, plasma_components)
-        self.assemble_matrix(atomic_db, plasma_components)
+    def __release_rate_arrays(self):
+        self.electron_impact_trans_np, self.electron_impact_loss_np = None, None
+        self.ion_impact_trans_np, self.ion_impact_loss_np = None, None
+        if hasattr(self, 'neutral_impact_trans_np'):
+            self.neutral_impact_trans_np, self.neutral_impact_loss_np = None, None
+
+    def __set_plasma_profiles(self, plasma_components, atomic_db):
+        self.electron_temperature = self.__get_profile('electron', 'temperature', 'eV')
+        self.electron_density = self.__get_profile('electron', 'density', 'm-3')
+        ion_count = len([comp for comp in plasma_components['q'] if int(comp) > 0])
+        self.ion_temperatures = numpy.array([self.__get_profile('ion' + str(ion + 1), 'temperature', 'eV')
+                                             for ion in range(ion_count)]).reshape(ion_count, -1)
+        self.ion_densities = numpy.array([self.__get_profile('ion' + str(ion + 1), 'density', 'm-3')
+                                          for ion in range(ion_count)]).reshape(ion_count, -1)
+        if atomic_db.are_neutrals:
+            self.neutral_densities = numpy.array([self.__get_profile('neutral' + str(neutral + 1), 'density', 'm-3')
+                                                  for neutral in range(atomic_db.neutral_db.neutral_target_count)])
+
+    def __get_profile(self, component, quantity, unit):
+        return numpy.asarray(self.beamlet_profiles[component][quantity][unit], dtype=float)
 
     def interpolate_rates(self, atomic_db, plasma_components):
-        for from_level in range(atomic_db.atomic_ceiling):
-            self.interpolate_electron_impact_loss(from_level, atomic_db)
-            for to_level in range(atomic_db.atomic_ceiling):
-                if to_level != from_level:
-                    self.interpolate_electron_impact_trans(from_level, to_level, atomic_db)
-        for ion in range(len([comp for comp in plasma_components['q'] if int(comp) > 0])):
-            for from_level in range(atomic_db.atomic_ceiling):
-                self.interpolate_ion_impact_loss(ion, from_level, atomic_db)
-                for to_level in range(atomic_db.atomic_ceiling):
-                    if to_level != from_level:
-                        self.interpolate_ion_impact_trans(ion, from_level, to_level, atomic_db)
+        if self.electron_impact_trans_np is None:
+            self.__allocate_rate_arrays(atomic_db)
+        diagonal = numpy.arange(atomic_db.atomic_ceiling)
+        self.electron_impact_loss_np[...] = atomic_db.electron_impact_loss_table.evaluate(self.electron_temperature)
+        self.electron_impact_trans_np[...] = atomic_db.electron_impact_trans_table.evaluate(self.electron_temperature)
+        self.electron_impact_trans_np[diagonal, diagonal, :] = 0.
+        for ion in range(self.ion_densities.shape[0]):
+            self.ion_impact_loss_np[ion] = atomic_db.ion_impact_loss_tables[ion].evaluate(self.ion_temperatures[ion])
+            self.ion_impact_trans_np[ion] = atomic_db.ion_impact_trans_tables[ion].evaluate(self.ion_temperatures[ion])
+        self.ion_impact_trans_np[:, diagonal, diagonal, :] = 0.
         if atomic_db.are_neutrals:
-            for neutral in range(atomic_db.neutral_db.neutral_target_count):
-                for from_level in range(atomic_db.atomic_ceiling):
-                    self.fetch_neutral_impact_loss(neutral, from_level, atomic_db)
-                    for to_level in range(atomic_db.atomic_ceiling):
-                        if to_level != from_level:
-                            self.fetch_neutral_impact_trans(neutral, from_level, to_level, atomic_db)
+            levels = atomic_db.atomic_ceiling
+            self.neutral_impact_loss_np[...] = atomic_db.neutral_db.neutral_impact_loss[:, :levels, numpy.newaxis]
+            self.neutral_impact_trans_np[...] = \
+                atomic_db.neutral_db.neutral_impact_trans[:, :levels, :levels, numpy.newaxis]
 
     def assemble_matrix(self, atomic_db, plasma_components):
-        for from_level in range(atomic_db.atomic_ceiling):
-            for to_level in range(atomic_db.atomic_ceiling):
-                if to_level == from_level:
-                    self.assemble_electron_impact_population_loss_terms(from_level, to_level, atomic_db)
-                else:
-                    self.assemble_electron_impact_population_gain_terms(from_level, to_level)
-        for step in range(self.beamlet_profiles['beamlet grid'].size):
-            self.apply_electron_density(step)
-        for ion in range(len([comp for comp in plasma_components['q'] if int(comp) > 0])):
-            for from_level in range(atomic_db.atomic_ceiling):
-                for to_level in range(atomic_db.atomic_ceiling):
-                    if to_level == from_level:
-                        self.assemble_ion_impact_population_loss_terms(ion, from_level, to_level, atomic_db)
-                    else:
-                        self.assemble_ion_impact_population_gain_terms(ion, from_level, to_level)
-            for step in range(self.beamlet_profiles['beamlet grid'].size):
-                self.apply_ion_density(ion, step)
-        for from_level in range(atomic_db.atomic_ceiling):
-            for to_level in range(atomic_db.atomic_ceiling):
-                if to_level == from_level:
-                    self.assemble_spontaneous_population_loss_terms(from_level, to_level, atomic_db)
-                else:
-                    self.assemble_spontaneous_population_gain_terms(from_level, to_level, atomic_db)
-        for step in range(self.beamlet_profiles['beamlet grid'].size):
-            self.apply_photons(step)
+        self.__assemble_rate_terms(atomic_db)
+        self.apply_densities()
+
+    def __assemble_rate_terms(self, atomic_db):
+        self.electron_terms[...] = self.assemble_rate_terms(self.electron_impact_trans_np,
+                                                            self.electron_impact_loss_np)
+        self.ion_terms[...] = self.assemble_rate_terms(self.ion_impact_trans_np, self.ion_impact_loss_np)
+        photon_terms = self.assemble_spontaneous_terms(atomic_db)[:, :, numpy.newaxis]
+        if self.lean:
+            self.photon_terms = numpy.broadcast_to(photon_terms, self.matrix.shape)
+        else:
+            self.photon_terms[...] = photon_terms
         if atomic_db.are_neutrals:
-            for neutral in range(atomic_db.neutral_db.neutral_target_count):
-                for from_level in range(atomic_db.atomic_ceiling):
-                    for to_level in range(atomic_db.atomic_ceiling):
-                        if to_level == from_level:
-                            self.assemble_neutral_impact_population_loss_terms(neutral, from_level, to_level, atomic_db)
-                        else:
-                            self.assemble_neutral_impact_population_gain_terms(neutral, from_level, to_level)
-                for step in range(self.beamlet_profiles['beamlet grid'].size):
-                    self.apply_neutral_density(neutral, step)
-
-    def interpolate_electron_impact_trans(self, from_level, to_level, atomic_db):
-        self.electron_impact_trans_np[from_level, to_level, :] \
-            = atomic_db.electron_impact_trans[from_level][to_level](
-                self.beamlet_profiles['electron']['temperature']['eV'][:])
-
-    def interpolate_ion_impact_trans(self, ion, from_level, to_level, atomic_db):
-        self.ion_impact_trans_np[ion, from_level, to_level, :] = \
-            atomic_db.ion_impact_trans[from_level][to_level][ion](
-                self.beamlet_profiles['ion'+str(ion+1)]['temperature']['eV'][:])
-
-    def interpolate_electron_impact_loss(self, from_level, atomic_db):
-        self.electron_impact_loss_np[from_level, :] = \
-            atomic_db.electron_impact_loss[from_level](self.beamlet_profiles['electron']['temperature']['eV'][:])
-
-    def interpolate_ion_impact_loss(self, ion, from_level, atomic_db):
-        self.ion_impact_loss_np[ion, from_level, :] = \
-            atomic_db.ion_impact_loss[from_level][ion](
-                self.beamlet_profiles['ion' + str(ion + 1)]['temperature']['eV'][:])
-
-    def fetch_neutral_impact_loss(self, neutral, from_level, atomic_db):
-        self.neutral_impact_loss_np[neutral, from_level, :] = atomic_db.neutral_db.\
-            get_neutral_impact_loss('neutral'+str(neutral+1), from_level)
-
-    def fetch_neutral_impact_trans(self, neutral, from_level, to_level, atomic_db):
-        self.neutral_impact_trans_np[neutral, from_level, to_level, :] = \
-            atomic_db.neutral_db.get_neutral_impact_transition('neutral'+str(neutral+1), from_level, to_level)
-
-    def assemble_electron_impact_population_loss_terms(self, from_level, to_level, atomic_db):
-        self.electron_terms[from_level, to_level, :] = \
-            - numpy.sum(self.electron_impact_trans_np[from_level, :to_level, :], axis=0) \
-            - numpy.sum(self.electron_impact_trans_np[from_level, (to_level + 1):atomic_db.atomic_ceiling, :], axis=0) \
-            - self.electron_impact_loss_np[from_level, :]
-
-    def assemble_neutral_impact_population_loss_terms(self, neutral, from_level, to_level, atomic_db):
-        self.neutral_terms[neutral, from_level, to_level, :] = (
-            - numpy.sum(self.neutral_impact_trans_np[neutral, from_level, :to_level, :], axis=0)
-            - numpy.sum(self.neutral_impact_trans_np[neutral, from_level,
-                        (to_level + 1):atomic_db.atomic_ceiling, :], axis=0)
-            - self.neutral_impact_loss_np[neutral, from_level, :])
-
-    def assemble_ion_impact_population_loss_terms(self, ion, from_level, to_level, atomic_db):
-        self.ion_terms[ion, from_level, to_level, :] = \
-            - numpy.sum(self.ion_impact_trans_np[ion, from_level, :to_level, :], axis=0) \
-            - numpy.sum(self.ion_impact_trans_np[ion, from_level, (to_level + 1):atomic_db.atomic_ceiling, :], axis=0) \
-            - self.ion_impact_loss_np[ion, from_level, :]
-
-    def assemble_electron_impact_population_gain_terms(self, from_level, to_level):
-        self.electron_terms[from_level, to_level, :] = \
-            self.electron_impact_trans_np[from_level, to_level, :]
-
-    def assemble_neutral_impact_population_gain_terms(self, neutral, from_level, to_level):
-        self.neutral_terms[neutral, from_level, to_level, :] = \
-            self.neutral_impact_trans_np[neutral, from_level, to_level, :]
-
-    def assemble_ion_impact_population_gain_terms(self, ion, from_level, to_level):
-        self.ion_terms[ion, from_level, to_level, :] = \
-            self.ion_impact_trans_np[ion, from_level, to_level, :]
-
-    def assemble_spontaneous_population_loss_terms(self, from_level, to_level, atomic_db):
-        self.photon_terms[from_level, to_level, :] = \
-            - numpy.sum(atomic_db.spontaneous_trans[:, from_level]) / atomic_db.velocity
-        
-    def assemble_spontaneous_population_gain_terms(self, from_level, to_level, atomic_db):
-        self.photon_terms[from_level, to_level, :] = \
-            atomic_db.spontaneous_trans[to_level, from_level] / atomic_db.velocity
-        
+            neutral_terms = self.assemble_rate_terms(self.neutral_impact_trans_np[..., :1],
+                                                     self.neutral_impact_loss_np[..., :1])
+            if self.lean:
+                self.neutral_terms = numpy.broadcast_to(neutral_terms, neutral_terms.shape[:-1] +
+                                                        self.matrix.shape[-1:])
+            else:
+                self.neutral_terms[...] = neutral_terms
+
+    def apply_densities(self):
+        '''''
+        Assembles the coefficient matrix from the temperature dependent rate terms and the current density profiles.
+        '''''
+        self.matrix[...] = self.electron_density * self.electron_terms + self.photon_terms
+        if self.ion_terms.shape[0] > 0:
+            self.matrix += numpy.einsum('in,ijkn->jkn', self.ion_densities, self.ion_terms)
+        if hasattr(self, 'neutral_terms'):
+            self.matrix += numpy.einsum('in,ijk->jkn', self.neutral_densities, self.neutral_terms[..., 0])
+
+    def update_densities(self, electron_density, ion_densities=None, neutral_densities=None):
+        '''''
+        Reassembles the coefficient matrix for new density profiles on the beamlet grid, keeping the temperature
+        dependent rate terms. Densities not provided are kept.
+        Indexing convention: electron_density[step], ion_densities[ion, step], neutral_densities[neutral, step]
+        '''''
+        self.electron_density = self.__check_density(electron_density, self.electron_density)
+        if ion_densities is not None:
+            self.ion_densities = self.__check_density(ion_densities, self.ion_densities)
+        if neutral_densities is not None:
+            if not hasattr(self, 'neutral_densities'):
+                raise ValueError('Neutral densities can not be updated for a plasma without neutral components.')
+            self.neutral_densities = self.__check_density(neutral_densities, self.neutral_densities)
+        self.apply_densities()
+
+    @staticmethod
+    def __check_density(density, reference):
+        density = numpy.asarray(density, dtype=float).reshape(reference.shape)
+        if not numpy.all(numpy.isfinite(density)):
+            raise ValueError('Density profiles are expected to be finite.')
+        return density
+
+    def update_profiles(self, beamlet_profiles, atomic_db):
+        '''''
+        Reassembles the coefficient matrix for new plasma profiles on the same beamlet grid and plasma components.
+        Rate interpolation and rate term assembly are skipped if the temperature profiles are unchanged.
+        '''''
+        assert isinstance(beamlet_profiles, pandas.DataFrame)
+        if not numpy.array_equal(numpy.asarray(beamlet_profiles['beamlet grid'], dtype=float),
+                                 numpy.asarray(self.beamlet_profiles['beamlet grid'], dtype=float)):
+            raise ValueError('Profile updates are expected to be given on the same beamlet grid.')
+        electron_temperature, ion_temperatures = self.electron_temperature, self.ion_temperatures
+        self.beamlet_profiles = beamlet_profiles
+        self.__set_plasma_profiles(self.plasma_components, atomic_db)
+        if not (numpy.array_equal(electron_temperature, self.electron_temperature) and
+                numpy.array_equal(ion_temperatures, self.ion_temperatures)):
+            self.interpolate_rates(atomic_db, self.plasma_components)
+            self.__assemble_rate_terms(atomic_db)
+            if self.lean:
+                self.__release_rate_arrays()
+        self.apply_densities()
+
+    def calculate_electron_temperature_terms(self, atomic_db):
+        '''''
+        Derivative of the electron rate terms with respect to the electron temperature on the beamlet grid.
+        Indexing convention: temperature_terms[from_level, to_level, step]
+        '''''
+        return self.assemble_rate_terms(atomic_db.electron_impact_trans_table.evaluate_derivative(
+            self.electron_temperature), atomic_db.electron_impact_loss_table.evaluate_derivative(
+            self.electron_temperature))
+
+    def calculate_quasi_steady_state_matrix(self, fast_levels):
+        '''''
+        Eliminates the fast levels algebraically, setting their derivatives to zero. With the remaining slow levels
+        the populations follow: d(slow)/dx = slow @ reduced_matrix, fast = slow @ fast_coupling
+        Indexing convention: reduced_matrix[from_level, to_level, step], fast_coupling[slow_level, fast_level, step]
+        '''''
+        levels = self.matrix.shape[0]
+        fast_levels = numpy.asarray(fast_levels, dtype=int).reshape(-1)
+        if fast_levels.size == 0 or numpy.unique(fast_levels).size != fast_levels.size or \
+                numpy.any(fast_levels < 0) or numpy.any(fast_levels >= levels) or fast_levels.size == levels:
+            raise ValueError('Fast levels are expected to be distinct atomic levels leaving at least one slow level.')
+        slow_levels = numpy.setdiff1d(numpy.arange(levels), fast_levels)
+        grid_matrices = numpy.moveaxis(self.matrix, 2, 0)
+        slow_to_fast = grid_matrices[:, slow_levels[:, None], fast_levels]
+        fast_to_slow = grid_matrices[:, fast_levels[:, None], slow_levels]
+        fast_to_fast = grid_matrices[:, fast_levels[:, None], fast_levels]
+        fast_coupling = - numpy.swapaxes(numpy.linalg.solve(numpy.swapaxes(fast_to_fast, 1, 2),
+                                                            numpy.swapaxes(slow_to_fast, 1, 2)), 1, 2)
+        reduced_matrix = grid_matrices[:, slow_levels[:, None], slow_levels] + numpy.matmul(fast_coupling,
+                                                                                            fast_to_slow)
+        return numpy.moveaxis(reduced_matrix, 0, 2), numpy.moveaxis(fast_coupling, 0, 2)
+
+    def get_memory_footprint(self):
+        '''''
+        Memory held by the numpy arrays of the instance in bytes, grid constant terms stored once are counted once.
+        '''''
+        footprint = {name: self.__get_array_memory(value) for name, value in vars(self).items()
+                     if isinstance(value, numpy.ndarray)}
+        footprint['total'] = sum(footprint.values())
+        return footprint
+
+    @staticmethod
+    def __get_array_memory(array):
+        return int(array.itemsize * numpy.prod([size for size, stride in zip(array.shape, array.strides)
+                                                if stride != 0 or size == 0], dtype=numpy.int64))
+
+    @staticmethod
+    def assemble_rate_terms(impact_trans, impact_loss):
+        '''''
+        Gain terms are the off-diagonal transitions, the loss terms on the diagonal are the sum of all transitions
+        out of a level plus the impact ionization of the level.
+        Indexing convention: impact_trans[..., from_level, to_level, step], impact_loss[..., from_level, step]
+        '''''
+        levels = impact_trans.shape[-2]
+        diagonal = numpy.arange(levels)
+        rate_terms = numpy.array(impact_trans, dtype=float)
+        rate_terms[..., diagonal, diagonal, :] = 0.
+        rate_terms[..., diagonal, diagonal, :] = - numpy.sum(rate_terms, axis=-2) - impact_loss
+        return rate_terms
+
+    @staticmethod
+    def assemble_spontaneous_terms(atomic_db):
+        levels = atomic_db.atomic_ceiling
+        photon_terms = numpy.transpose(atomic_db.spontaneous_trans[:levels, :levels]) / atomic_db.velocity
+        photon_terms[numpy.diag_indices(levels)] = - numpy.sum(atomic_db.spontaneous_trans[:, :levels], axis=0) \
+            / atomic_db.velocity
+        return photon_terms
+
     def apply_electron_density(self, step):
-        self.matrix[:, :, step] = self.beamlet_profiles['electron']['density']['m-3'][step] \
-                                  * self.electron_terms[:, :, step]
+        self.matrix[:, :, step] = self.electron_density[step] * self.electron_terms[:, :, step]
         
     def apply_ion_density(self, ion, step):
         self.matrix[:, :, step] = self.matrix[:, :, step] + \
-                                  self.beamlet_profiles['ion' + str(ion + 1)]['density']['m-3'][step] \
-                                  * self.ion_terms[ion, :, :, step]
+                                  self.ion_densities[ion, step] * self.ion_terms[ion, :, :, step]
         
     def apply_photons(self, step):
         self.matrix[:, :, step] = self.matrix[:, :, step] + self.photon_terms[:, :, step]
 
     def apply_neutral_density(self, neutral, step):
         self.matrix[:, :, step] = self.matrix[:, :, step] + \
-                                  self.beamlet_profiles['neutral'+str(neutral+1)]['density']['m-3'][step] \
-                                  * self.neutral_terms[neutral, :, :, step]
+                                  self.neutral_densities[neutral, step] * self.neutral_terms[neutral, :, :, step]
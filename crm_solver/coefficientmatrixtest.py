@@ -12,6 +12,8 @@ class CoefficientMatrixTest(unittest.TestCase):
     INPUT_z = [1, 1, 2, 2, 4]
     INPUT_a = [1, 2, 3, 4, 9]
     INPUT_m = [None, None, None, None, None]
+    INPUT_SCALING = 2.
+    INPUT_FAST_LEVELS = [2]
 
     INPUT_neutral_q = [-1, 0, 1]
     INPUT_neutral_z = [0, 1, 1]
@@ -445,6 +447,97 @@ class CoefficientMatrixTest(unittest.TestCase):
         numpy.testing.assert_almost_equal(self.neutral_rate_coefficient.neutral_terms, self.EXPECTED_NEUTRAL_TERMS,
                                           self.EXPECTED_DECIMAL_PRECISION_6, err_msg='Neutral term assembly failed.')
 
+    def test_density_update(self):
+        updated_profiles = self._scale_profiles(self.PROFILES, 'density', self.INPUT_SCALING)
+        reference = CoefficientMatrix(self.BEAMLET_PARAM, updated_profiles, self.COMPONENTS, self.ATOMIC_DB)
+        self.RATE_COEFFICIENT.update_densities(self.RATE_COEFFICIENT.electron_density * self.INPUT_SCALING,
+                                               ion_densities=self.RATE_COEFFICIENT.ion_densities * self.INPUT_SCALING)
+        numpy.testing.assert_allclose(self.RATE_COEFFICIENT.matrix, reference.matrix, rtol=1E-12,
+                                      err_msg='Density update of the coefficient matrix failed.')
+
+    def test_density_profile_update(self):
+        updated_profiles = self._scale_profiles(self.PROFILES, 'density', self.INPUT_SCALING)
+        reference = CoefficientMatrix(self.BEAMLET_PARAM, updated_profiles, self.COMPONENTS, self.ATOMIC_DB)
+        self.RATE_COEFFICIENT.interpolate_rates = lambda *args: self.fail('Rate interpolation is not expected for '
+                                                                          'unchanged temperatures.')
+        self.RATE_COEFFICIENT.update_profiles(updated_profiles, self.ATOMIC_DB)
+        numpy.testing.assert_allclose(self.RATE_COEFFICIENT.matrix, reference.matrix, rtol=1E-12,
+                                      err_msg='Density profile update of the coefficient matrix failed.')
+
+    def test_temperature_profile_update(self):
+        updated_profiles = self._scale_profiles(self.PROFILES, 'temperature', self.INPUT_SCALING)
+        reference = CoefficientMatrix(self.BEAMLET_PARAM, updated_profiles, self.COMPONENTS, self.ATOMIC_DB)
+        self.RATE_COEFFICIENT.update_profiles(updated_profiles, self.ATOMIC_DB)
+        numpy.testing.assert_allclose(self.RATE_COEFFICIENT.matrix, reference.matrix, rtol=1E-12,
+                                      err_msg='Temperature profile update of the coefficient matrix failed.')
+
+    def test_profile_update_on_different_grid(self):
+        updated_profiles = self._scale_profiles(self.PROFILES, 'distance', self.INPUT_SCALING)
+        with self.assertRaises(ValueError):
+            self.RATE_COEFFICIENT.update_profiles(updated_profiles, self.ATOMIC_DB)
+
+    def test_lean_matrix(self):
+        lean_coefficient = CoefficientMatrix(self.BEAMLET_PARAM, self.PROFILES, self.COMPONENTS, self.ATOMIC_DB,
+                                             lean=True)
+        numpy.testing.assert_array_equal(lean_coefficient.matrix, self.RATE_COEFFICIENT.matrix,
+                                         err_msg='Lean mode is expected to assemble the same coefficient matrix.')
+        numpy.testing.assert_array_equal(lean_coefficient.photon_terms, self.RATE_COEFFICIENT.photon_terms,
+                                         err_msg='Lean mode is expected to provide the same photon terms.')
+        self.assertIsNone(lean_coefficient.electron_impact_trans_np,
+                          msg='Interpolated rates are expected to be released in lean mode.')
+        self.assertLess(lean_coefficient.get_memory_footprint()['total'],
+                        self.RATE_COEFFICIENT.get_memory_footprint()['total'],
+                        msg='Lean mode is expected to reduce the memory footprint.')
+
+    def test_memory_footprint(self):
+        footprint = self.RATE_COEFFICIENT.get_memory_footprint()
+        self.assertEqual(footprint['matrix'], self.RATE_COEFFICIENT.matrix.nbytes,
+                         msg='Memory footprint of the coefficient matrix is inaccurate.')
+        self.assertEqual(footprint['total'], sum(value for key, value in footprint.items() if key != 'total'),
+                         msg='Total memory footprint is inaccurate.')
+
+    def test_lean_temperature_profile_update(self):
+        updated_profiles = self._scale_profiles(self.PROFILES, 'temperature', self.INPUT_SCALING)
+        reference = CoefficientMatrix(self.BEAMLET_PARAM, updated_profiles, self.COMPONENTS, self.ATOMIC_DB)
+        lean_coefficient = CoefficientMatrix(self.BEAMLET_PARAM, self.PROFILES, self.COMPONENTS, self.ATOMIC_DB,
+                                             lean=True)
+        lean_coefficient.update_profiles(updated_profiles, self.ATOMIC_DB)
+        numpy.testing.assert_allclose(lean_coefficient.matrix, reference.matrix, rtol=1E-12,
+                                      err_msg='Temperature profile update in lean mode failed.')
+
+    def test_quasi_steady_state_matrix(self):
+        levels = self.ATOMIC_DB.atomic_ceiling
+        reduced_matrix, fast_coupling = self.RATE_COEFFICIENT.calculate_quasi_steady_state_matrix(
+            self.INPUT_FAST_LEVELS)
+        slow_levels = [level for level in range(levels) if level not in self.INPUT_FAST_LEVELS]
+        self.assertTupleEqual(reduced_matrix.shape, (len(slow_levels), len(slow_levels),
+                                                     self.PROFILES['beamlet grid'].size))
+        for step in range(self.PROFILES['beamlet grid'].size):
+            for slow_population in numpy.identity(len(slow_levels)):
+                populations = numpy.zeros(levels)
+                populations[slow_levels] = slow_population
+                populations[self.INPUT_FAST_LEVELS] = numpy.dot(slow_population, fast_coupling[:, :, step])
+                derivatives = numpy.dot(populations, self.RATE_COEFFICIENT.matrix[:, :, step])
+                numpy.testing.assert_allclose(derivatives[self.INPUT_FAST_LEVELS], 0., atol=1E-12,
+                                              err_msg='Fast levels are expected to be in steady state.')
+                numpy.testing.assert_allclose(derivatives[slow_levels],
+                                              numpy.dot(slow_population, reduced_matrix[:, :, step]), atol=1E-12,
+                                              err_msg='Reduced matrix differs from the eliminated system.')
+
+    def test_invalid_quasi_steady_state_levels(self):
+        with self.assertRaises(ValueError):
+            self.RATE_COEFFICIENT.calculate_quasi_steady_state_matrix(list(range(self.ATOMIC_DB.atomic_ceiling)))
+        with self.assertRaises(ValueError):
+            self.RATE_COEFFICIENT.calculate_quasi_steady_state_matrix([1, 1])
+
+    @staticmethod
+    def _scale_profiles(profiles, quantity, scaling):
+        scaled_profiles = profiles.copy()
+        for column in scaled_profiles.columns:
+            if column[1] == quantity:
+                scaled_profiles[column] = scaled_profiles[column] * scaling
+        return scaled_profiles
+
     def _build_beamlet_input(self):
         input_gen = BeamletInput(energy=60, projectile='dummy', param_name='Coefficient Matrix Test',
                                  source='Unittest', current=0.001)
@@ -0,0 +1,100 @@
+import os
+import math
+import traceback
+import numpy
+import pandas
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+from crm_solver.beamlet import Beamlet
+from crm_solver.atomic_db import atomic_db_cache
+
+SUPPORTED_SOLVERS = ('numerical', 'analytical', 'adaptive')
+CHUNKS_PER_WORKER = 4
+
+
+def pack_beamlet_input(param, profiles, components):
+    '''''
+    Compact, picklable form of a beamlet input: the beamlet parameters as XML bytes, the profiles as a single array
+    and the components column by column, together with their labels.
+    '''''
+    if not isinstance(param, etree._ElementTree):
+        raise TypeError('The beamlet parameters are expected as an lxml ElementTree.')
+    if not (isinstance(profiles, pandas.DataFrame) and isinstance(components, pandas.DataFrame)):
+        raise TypeError('The beamlet profiles and components are expected as pandas DataFrames.')
+    return {'param': etree.tostring(param),
+            'profile_labels': [tuple(column) for column in profiles.columns],
+            'profile_names': list(profiles.columns.names),
+            'profiles': numpy.ascontiguousarray(profiles.values, dtype=float),
+            'component_names': list(components.index),
+            'components': {column: components[column].values for column in components.columns}}
+
+
+def unpack_beamlet_input(packed):
+    param = etree.ElementTree(etree.fromstring(packed['param']))
+    profiles = pandas.DataFrame(packed['profiles'], columns=pandas.MultiIndex.from_tuples(
+        packed['profile_labels'], names=packed['profile_names']))
+    components = pandas.DataFrame(packed['components'], index=packed['component_names'])
+    return param, profiles, components
+
+
+def solve_packed_beamlet(packed, solver='numerical', transitions=(), integrator='odeint', bundle=None):
+    '''''
+    Solves a packed beamlet input and returns its compact results. Errors are returned as the formatted traceback
+    under the error key instead of being raised. The AtomicDB is taken from the process wide atomic_db_cache, so a
+    worker process builds it only once for all its beamlets of the same species and energy, from the atomic bundle
+    if given.
+    Indexing convention: populations[step, level]
+    '''''
+    try:
+        param, profiles, components = unpack_beamlet_input(packed)
+        atomic_db = atomic_db_cache.get_atomic_db(param=param, components=components, bundle=bundle)
+        beamlet = Beamlet(param=param, profiles=profiles, components=components, atomic_db=atomic_db, solver=solver,
+                          integrator=integrator)
+        beamlet.compute_linear_density_attenuation()
+        result = {'levels': [beamlet.atomic_db.inv_atomic_dict[level]
+                             for level in range(beamlet.atomic_db.atomic_ceiling)],
+                  'populations': beamlet.checkpoints,
+                  'linear_density_attenuation': beamlet.profiles['linear_density_attenuation'].values.reshape(-1),
+                  'solver_statistics': beamlet.solver_statistics, 'error': None}
+        for from_level, to_level in transitions:
+            beamlet.compute_linear_emission_density(to_level=to_level, from_level=from_level)
+            result[from_level + '-->' + to_level] = beamlet.profiles[from_level + '-->' + to_level].values.reshape(-1)
+        return result
+    except Exception:
+        return {'error': traceback.format_exc()}
+
+
+def solve_beamlets(inputs, workers=None, chunksize=None, solver='numerical', transitions=(), integrator='odeint',
+                   mp_context=None, bundle=None):
+    '''''
+    Solves many beamlets on a process pool. Inputs are given as (param, profiles, components) in the argument order
+    of Beamlet and are dispatched in chunks of packed arrays, by default about 4 chunks per worker process.
+    Results come back in the order of the inputs as dictionaries of the level labels, the level populations, the
+    linear density attenuation, the emission density of every (from_level, to_level) transition and the solver
+    statistics. A failed beamlet does not stop the others, its result only holds the traceback under error, which is
+    None for solved beamlets. With a single worker the beamlets are solved in the calling process.
+    A SharedAtomicBundle, e.g. from publish_atomic_data, lets all worker processes read the atomic data from a single
+    shared memory copy instead of loading their own. A file backed AtomicBundle is sent by path and memory mapped.
+    The multiprocessing context is only passed to the process pool if given, it requires Python 3.7 or later.
+    '''''
+    if solver not in SUPPORTED_SOLVERS:
+        raise ValueError('The solver: ' + str(solver) + ' is not supported for parallel execution. '
+                         'Supported solvers are: ' + ', '.join(SUPPORTED_SOLVERS) + '.')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError('The number of workers is expected to be a positive integer.')
+    packed_inputs = [pack_beamlet_input(*beamlet_input) for beamlet_input in inputs]
+    worker = partial(solve_packed_beamlet, solver=solver, transitions=tuple(transitions), integrator=integrator,
+                     bundle=bundle)
+    workers = min(workers, max(len(packed_inputs), 1))
+    if workers == 1:
+        return [worker(packed) for packed in packed_inputs]
+    if chunksize is None:
+        chunksize = max(1, math.ceil(len(packed_inputs) / (CHUNKS_PER_WORKER * workers)))
+    pool_options = {'max_workers': workers}
+    if mp_context is not None:
+        pool_options['mp_context'] = mp_context
+    with ProcessPoolExecutor(**pool_options) as executor:
+        return list(executor.map(worker, packed_inputs, chunksize=chunksize))
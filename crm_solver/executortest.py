@@ -0,0 +1,121 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy
+from multiprocessing import get_context
+from crm_solver.beamlet import Beamlet
+from crm_solver.atomic_bundle import AtomicBundle, convert_to_atomic_bundle, publish_atomic_data
+from crm_solver.executor import solve_beamlets, pack_beamlet_input, unpack_beamlet_input
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+class ExecutorTest(unittest.TestCase):
+    INPUT_DENSITY_SCALES = [1., 1.5, 2.]
+    INPUT_TRANSITION = ('2p', '2s')
+    INPUT_WORKERS = 2
+    EXPECTED_PRECISION = 1E-10
+
+    def setUp(self):
+        self.beamlet = Beamlet(solver='disregard')
+        self.inputs = [self.build_input(scale) for scale in self.INPUT_DENSITY_SCALES]
+
+    def tearDown(self):
+        del self.beamlet
+
+    def build_input(self, density_scale):
+        profiles = self.beamlet._copy_profiles_input()
+        for column in profiles.columns:
+            if column[1] == 'density':
+                profiles[column] = profiles[column] * density_scale
+        return self.beamlet.param, profiles, self.beamlet.components
+
+    def test_pack_and_unpack(self):
+        param, profiles, components = unpack_beamlet_input(pack_beamlet_input(*self.inputs[0]))
+        self.assertEqual(param.getroot().find('body').find('beamlet_energy').text,
+                         self.beamlet.param.getroot().find('body').find('beamlet_energy').text)
+        self.assertTrue(profiles.equals(self.inputs[0][1]), msg='Profiles are expected to be restored.')
+        self.assertTrue(components.equals(self.beamlet.components), msg='Components are expected to be restored.')
+
+    def test_ordered_results(self):
+        results = solve_beamlets(self.inputs, workers=self.INPUT_WORKERS, chunksize=1,
+                                 transitions=[self.INPUT_TRANSITION])
+        self.assertEqual(len(results), len(self.inputs))
+        transition = self.INPUT_TRANSITION[0] + '-->' + self.INPUT_TRANSITION[1]
+        for result, (param, profiles, components) in zip(results, self.inputs):
+            self.assertIsNone(result['error'])
+            reference = Beamlet(param=param, profiles=profiles.copy(), components=components)
+            reference.compute_linear_density_attenuation()
+            reference.compute_linear_emission_density(to_level=self.INPUT_TRANSITION[1],
+                                                      from_level=self.INPUT_TRANSITION[0])
+            numpy.testing.assert_allclose(result['linear_density_attenuation'],
+                                          reference.profiles['linear_density_attenuation'].values.reshape(-1),
+                                          rtol=self.EXPECTED_PRECISION)
+            numpy.testing.assert_allclose(result[transition], reference.profiles[transition].values.reshape(-1),
+                                          rtol=self.EXPECTED_PRECISION)
+            self.assertTupleEqual(result['populations'].shape, (len(profiles), len(result['levels'])))
+
+    def test_serial_execution(self):
+        serial = solve_beamlets(self.inputs, workers=1)
+        parallel = solve_beamlets(self.inputs, workers=self.INPUT_WORKERS)
+        for serial_result, parallel_result in zip(serial, parallel):
+            numpy.testing.assert_allclose(serial_result['populations'], parallel_result['populations'],
+                                          rtol=self.EXPECTED_PRECISION)
+
+    @unittest.skipIf(shared_memory is None, 'Shared memory requires Python 3.8 or later.')
+    def test_shared_atomic_data(self):
+        body = self.beamlet.param.getroot().find('body')
+        with publish_atomic_data(body.find('beamlet_species').text, [body.find('beamlet_energy').text]) as bundle:
+            shared = solve_beamlets(self.inputs, workers=self.INPUT_WORKERS, bundle=bundle)
+        loaded = solve_beamlets(self.inputs, workers=self.INPUT_WORKERS)
+        for shared_result, loaded_result in zip(shared, loaded):
+            self.assertIsNone(shared_result['error'])
+            numpy.testing.assert_allclose(shared_result['populations'], loaded_result['populations'],
+                                          rtol=self.EXPECTED_PRECISION)
+
+    def test_file_atomic_bundle(self):
+        body = self.beamlet.param.getroot().find('body')
+        directory = tempfile.mkdtemp()
+        try:
+            bundle = convert_to_atomic_bundle(os.path.join(directory, 'atomic.bundle'),
+                                              body.find('beamlet_species').text, [body.find('beamlet_energy').text])
+            self.assertLess(len(pickle.dumps(bundle)), os.path.getsize(bundle.bundle_path) / 100.,
+                            msg='Atomic bundles are expected to be sent to the workers by path.')
+            bundled = solve_beamlets(self.inputs, workers=self.INPUT_WORKERS, bundle=bundle)
+            loaded = solve_beamlets(self.inputs, workers=self.INPUT_WORKERS)
+            for bundled_result, loaded_result in zip(bundled, loaded):
+                self.assertIsNone(bundled_result['error'])
+                numpy.testing.assert_allclose(bundled_result['populations'], loaded_result['populations'],
+                                              rtol=self.EXPECTED_PRECISION)
+        finally:
+            AtomicBundle.opened_bundles.clear()
+            shutil.rmtree(directory)
+
+    def test_process_context(self):
+        spawned = solve_beamlets(self.inputs, workers=self.INPUT_WORKERS, mp_context=get_context('spawn'))
+        forked = solve_beamlets(self.inputs, workers=self.INPUT_WORKERS)
+        for spawned_result, forked_result in zip(spawned, forked):
+            self.assertIsNone(spawned_result['error'])
+            numpy.testing.assert_allclose(spawned_result['populations'], forked_result['populations'],
+                                          rtol=self.EXPECTED_PRECISION)
+
+    def test_item_errors(self):
+        param, profiles, components = self.inputs[1]
+        inputs = [self.inputs[0], (param, profiles.drop(columns='electron', level='type'), components),
+                  self.inputs[2]]
+        results = solve_beamlets(inputs, workers=self.INPUT_WORKERS, chunksize=1)
+        self.assertIsNone(results[0]['error'])
+        self.assertIsInstance(results[1]['error'], str, msg='A failed beamlet is expected to report its error.')
+        self.assertIsNone(results[2]['error'])
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            solve_beamlets(self.inputs, workers=0)
+        with self.assertRaises(ValueError):
+            solve_beamlets(self.inputs, solver='disregard')
+        with self.assertRaises(TypeError):
+            solve_beamlets([(None, self.inputs[0][1], self.beamlet.components)])
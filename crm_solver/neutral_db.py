@@ -1,15 +1,21 @@
 import os
+import numpy
 import utility.convert as uc
 from utility.getdata import GetData
 from utility.exceptions import RenateNotValidTransitionError
+from crm_solver.atomic_bundle import AtomicBundle
 
 
 class NeutralDB(object):
-    def __init__(self, param=None, components=None, resolved=None):
+    loaded_cross_sections = {}
+
+    def __init__(self, param=None, components=None, resolved=None, bundle=None):
         self.param = param
+        self.bundle = None if bundle is None else AtomicBundle.open(bundle)
         self.__set_atomic_resolution(resolved=resolved)
         self.__load_neutral_cross_section(components=components)
         self.__get_atomic_levels()
+        self.__set_cross_section_stacks()
 
     def __set_atomic_resolution(self, resolved):
         projectile = self.param.getroot().find('body').find('beamlet_species').text
@@ -53,16 +59,50 @@ class NeutralDB(object):
             name = 'neutral'+str(index+1)
             target = self.__identify_neutral_target(component=components.T[name])
             path = self.__set_neutral_cross_section_path(target=target)
-            self.neutral_cross_sections[name] = GetData(data_path_name=path, data_format="array").data
+            self.neutral_cross_sections[name] = self.__get_cross_section(path)
+
+    def __get_cross_section(self, path):
+        key = (path, None if self.bundle is None else self.bundle.bundle_path)
+        if key not in self.loaded_cross_sections:
+            if self.bundle is None:
+                cross_section = GetData(data_path_name=path, data_format="array").data
+            else:
+                cross_section = self.bundle.get_array(path)
+            cross_section.flags.writeable = False
+            self.loaded_cross_sections[key] = cross_section
+        return self.loaded_cross_sections[key]
+
+    @classmethod
+    def release_bundle(cls, bundle_path):
+        '''''
+        Evicts the cross-sections read from the atomic bundle of the given path.
+        '''''
+        for key in [key for key in cls.loaded_cross_sections if key[1] == bundle_path]:
+            del cls.loaded_cross_sections[key]
 
     def __get_atomic_levels(self):
         for index in range(self.neutral_target_count):
             atomic_levels = self.neutral_cross_sections['neutral'+str(index+1)].shape[0]
-            if not hasattr(self, 'atomic_level'):
+            if not hasattr(self, 'atomic_levels'):
                 self.atomic_levels = atomic_levels
             elif self.atomic_levels > atomic_levels:
                 self.atomic_levels = atomic_levels
 
+    def __set_cross_section_stacks(self):
+        '''''
+        Cross-sections of all neutral targets converted to m2 and stacked up to the common atomic levels.
+        Indexing convention: neutral_impact_loss[target, from_level], neutral_impact_trans[target, from_level, to_level]
+        '''''
+        levels = getattr(self, 'atomic_levels', 0)
+        cross_sections = numpy.zeros((self.neutral_target_count, levels, levels))
+        for index in range(self.neutral_target_count):
+            cross_sections[index] = uc.convert_from_cm2_to_m2(
+                self.neutral_cross_sections['neutral'+str(index+1)][:levels, :levels])
+        diagonal = numpy.arange(levels)
+        self.neutral_impact_loss = cross_sections[:, diagonal, diagonal].copy()
+        cross_sections[:, diagonal, diagonal] = 0.
+        self.neutral_impact_trans = cross_sections
+
     def get_neutral_impact_loss(self, target, from_level):
         return uc.convert_from_cm2_to_m2(self.neutral_cross_sections[target][from_level, from_level])
 
@@ -107,3 +107,37 @@ class NeutralDBTest(unittest.TestCase):
             val = actual_db.get_neutral_impact_transition(target=self.EXPECTED_KEY_NAME_1,
                                                           from_level=self.INPUT_FROM_LEVELS,
                                                           to_level=self.INPUT_FROM_LEVELS)
+
+    def test_cross_section_stacks(self):
+        self.input.add_target_component(charge=self.INPUT_H[0], atomic_number=self.INPUT_H[1],
+                                        mass_number=self.INPUT_H[2], molecule_name=self.INPUT_H[3])
+        self.input.add_target_component(charge=self.INPUT_H2[0], atomic_number=self.INPUT_H2[1],
+                                        mass_number=self.INPUT_H2[2], molecule_name=self.INPUT_H2[3])
+        actual_param, actual_components = self.input.get_atomic_db_input()
+        actual_db = NeutralDB(param=actual_param, components=actual_components, resolved=self.INPUT_TEST)
+        self.assertTupleEqual(actual_db.neutral_impact_trans.shape, (self.EXPECTED_KEY_2,
+                              self.EXPECTED_TEST_ATOMIC_LEVELS, self.EXPECTED_TEST_ATOMIC_LEVELS),
+                              msg='Stacked neutral transition cross-sections are dimensionally not accurate.')
+        for index, target in enumerate(self.EXPECTED_KEY_NAME_2):
+            for from_level in range(actual_db.atomic_levels):
+                self.assertEqual(actual_db.neutral_impact_loss[index, from_level],
+                                 actual_db.get_neutral_impact_loss(target=target, from_level=from_level),
+                                 msg='Stacked neutral loss cross-sections do not match the getter.')
+                self.assertEqual(actual_db.neutral_impact_trans[index, from_level, from_level], 0.,
+                                 msg='Stacked neutral transition cross-sections are expected to be off-diagonal.')
+                for to_level in range(actual_db.atomic_levels):
+                    if to_level != from_level:
+                        self.assertEqual(actual_db.neutral_impact_trans[index, from_level, to_level],
+                                         actual_db.get_neutral_impact_transition(target=target, from_level=from_level,
+                                                                                 to_level=to_level),
+                                         msg='Stacked neutral transition cross-sections do not match the getter.')
+
+    def test_cross_section_cache(self):
+        self.input.add_target_component(charge=self.INPUT_H[0], atomic_number=self.INPUT_H[1],
+                                        mass_number=self.INPUT_H[2], molecule_name=self.INPUT_H[3])
+        actual_param, actual_components = self.input.get_atomic_db_input()
+        first_db = NeutralDB(param=actual_param, components=actual_components, resolved=self.INPUT_TEST)
+        second_db = NeutralDB(param=actual_param, components=actual_components, resolved=self.INPUT_TEST)
+        self.assertIs(first_db.neutral_cross_sections[self.EXPECTED_KEY_NAME_1],
+                      second_db.neutral_cross_sections[self.EXPECTED_KEY_NAME_1],
+                      msg='Loaded cross-section files are expected to be shared between NeutralDB instances.')
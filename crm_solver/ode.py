@@ -1,6 +1,11 @@
 import numpy
-from scipy.integrate import odeint
+from scipy.integrate import odeint, solve_ivp
 from scipy.interpolate import interp1d
+from scipy.sparse import csc_matrix
+
+STIFF_METHODS = ('LSODA', 'BDF', 'Radau')
+BATCH_STIFF_METHODS = ('BDF', 'Radau')
+PADE_COEFFICIENTS = (1., 1. / 2., 5. / 44., 1. / 66., 1. / 792., 1. / 15840., 1. / 665280.)
 
 
 class Ode:
@@ -8,6 +13,10 @@ class Ode:
         self.coeff_matrix = coeff_matrix
         self.init_condition = init_condition
         self.__validate_parameters()
+        self.grid = None
+        self.grid_matrices = None
+        self.grid_slopes = None
+        self.solver_statistics = None
 
     def __validate_parameters(self):
         self.__validate(self.coeff_matrix)
@@ -32,22 +41,234 @@ class Ode:
             matrix_temp2 = 0
         return matrix_temp1 != matrix_temp2
 
-    def calculate_numerical_solution(self, steps):
-        return odeint(func=self.set_derivative_vector, y0=self.init_condition, t=steps, args=(self.coeff_matrix, steps))
+    def calculate_numerical_solution(self, steps, interpolation='interp1d', method='odeint', rtol=None, atol=None):
+        assert isinstance(interpolation, str)
+        assert isinstance(method, str)
+        if method == 'odeint':
+            return self.__calculate_odeint_solution(steps, interpolation, rtol, atol)
+        elif method in STIFF_METHODS:
+            if interpolation != 'piecewise_linear':
+                raise ValueError('The solve_ivp methods: ' + ', '.join(STIFF_METHODS) + ' are only supported with '
+                                 'piecewise_linear interpolation.')
+            return self.__calculate_stiff_solution(steps, method, rtol, atol)
+        else:
+            raise ValueError('The integration method: ' + method + ' is not supported. '
+                             'Supported methods are: odeint, ' + ', '.join(STIFF_METHODS) + '.')
+
+    def __calculate_odeint_solution(self, steps, interpolation, rtol, atol):
+        if interpolation == 'interp1d':
+            solution, info = odeint(func=self.set_derivative_vector, y0=self.init_condition, t=steps,
+                                    args=(self.coeff_matrix, steps), rtol=rtol, atol=atol, full_output=True)
+        elif interpolation == 'piecewise_linear':
+            self.set_piecewise_linear_coefficients(steps)
+            solution, info = odeint(func=self.set_precomputed_derivative_vector, y0=self.init_condition, t=steps,
+                                    Dfun=self.set_precomputed_jacobian, rtol=rtol, atol=atol, full_output=True)
+        else:
+            raise ValueError('The coefficient interpolation: ' + interpolation + ' is not supported. '
+                             'Supported interpolations are: interp1d, piecewise_linear.')
+        self.solver_statistics = {'method': 'odeint', 'nfev': int(info['nfe'][-1]), 'njev': int(info['nje'][-1]),
+                                  'message': info['message']}
+        return solution
+
+    def __calculate_stiff_solution(self, steps, method, rtol, atol):
+        self.set_piecewise_linear_coefficients(steps)
+        tolerances = {}
+        if rtol is not None:
+            tolerances['rtol'] = rtol
+        if atol is not None:
+            tolerances['atol'] = atol
+        result = solve_ivp(fun=self.set_precomputed_derivative_vector_ivp, t_span=(self.grid[0], self.grid[-1]),
+                           y0=numpy.asarray(self.init_condition, dtype=float), method=method, t_eval=self.grid,
+                           jac=self.set_precomputed_jacobian_ivp, **tolerances)
+        if not result.success:
+            raise ValueError('Integration with method ' + method + ' failed: ' + result.message)
+        self.solver_statistics = {'method': method, 'nfev': result.nfev, 'njev': result.njev, 'nlu': result.nlu,
+                                  'message': result.message}
+        return numpy.swapaxes(result.y, 0, 1)
+
+    def set_piecewise_linear_coefficients(self, steps):
+        '''''
+        Precomputes the grid matrices and the segment slopes of the coefficient matrix once per grid,
+        so that a local matrix evaluation costs O(L^2) instead of rebuilding an interpolator over (L, L, N).
+        Indexing convention: grid_matrices[step, from_level, to_level], grid_slopes[segment, from_level, to_level]
+        '''''
+        steps = numpy.asarray(steps, dtype=float)
+        if self.grid is not None and numpy.array_equal(self.grid, steps):
+            return
+        if self.coeff_matrix.ndim == 3:
+            if self.coeff_matrix.shape[2] != steps.size:
+                raise ValueError('The coefficient matrix is defined on ' + str(self.coeff_matrix.shape[2]) +
+                                 ' grid points, while ' + str(steps.size) + ' steps were given.')
+            if steps.size < 2:
+                raise ValueError('Piecewise linear interpolation requires at least two grid points.')
+            self.grid = steps
+            self.grid_matrices = numpy.ascontiguousarray(numpy.moveaxis(self.coeff_matrix, 2, 0), dtype=float)
+            self.grid_slopes = numpy.diff(self.grid_matrices, axis=0) / numpy.diff(steps)[:, None, None]
+        elif self.coeff_matrix.ndim == 2:
+            self.grid = steps
+            self.grid_matrices = numpy.asarray(self.coeff_matrix, dtype=float)[None, :, :]
+            self.grid_slopes = None
+        else:
+            raise ValueError('Rate Coefficient Matrix of dimensions: ' + str(self.coeff_matrix.ndim) +
+                             ' is not supported')
+
+    def get_precomputed_coefficient_matrix(self, actual_position):
+        if self.grid_slopes is None:
+            return self.grid_matrices[0]
+        segment = numpy.searchsorted(self.grid, actual_position, side='right') - 1
+        segment = min(max(segment, 0), self.grid_slopes.shape[0] - 1)
+        return self.grid_matrices[segment] + self.grid_slopes[segment] * (actual_position - self.grid[segment])
+
+    def set_precomputed_derivative_vector(self, variable_vector, actual_position):
+        return numpy.dot(variable_vector, self.get_precomputed_coefficient_matrix(actual_position))
+
+    def set_precomputed_jacobian(self, variable_vector, actual_position):
+        '''''
+        The system is linear in the populations, hence the Jacobian: d(derivative_i)/d(variable_j) = matrix[j, i]
+        '''''
+        return numpy.transpose(self.get_precomputed_coefficient_matrix(actual_position))
+
+    def set_precomputed_derivative_vector_ivp(self, actual_position, variable_vector):
+        return self.set_precomputed_derivative_vector(variable_vector, actual_position)
+
+    def set_precomputed_jacobian_ivp(self, actual_position, variable_vector):
+        return self.set_precomputed_jacobian(variable_vector, actual_position)
 
     def calculate_analytical_solution(self, steps):
+        if self.coeff_matrix.ndim == 3:
+            return self.__calculate_propagated_solution(steps)
         eigenvalues, eigenvectors = numpy.linalg.eig(self.coeff_matrix)
-        if self.init_condition.size == 1:
+        if numpy.asarray(self.init_condition).size == 1:
             return self.__calculate_analytical_solution_1d(steps, eigenvalues)
         else:
-            return self.__calculate_analytical_solution_else(steps, eigenvalues, eigenvectors)
+            return self.__calculate_analytical_solution_else(steps)
 
-    def __calculate_analytical_solution_else(self, steps, eigenvalues, eigenvectors):
-        analytical_solution = numpy.zeros((steps.size, self.init_condition.size))
-        temporal_constant = numpy.dot(numpy.dot(numpy.linalg.inv(eigenvectors), self.init_condition), eigenvectors)
-        for step in range(steps.size):
-            analytical_solution[step, :] = self.calculate_exp_solution(temporal_constant, eigenvalues, steps[step])
-        return analytical_solution
+    def __calculate_analytical_solution_else(self, steps):
+        steps = numpy.asarray(steps, dtype=float)
+        propagators = self.calculate_matrix_exponentials(numpy.tensordot(steps - steps[0], self.coeff_matrix,
+                                                                         axes=0))
+        return numpy.einsum('i,nij->nj', numpy.asarray(self.init_condition, dtype=float), propagators)
+
+    def __calculate_propagated_solution(self, steps):
+        '''''
+        Treats the coefficient matrix as constant on each grid segment, taking the mean of the segment end matrices,
+        and advances the populations with the matrix exponential of every segment. Exponentials are evaluated
+        for all segments at once, the propagation itself costs O(N*L^2).
+        '''''
+        steps = numpy.asarray(steps, dtype=float)
+        if self.coeff_matrix.shape[2] != steps.size:
+            raise ValueError('The coefficient matrix is defined on ' + str(self.coeff_matrix.shape[2]) +
+                             ' grid points, while ' + str(steps.size) + ' steps were given.')
+        grid_matrices = numpy.moveaxis(self.coeff_matrix, 2, 0)
+        segment_matrices = (grid_matrices[:-1] + grid_matrices[1:]) / 2. * numpy.diff(steps)[:, None, None]
+        propagators = self.calculate_matrix_exponentials(segment_matrices)
+        solution = numpy.zeros((steps.size, grid_matrices.shape[1]))
+        solution[0, :] = self.init_condition
+        for step in range(propagators.shape[0]):
+            solution[step + 1, :] = numpy.dot(solution[step, :], propagators[step])
+        return solution
+
+    def calculate_fundamental_solution(self, steps, method='odeint', rtol=None, atol=None):
+        '''''
+        Fundamental solution matrix of the system, row i holds the solution for a unit initial condition on level i.
+        The solution for any initial condition is: init_condition @ fundamental[step]
+        Indexing convention: fundamental[step, init_level, level]
+        '''''
+        assert isinstance(method, str)
+        steps = numpy.asarray(steps, dtype=float)
+        coeff_matrix = numpy.asarray(self.coeff_matrix, dtype=float)
+        if coeff_matrix.ndim == 2:
+            coeff_matrix = numpy.repeat(coeff_matrix[:, :, numpy.newaxis], steps.size, axis=2)
+        levels = coeff_matrix.shape[0]
+        if coeff_matrix.shape[2] != steps.size:
+            raise ValueError('The coefficient matrix is defined on ' + str(coeff_matrix.shape[2]) +
+                             ' grid points, while ' + str(steps.size) + ' steps were given.')
+        if method == 'analytical':
+            grid_matrices = numpy.moveaxis(coeff_matrix, 2, 0)
+            propagators = self.calculate_matrix_exponentials((grid_matrices[:-1] + grid_matrices[1:]) / 2. *
+                                                             numpy.diff(steps)[:, None, None])
+            solution = numpy.zeros((steps.size, levels, levels))
+            solution[0] = numpy.identity(levels)
+            for step in range(propagators.shape[0]):
+                solution[step + 1] = numpy.dot(solution[step], propagators[step])
+            return solution
+        batch = BatchOde(numpy.broadcast_to(coeff_matrix, (levels,) + coeff_matrix.shape), numpy.identity(levels))
+        solution = batch.calculate_numerical_solution(steps, method=method, rtol=rtol, atol=atol)
+        self.solver_statistics = batch.solver_statistics
+        return numpy.swapaxes(solution, 0, 1)
+
+    def calculate_nodal_sensitivity(self, steps, nodal_derivatives, weights=None):
+        '''''
+        Linear response of the propagated solution (see calculate_analytical_solution) to parameters acting on single
+        grid points, i.e. the coefficient matrix at grid point j depends on parameter j as given by
+        nodal_derivatives[:, :, j]. The Frechet derivatives of the segment exponentials are the off-diagonal blocks of
+        the exponentials of the block matrices [[A, dA], [0, A]]. The derivatives are those of the segment mean
+        propagator, not of the numerical solution.
+        Only the response of the outputs = numpy.dot(solution, weights) is stored, weights of shape (level, output)
+        default to the identity, i.e. the response of every level.
+        Indexing convention: sensitivity[step, node, output] = d(output[step]) / d(parameter[node])
+        '''''
+        steps = numpy.asarray(steps, dtype=float)
+        coeff_matrix = numpy.asarray(self.coeff_matrix, dtype=float)
+        if coeff_matrix.ndim == 2:
+            coeff_matrix = numpy.repeat(coeff_matrix[:, :, numpy.newaxis], steps.size, axis=2)
+        nodal_derivatives = numpy.asarray(nodal_derivatives, dtype=float)
+        if coeff_matrix.shape[2] != steps.size or nodal_derivatives.shape != coeff_matrix.shape:
+            raise ValueError('The coefficient matrix and its nodal derivatives are expected to be defined on all ' +
+                             str(steps.size) + ' grid points.')
+        levels = coeff_matrix.shape[0]
+        weights = numpy.identity(levels) if weights is None else numpy.asarray(weights, dtype=float)
+        if weights.ndim != 2 or weights.shape[0] != levels:
+            raise ValueError('The output weights are expected in (level, output) shape for ' + str(levels) +
+                             ' levels.')
+        widths = numpy.diff(steps)[:, None, None]
+        grid_matrices = numpy.moveaxis(coeff_matrix, 2, 0)
+        grid_derivatives = numpy.moveaxis(nodal_derivatives, 2, 0) * 0.5
+        blocks = numpy.zeros((2, steps.size - 1, 2 * levels, 2 * levels))
+        blocks[:, :, :levels, :levels] = (grid_matrices[:-1] + grid_matrices[1:]) / 2. * widths
+        blocks[:, :, levels:, levels:] = blocks[:, :, :levels, :levels]
+        blocks[0, :, :levels, levels:] = grid_derivatives[:-1] * widths
+        blocks[1, :, :levels, levels:] = grid_derivatives[1:] * widths
+        exponentials = self.calculate_matrix_exponentials(blocks.reshape((-1,) + blocks.shape[2:])).\
+            reshape(blocks.shape)
+        propagators = exponentials[0, :, :levels, :levels]
+        populations = numpy.array(self.init_condition, dtype=float)
+        # Level sensitivities of the current step only, indexing convention: state[node, level]
+        state = numpy.zeros((steps.size, levels))
+        sensitivity = numpy.zeros((steps.size, steps.size, weights.shape[1]))
+        for step in range(steps.size - 1):
+            state[:step + 1] = numpy.dot(state[:step + 1], propagators[step])
+            state[step] += numpy.dot(populations, exponentials[0, step, :levels, levels:])
+            state[step + 1] += numpy.dot(populations, exponentials[1, step, :levels, levels:])
+            populations = numpy.dot(populations, propagators[step])
+            sensitivity[step + 1, :step + 2] = numpy.dot(state[:step + 2], weights)
+        return sensitivity
+
+    @staticmethod
+    def calculate_matrix_exponentials(matrices):
+        '''''
+        Matrix exponential of a stack of square matrices of shape (N, L, L), using the scaling and squaring method
+        with a diagonal (6, 6) Pade approximant.
+        '''''
+        matrices = numpy.asarray(matrices, dtype=float)
+        norms = numpy.max(numpy.sum(numpy.abs(matrices), axis=-2), axis=-1)
+        squarings = numpy.zeros(norms.shape, dtype=int)
+        large = norms > 0.5
+        squarings[large] = numpy.ceil(numpy.log2(norms[large] / 0.5)).astype(int)
+        scaled = matrices / (2. ** squarings)[..., None, None]
+        identity = numpy.broadcast_to(numpy.eye(matrices.shape[-1]), matrices.shape)
+        numerator = PADE_COEFFICIENTS[0] * identity
+        denominator = PADE_COEFFICIENTS[0] * identity
+        power = identity
+        for order in range(1, len(PADE_COEFFICIENTS)):
+            power = numpy.matmul(power, scaled)
+            numerator = numerator + PADE_COEFFICIENTS[order] * power
+            denominator = denominator + (-1) ** order * PADE_COEFFICIENTS[order] * power
+        exponentials = numpy.linalg.solve(denominator, numerator)
+        for squaring in range(int(numpy.max(squarings)) if squarings.size > 0 else 0):
+            selection = squarings > squaring
+            exponentials[selection] = numpy.matmul(exponentials[selection], exponentials[selection])
+        return exponentials
 
     def __calculate_analytical_solution_1d(self, steps, eigenvalues):
         analytical_solution = numpy.zeros(steps.size)
@@ -68,3 +289,121 @@ class Ode:
     @staticmethod
     def calculate_exp_solution(init, coefficient, variable):
         return init * numpy.exp(coefficient * variable)
+
+
+class BatchOde:
+    '''''
+    Integrates a batch of beamlet systems sharing a common grid at once.
+    Indexing convention: coeff_matrices[beamlet, from_level, to_level, step], init_conditions[beamlet, level]
+    The solutions are returned as: solution[beamlet, step, level]
+    '''''
+    def __init__(self, coeff_matrices, init_conditions):
+        if coeff_matrices is None or init_conditions is None:
+            raise ValueError('Try to define BatchOde class with null matrix.')
+        self.coeff_matrices = numpy.asarray(coeff_matrices, dtype=float)
+        self.init_conditions = numpy.asarray(init_conditions, dtype=float)
+        self.__validate_parameters()
+        self.batch_size, self.levels = self.init_conditions.shape
+        self.grid = None
+        self.grid_matrices = None
+        self.grid_slopes = None
+        self.solver_statistics = None
+
+    def __validate_parameters(self):
+        if self.coeff_matrices.ndim != 4:
+            raise ValueError('Batched rate coefficient matrices are expected in (beamlet, level, level, step) shape.')
+        if self.coeff_matrices.shape[1] != self.coeff_matrices.shape[2]:
+            raise ValueError("The matrix must be squared")
+        if self.init_conditions.shape != self.coeff_matrices.shape[:2]:
+            raise ValueError('Initial conditions are expected in (beamlet, level) shape, matching the matrices.')
+
+    def set_piecewise_linear_coefficients(self, steps):
+        steps = numpy.asarray(steps, dtype=float)
+        if self.grid is not None and numpy.array_equal(self.grid, steps):
+            return
+        if self.coeff_matrices.shape[3] != steps.size:
+            raise ValueError('The coefficient matrices are defined on ' + str(self.coeff_matrices.shape[3]) +
+                             ' grid points, while ' + str(steps.size) + ' steps were given.')
+        if steps.size < 2:
+            raise ValueError('Piecewise linear interpolation requires at least two grid points.')
+        self.grid = steps
+        self.grid_matrices = numpy.ascontiguousarray(numpy.moveaxis(self.coeff_matrices, 3, 0))
+        self.grid_slopes = numpy.diff(self.grid_matrices, axis=0) / numpy.diff(steps)[:, None, None, None]
+        self.__set_jacobian_structure()
+
+    def __set_jacobian_structure(self):
+        from_level, to_level = numpy.meshgrid(numpy.arange(self.levels), numpy.arange(self.levels), indexing='ij')
+        offsets = (numpy.arange(self.batch_size) * self.levels)[:, None, None]
+        self.jacobian_rows = (offsets + to_level[None, :, :]).ravel()
+        self.jacobian_columns = (offsets + from_level[None, :, :]).ravel()
+        self.band_rows = numpy.broadcast_to(self.levels - 1 + to_level - from_level,
+                                            (self.batch_size, self.levels, self.levels)).ravel()
+
+    def get_precomputed_coefficient_matrices(self, actual_position):
+        segment = numpy.searchsorted(self.grid, actual_position, side='right') - 1
+        segment = min(max(segment, 0), self.grid_slopes.shape[0] - 1)
+        return self.grid_matrices[segment] + self.grid_slopes[segment] * (actual_position - self.grid[segment])
+
+    def set_precomputed_derivative_vector(self, variable_vector, actual_position):
+        populations = numpy.reshape(variable_vector, (self.batch_size, self.levels))
+        return numpy.einsum('bi,bij->bj', populations,
+                            self.get_precomputed_coefficient_matrices(actual_position)).ravel()
+
+    def set_precomputed_banded_jacobian(self, variable_vector, actual_position):
+        '''''
+        The Jacobian is block diagonal with one (L, L) block per beamlet, it is handed to odeint in banded storage.
+        '''''
+        banded = numpy.zeros((2 * self.levels - 1, self.batch_size * self.levels))
+        banded[self.band_rows, self.jacobian_columns] = \
+            self.get_precomputed_coefficient_matrices(actual_position).ravel()
+        return banded
+
+    def set_precomputed_derivative_vector_ivp(self, actual_position, variable_vector):
+        return self.set_precomputed_derivative_vector(variable_vector, actual_position)
+
+    def set_precomputed_sparse_jacobian_ivp(self, actual_position, variable_vector):
+        size = self.batch_size * self.levels
+        return csc_matrix((self.get_precomputed_coefficient_matrices(actual_position).ravel(),
+                           (self.jacobian_rows, self.jacobian_columns)), shape=(size, size))
+
+    def calculate_numerical_solution(self, steps, method='odeint', rtol=None, atol=None):
+        assert isinstance(method, str)
+        self.set_piecewise_linear_coefficients(steps)
+        if method == 'odeint':
+            solution, info = odeint(func=self.set_precomputed_derivative_vector, y0=self.init_conditions.ravel(),
+                                    t=self.grid, Dfun=self.set_precomputed_banded_jacobian, ml=self.levels - 1,
+                                    mu=self.levels - 1, rtol=rtol, atol=atol, full_output=True)
+            self.solver_statistics = {'method': method, 'nfev': int(info['nfe'][-1]),
+                                      'njev': int(info['nje'][-1]), 'message': info['message']}
+        elif method in BATCH_STIFF_METHODS:
+            tolerances = {}
+            if rtol is not None:
+                tolerances['rtol'] = rtol
+            if atol is not None:
+                tolerances['atol'] = atol
+            result = solve_ivp(fun=self.set_precomputed_derivative_vector_ivp, t_span=(self.grid[0], self.grid[-1]),
+                               y0=self.init_conditions.ravel(), method=method, t_eval=self.grid,
+                               jac=self.set_precomputed_sparse_jacobian_ivp, **tolerances)
+            if not result.success:
+                raise ValueError('Integration with method ' + method + ' failed: ' + result.message)
+            self.solver_statistics = {'method': method, 'nfev': result.nfev, 'njev': result.njev,
+                                      'nlu': result.nlu, 'message': result.message}
+            solution = numpy.swapaxes(result.y, 0, 1)
+        else:
+            raise ValueError('The batched integration method: ' + method + ' is not supported. '
+                             'Supported methods are: odeint, ' + ', '.join(BATCH_STIFF_METHODS) + '.')
+        return numpy.swapaxes(numpy.reshape(solution, (self.grid.size, self.batch_size, self.levels)), 0, 1)
+
+    def calculate_analytical_solution(self, steps):
+        steps = numpy.asarray(steps, dtype=float)
+        if self.coeff_matrices.shape[3] != steps.size:
+            raise ValueError('The coefficient matrices are defined on ' + str(self.coeff_matrices.shape[3]) +
+                             ' grid points, while ' + str(steps.size) + ' steps were given.')
+        grid_matrices = numpy.moveaxis(self.coeff_matrices, 3, 0)
+        segment_matrices = (grid_matrices[:-1] + grid_matrices[1:]) / 2. * numpy.diff(steps)[:, None, None, None]
+        propagators = Ode.calculate_matrix_exponentials(segment_matrices)
+        solution = numpy.zeros((steps.size, self.batch_size, self.levels))
+        solution[0] = self.init_conditions
+        for step in range(propagators.shape[0]):
+            solution[step + 1] = numpy.einsum('bi,bij->bj', solution[step], propagators[step])
+        return numpy.swapaxes(solution, 0, 1)
@@ -0,0 +1,83 @@
+import time
+import numpy
+from crm_solver.ode import Ode, BatchOde
+
+
+def build_coefficient_matrix(levels, grid_size, seed=1):
+    random = numpy.random.RandomState(seed)
+    grid = numpy.linspace(0., 0.3, grid_size)
+    transitions = random.uniform(0.1, 1., (levels, levels, 1)) * (1. + numpy.sin(grid * 20.))[None, None, :]
+    matrix = transitions.copy()
+    for level in range(levels):
+        matrix[level, level, :] = - numpy.sum(transitions[level, :, :], axis=0)
+    return grid, matrix * 10.
+
+
+def benchmark_interpolation(grid_sizes=(500, 1000, 2000, 5000), levels=9, repeat=1):
+    print('Grid size \t interp1d [s] \t piecewise_linear [s] \t speed-up \t max. rel. deviation')
+    results = []
+    for grid_size in grid_sizes:
+        grid, matrix = build_coefficient_matrix(levels, grid_size)
+        init_condition = numpy.zeros(levels)
+        init_condition[0] = 1.
+        timings = {}
+        solutions = {}
+        for interpolation in ['interp1d', 'piecewise_linear']:
+            start = time.perf_counter()
+            for run in range(repeat):
+                ode = Ode(coeff_matrix=matrix, init_condition=init_condition)
+                solutions[interpolation] = ode.calculate_numerical_solution(grid, interpolation=interpolation)
+            timings[interpolation] = (time.perf_counter() - start) / repeat
+        deviation = numpy.max(numpy.abs(solutions['piecewise_linear'] - solutions['interp1d']) /
+                              numpy.maximum(numpy.abs(solutions['interp1d']), 1e-30))
+        speed_up = timings['interp1d'] / timings['piecewise_linear']
+        print('%d \t %.4f \t %.4f \t %.1f \t %.2e' % (grid_size, timings['interp1d'],
+                                                     timings['piecewise_linear'], speed_up, deviation))
+        results.append((grid_size, timings['interp1d'], timings['piecewise_linear'], deviation))
+    return results
+
+
+def benchmark_methods(grid_size=2000, levels=9, stiffness=1e4, methods=('odeint', 'LSODA', 'BDF', 'Radau')):
+    grid, matrix = build_coefficient_matrix(levels, grid_size)
+    matrix[-1, -1, :] -= stiffness
+    init_condition = numpy.zeros(levels)
+    init_condition[0] = 1.
+    print('Method \t time [s] \t nfev \t njev')
+    results = []
+    for method in methods:
+        ode = Ode(coeff_matrix=matrix, init_condition=init_condition)
+        start = time.perf_counter()
+        ode.calculate_numerical_solution(grid, interpolation='piecewise_linear', method=method)
+        timing = time.perf_counter() - start
+        print('%s \t %.4f \t %d \t %d' % (method, timing, ode.solver_statistics['nfev'],
+                                           ode.solver_statistics['njev']))
+        results.append((method, timing, ode.solver_statistics))
+    return results
+
+
+def benchmark_batch(batch_sizes=(10, 100, 300), grid_size=500, levels=9):
+    print('Batch size \t individual [s] \t batched [s] \t speed-up')
+    results = []
+    for batch_size in batch_sizes:
+        coeff_matrices = numpy.zeros((batch_size, levels, levels, grid_size))
+        for beamlet in range(batch_size):
+            grid, coeff_matrices[beamlet] = build_coefficient_matrix(levels, grid_size, seed=beamlet)
+        init_conditions = numpy.zeros((batch_size, levels))
+        init_conditions[:, 0] = 1.
+        start = time.perf_counter()
+        for beamlet in range(batch_size):
+            ode = Ode(coeff_matrix=coeff_matrices[beamlet], init_condition=init_conditions[beamlet])
+            ode.calculate_numerical_solution(grid, interpolation='piecewise_linear')
+        individual = time.perf_counter() - start
+        start = time.perf_counter()
+        BatchOde(coeff_matrices=coeff_matrices, init_conditions=init_conditions).calculate_numerical_solution(grid)
+        batched = time.perf_counter() - start
+        print('%d \t %.4f \t %.4f \t %.1f' % (batch_size, individual, batched, individual / batched))
+        results.append((batch_size, individual, batched))
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_interpolation()
+    benchmark_methods()
+    benchmark_batch()
@@ -3,13 +3,14 @@ import unittest
 import numpy
 import numpy.testing as npt
 
-from crm_solver.ode import Ode
+from crm_solver.ode import Ode, BatchOde
 
 
 class OdeTest(unittest.TestCase):
 
     # General setup
     DECIMALS_2 = 2
+    DECIMALS_4 = 4
     DECIMALS_6 = 6
     START_INTERVAL = 0
     END_INTERVAL = 0.1
@@ -53,6 +54,11 @@ class OdeTest(unittest.TestCase):
                                                        [2.82871194, -0.36454059],
                                                        [3.0456828, -0.85070421]])
     EXPECTED_DERIVATIVE_VARYING_NONDIAGONAL = numpy.array([2, 4])
+    REFINEMENT = 100
+    INPUT_STIFF_METHODS = ['LSODA', 'BDF', 'Radau']
+    INPUT_TOLERANCE = 1E-10
+    FINITE_DIFFERENCE = 1E-6
+    POSITIONS_VARYING_NONDIAGONAL = numpy.array([-0.05, 0., 0.05, 0.1, 0.17, 0.3, 0.35])
 
     COEFF_MATRIX_CHANGING = numpy.tensordot(COEFF_MATRIX_CONSTANT_DIAGONAL, STEPS, axes=0)
 
@@ -164,7 +170,6 @@ class OdeTest(unittest.TestCase):
             self.assertIn(type(actual[-1, index]), self.ACCEPTED_TYPES)
             self.assertAlmostEqual(actual[-1, index], self.EXPECTED_RESULT_CONSTANT_NONDIAGONAL[index], self.DECIMALS_6)
 
-    @unittest.skip('Analytical solver for constant non-diagonal case.')
     def test_calculate_analytical_solution_for_constant_nondiagonal_case(self):
         ode = Ode(coeff_matrix=self.COEFF_MATRIX_CONSTANT_NONDIAGONAL,
                   init_condition=self.INIT_CONDITION_CONSTANT_NONDIAGONAL)
@@ -212,6 +217,160 @@ class OdeTest(unittest.TestCase):
             for j in range(self.INIT_CONDITION_VARYING_NONDIAGONAL.size):
                 self.assertIn(type(actual[i, j]), self.ACCEPTED_TYPES)
 
+    def test_set_precomputed_derivative_vector_for_varying_nondiagonal(self):
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+        ode.set_piecewise_linear_coefficients(self.STEPS_VARYING_NONDIAGONAL)
+        for position in self.POSITIONS_VARYING_NONDIAGONAL:
+            expected = ode.set_derivative_vector(variable_vector=self.INIT_CONDITION_VARYING_NONDIAGONAL,
+                                                 actual_position=position,
+                                                 coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                                                 steps=self.STEPS_VARYING_NONDIAGONAL)
+            actual = ode.set_precomputed_derivative_vector(variable_vector=self.INIT_CONDITION_VARYING_NONDIAGONAL,
+                                                           actual_position=position)
+            npt.assert_almost_equal(actual, expected, self.DECIMALS_6)
+
+    def test_piecewise_linear_solution_for_varying_nondiagonal_case(self):
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+        actual = ode.calculate_numerical_solution(self.STEPS_VARYING_NONDIAGONAL, interpolation='piecewise_linear')
+        self.assertEqual(actual.shape,
+                         (self.STEPS_VARYING_NONDIAGONAL.size, self.INIT_CONDITION_VARYING_NONDIAGONAL.size))
+        npt.assert_almost_equal(actual, self.EXPECTED_RESULT_VARYING_NONDIAGONAL, self.DECIMALS_6)
+
+    def test_piecewise_linear_solution_for_constant_nondiagonal_case(self):
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_CONSTANT_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_CONSTANT_NONDIAGONAL)
+        actual = ode.calculate_numerical_solution(self.STEPS, interpolation='piecewise_linear')
+        npt.assert_almost_equal(actual[-1, :], self.EXPECTED_RESULT_CONSTANT_NONDIAGONAL, self.DECIMALS_6)
+
+    def test_precomputed_jacobian_for_varying_nondiagonal(self):
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+        ode.set_piecewise_linear_coefficients(self.STEPS_VARYING_NONDIAGONAL)
+        actual = ode.set_precomputed_jacobian(variable_vector=self.INIT_CONDITION_VARYING_NONDIAGONAL,
+                                              actual_position=self.STEPS_VARYING_NONDIAGONAL[1])
+        npt.assert_almost_equal(actual, self.COEFF_MATRIX_VARYING_NONDIAGONAL[:, :, 1].T, self.DECIMALS_6)
+
+    def test_stiff_methods_for_varying_nondiagonal_case(self):
+        for method in self.INPUT_STIFF_METHODS:
+            ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                      init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+            actual = ode.calculate_numerical_solution(self.STEPS_VARYING_NONDIAGONAL, interpolation='piecewise_linear',
+                                                      method=method, rtol=self.INPUT_TOLERANCE,
+                                                      atol=self.INPUT_TOLERANCE)
+            self.assertEqual(actual.shape,
+                             (self.STEPS_VARYING_NONDIAGONAL.size, self.INIT_CONDITION_VARYING_NONDIAGONAL.size))
+            npt.assert_almost_equal(actual, self.EXPECTED_RESULT_VARYING_NONDIAGONAL, self.DECIMALS_6)
+            self.assertEqual(ode.solver_statistics['method'], method)
+            self.assertGreater(ode.solver_statistics['nfev'], 0)
+            self.assertIn('njev', ode.solver_statistics)
+
+    def test_solver_statistics_for_odeint(self):
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+        ode.calculate_numerical_solution(self.STEPS_VARYING_NONDIAGONAL, interpolation='piecewise_linear')
+        self.assertEqual(ode.solver_statistics['method'], 'odeint')
+        self.assertGreater(ode.solver_statistics['nfev'], 0)
+
+    def test_not_supported_stiff_interpolation(self):
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+        with self.assertRaises(ValueError):
+            ode.calculate_numerical_solution(self.STEPS_VARYING_NONDIAGONAL, interpolation='interp1d', method='BDF')
+        with self.assertRaises(ValueError):
+            ode.calculate_numerical_solution(self.STEPS_VARYING_NONDIAGONAL, method='not-supported')
+
+    def test_not_supported_interpolation(self):
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+        with self.assertRaises(ValueError):
+            ode.calculate_numerical_solution(self.STEPS_VARYING_NONDIAGONAL, interpolation='not-supported')
+
+    def test_propagated_solution_for_refined_varying_nondiagonal_case(self):
+        refined_steps = numpy.linspace(self.STEPS_VARYING_NONDIAGONAL[0], self.STEPS_VARYING_NONDIAGONAL[-1],
+                                       self.REFINEMENT * (self.STEPS_VARYING_NONDIAGONAL.size - 1) + 1)
+        refined_matrix = numpy.zeros(self.COEFF_MATRIX_VARYING_NONDIAGONAL.shape[:2] + refined_steps.shape)
+        for from_level in range(refined_matrix.shape[0]):
+            for to_level in range(refined_matrix.shape[1]):
+                refined_matrix[from_level, to_level, :] = numpy.interp(
+                    refined_steps, self.STEPS_VARYING_NONDIAGONAL,
+                    self.COEFF_MATRIX_VARYING_NONDIAGONAL[from_level, to_level, :])
+        ode = Ode(coeff_matrix=refined_matrix, init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+        actual = ode.calculate_analytical_solution(refined_steps)
+        self.assertEqual(actual.shape, (refined_steps.size, self.INIT_CONDITION_VARYING_NONDIAGONAL.size))
+        npt.assert_almost_equal(actual[::self.REFINEMENT, :], self.EXPECTED_RESULT_VARYING_NONDIAGONAL,
+                                self.DECIMALS_4)
+
+    def test_matrix_exponentials_for_constant_diagonal_case(self):
+        actual = Ode.calculate_matrix_exponentials(numpy.tensordot(self.STEPS, self.COEFF_MATRIX_CONSTANT_DIAGONAL,
+                                                                   axes=0))
+        self.assertEqual(actual.shape, (self.STEP_NUMBER, self.INIT_CONDITION_GENERAL.size,
+                                        self.INIT_CONDITION_GENERAL.size))
+        for i in range(self.STEP_NUMBER):
+            npt.assert_almost_equal(actual[i], numpy.diag(numpy.exp(numpy.diag(self.COEFF_MATRIX_CONSTANT_DIAGONAL)
+                                                                    * self.STEPS[i])), self.DECIMALS_6)
+
+    def test_fundamental_solution_for_varying_nondiagonal_case(self):
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+        actual = ode.calculate_fundamental_solution(self.STEPS_VARYING_NONDIAGONAL, rtol=self.INPUT_TOLERANCE,
+                                                    atol=self.INPUT_TOLERANCE)
+        levels = self.INIT_CONDITION_VARYING_NONDIAGONAL.size
+        self.assertEqual(actual.shape, (self.STEPS_VARYING_NONDIAGONAL.size, levels, levels))
+        for level in range(levels):
+            unit_ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                           init_condition=numpy.identity(levels)[level])
+            expected = unit_ode.calculate_numerical_solution(self.STEPS_VARYING_NONDIAGONAL,
+                                                             rtol=self.INPUT_TOLERANCE, atol=self.INPUT_TOLERANCE)
+            npt.assert_almost_equal(actual[:, level, :], expected, self.DECIMALS_6)
+        npt.assert_almost_equal(numpy.einsum('i,nij->nj', self.INIT_CONDITION_VARYING_NONDIAGONAL, actual),
+                                self.EXPECTED_RESULT_VARYING_NONDIAGONAL, self.DECIMALS_4)
+
+    def test_analytical_fundamental_solution_for_constant_nondiagonal_case(self):
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_CONSTANT_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_CONSTANT_NONDIAGONAL)
+        actual = ode.calculate_fundamental_solution(self.STEPS, method='analytical')
+        expected = Ode.calculate_matrix_exponentials(numpy.tensordot(self.STEPS - self.STEPS[0],
+                                                                     self.COEFF_MATRIX_CONSTANT_NONDIAGONAL, axes=0))
+        npt.assert_almost_equal(actual, expected, self.DECIMALS_6)
+
+    def test_fundamental_solution_for_grid_mismatch(self):
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+        with self.assertRaises(ValueError):
+            ode.calculate_fundamental_solution(self.STEPS)
+
+    def test_nodal_sensitivity_for_varying_nondiagonal_case(self):
+        nodal_derivatives = numpy.tensordot(numpy.array([[-1., 0.5], [0.2, -2.]]),
+                                            numpy.arange(1., self.STEPS_VARYING_NONDIAGONAL.size + 1), axes=0)
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+        actual = ode.calculate_nodal_sensitivity(self.STEPS_VARYING_NONDIAGONAL, nodal_derivatives)
+        self.assertEqual(actual.shape, (self.STEPS_VARYING_NONDIAGONAL.size, self.STEPS_VARYING_NONDIAGONAL.size,
+                                        self.INIT_CONDITION_VARYING_NONDIAGONAL.size))
+        for node in range(self.STEPS_VARYING_NONDIAGONAL.size):
+            perturbation = numpy.zeros(nodal_derivatives.shape)
+            perturbation[:, :, node] = self.FINITE_DIFFERENCE * nodal_derivatives[:, :, node]
+            solutions = [Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL + sign * perturbation,
+                             init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL).
+                         calculate_analytical_solution(self.STEPS_VARYING_NONDIAGONAL) for sign in (1., -1.)]
+            npt.assert_almost_equal(actual[:, node, :], (solutions[0] - solutions[1]) / (2. * self.FINITE_DIFFERENCE),
+                                    self.DECIMALS_6)
+
+    def test_weighted_nodal_sensitivity(self):
+        nodal_derivatives = numpy.tensordot(numpy.array([[-1., 0.5], [0.2, -2.]]),
+                                            numpy.ones(self.STEPS_VARYING_NONDIAGONAL.size), axes=0)
+        weights = numpy.array([[1.], [2.]])
+        ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                  init_condition=self.INIT_CONDITION_VARYING_NONDIAGONAL)
+        expected = numpy.dot(ode.calculate_nodal_sensitivity(self.STEPS_VARYING_NONDIAGONAL, nodal_derivatives),
+                             weights)
+        actual = ode.calculate_nodal_sensitivity(self.STEPS_VARYING_NONDIAGONAL, nodal_derivatives, weights)
+        npt.assert_allclose(actual, expected, rtol=1E-12, atol=1E-15)
+        with self.assertRaises(ValueError):
+            ode.calculate_nodal_sensitivity(self.STEPS_VARYING_NONDIAGONAL, nodal_derivatives, numpy.ones(2))
+
     @unittest.skip('Analytical solver for varying non-diagonal case.')
     def test_calculate_analytical_solution_for_varying_nondiagonal_case(self):
         ode = Ode(coeff_matrix=self.COEFF_MATRIX_VARYING_NONDIAGONAL,
@@ -236,5 +395,58 @@ class OdeTest(unittest.TestCase):
         npt.assert_almost_equal(numerical, analytical, self.DECIMALS_6)
 
 
+class BatchOdeTest(unittest.TestCase):
+
+    DECIMALS_6 = 6
+    INPUT_SCALING = numpy.array([0.5, 1., 2.])
+    INPUT_METHODS = ['odeint', 'BDF', 'Radau']
+    INPUT_TOLERANCE = 1E-10
+
+    def setUp(self):
+        self.steps = OdeTest.STEPS_VARYING_NONDIAGONAL
+        self.coeff_matrices = numpy.array([scaling * OdeTest.COEFF_MATRIX_VARYING_NONDIAGONAL
+                                           for scaling in self.INPUT_SCALING])
+        self.init_conditions = numpy.array([scaling * OdeTest.INIT_CONDITION_VARYING_NONDIAGONAL
+                                            for scaling in self.INPUT_SCALING])
+
+    def _get_individual_solutions(self):
+        solutions = []
+        for index in range(self.INPUT_SCALING.size):
+            ode = Ode(coeff_matrix=self.coeff_matrices[index], init_condition=self.init_conditions[index])
+            solutions.append(ode.calculate_numerical_solution(self.steps, interpolation='piecewise_linear',
+                                                              rtol=self.INPUT_TOLERANCE, atol=self.INPUT_TOLERANCE))
+        return numpy.array(solutions)
+
+    def test_dimension_error(self):
+        with self.assertRaises(ValueError):
+            BatchOde(coeff_matrices=OdeTest.COEFF_MATRIX_VARYING_NONDIAGONAL,
+                     init_conditions=OdeTest.INIT_CONDITION_VARYING_NONDIAGONAL)
+        with self.assertRaises(ValueError):
+            BatchOde(coeff_matrices=self.coeff_matrices, init_conditions=self.init_conditions[:-1])
+
+    def test_batched_numerical_solution(self):
+        expected = self._get_individual_solutions()
+        for method in self.INPUT_METHODS:
+            batch = BatchOde(coeff_matrices=self.coeff_matrices, init_conditions=self.init_conditions)
+            actual = batch.calculate_numerical_solution(self.steps, method=method, rtol=self.INPUT_TOLERANCE,
+                                                        atol=self.INPUT_TOLERANCE)
+            self.assertTupleEqual(actual.shape, (self.INPUT_SCALING.size, self.steps.size,
+                                                 OdeTest.INIT_CONDITION_VARYING_NONDIAGONAL.size))
+            npt.assert_almost_equal(actual, expected, self.DECIMALS_6)
+            self.assertEqual(batch.solver_statistics['method'], method)
+
+    def test_batched_analytical_solution(self):
+        batch = BatchOde(coeff_matrices=self.coeff_matrices, init_conditions=self.init_conditions)
+        actual = batch.calculate_analytical_solution(self.steps)
+        for index in range(self.INPUT_SCALING.size):
+            ode = Ode(coeff_matrix=self.coeff_matrices[index], init_condition=self.init_conditions[index])
+            npt.assert_almost_equal(actual[index], ode.calculate_analytical_solution(self.steps), self.DECIMALS_6)
+
+    def test_not_supported_method(self):
+        batch = BatchOde(coeff_matrices=self.coeff_matrices, init_conditions=self.init_conditions)
+        with self.assertRaises(ValueError):
+            batch.calculate_numerical_solution(self.steps, method='not-supported')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -51,6 +51,8 @@ class GetData(AccessData):
             if self.data_path_name.endswith('.h5'):
                 if self.data_format == "pandas":
                     self.read_h5_to_pandas()
+                elif self.data_format == "dict":
+                    self.read_h5_to_dict()
                 else:
                     self.read_h5_to_array()
             elif self.data_path_name.endswith('.txt'):
@@ -91,7 +93,7 @@ class GetData(AccessData):
                 hdf5_group = hdf5_id
                 for key in self.data_key:
                     hdf5_group = hdf5_group[key]
-                self.data = hdf5_group.value
+                self.data = hdf5_group[()]
                 hdf5_id.close()
             print("Data read to array from HD5 file: " + self.access_path + " with key: " + str(self.data_key))
         except ValueError:
@@ -101,6 +103,30 @@ class GetData(AccessData):
             print("Data could NOT be read to array from HD5 file: " + self.access_path +
                   " with key: " + str(self.data_key) + '. Check if the key sequence fits the groups of the HDF5 file!')
 
+    def read_h5_to_dict(self):
+        """
+        Reads all datasets of the HDF5 file (or of the group given by self.data_key) while opening the file once.
+        Keys of the resulting dictionary are the dataset paths relative to the group, e.g. 'group/dataset'.
+        """
+        self.data = {}
+        try:
+            with h5py.File(self.access_path, 'r') as hdf5_id:
+                hdf5_group = hdf5_id
+                for key in self.data_key:
+                    hdf5_group = hdf5_group[key]
+                hdf5_group.visititems(self.__read_h5_dataset)
+            print("Data read to dictionary from HD5 file: " + self.access_path + " with key: " + str(self.data_key))
+        except ValueError:
+            print("Data could NOT be read to dictionary from HD5 file: " + self.access_path +
+                  " with key: " + str(self.data_key))
+        except AttributeError:
+            print("Data could NOT be read to dictionary from HD5 file: " + self.access_path +
+                  " with key: " + str(self.data_key) + '. Check if the key sequence fits the groups of the HDF5 file!')
+
+    def __read_h5_dataset(self, name, node):
+        if isinstance(node, h5py.Dataset):
+            self.data[name] = node[()]
+
     def read_txt_to_str(self):
         with open(self.access_path, 'r') as file:
             self.data = file.read()